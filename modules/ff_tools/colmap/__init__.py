@@ -1,2 +1,10 @@
 from . import database
-from . import utils
\ No newline at end of file
+from . import utils
+from . import reconstruction
+from . import match_graph
+from . import projection
+from . import undistort
+from . import image_index
+from . import pair_generation
+from . import ingest
+from . import alignment
\ No newline at end of file
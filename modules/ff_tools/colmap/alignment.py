@@ -0,0 +1,154 @@
+# Blender Tools
+# Copyright 2024 Ralph Wiedemeier, Frame Factory GmbH
+# License: MIT
+
+from dataclasses import dataclass, field
+from typing import Optional
+
+import numpy as np
+
+from .reconstruction import Reconstruction
+from .utils import rotmat2qvec
+
+
+POINT_CHUNK_SIZE = 1 << 20
+
+
+@dataclass
+class Sim3:
+    """Similarity transform x' = scale * rotation @ x + translation."""
+    scale: float = 1.0
+    rotation: np.ndarray = field(default_factory=lambda: np.eye(3))
+    translation: np.ndarray = field(default_factory=lambda: np.zeros(3))
+
+    def matrix(self) -> np.ndarray:
+        """Returns the transform as 4x4 matrix, e.g. for Blender's matrix_world."""
+        matrix = np.eye(4)
+        matrix[:3, :3] = self.scale * self.rotation
+        matrix[:3, 3] = self.translation
+        return matrix
+
+    @classmethod
+    def from_matrix(cls, matrix: np.ndarray) -> "Sim3":
+        """Creates the transform from a 4x4 matrix with uniform scale."""
+        matrix = np.asarray(matrix, dtype=np.float64)
+        scale = np.cbrt(np.linalg.det(matrix[:3, :3]))
+        return cls(float(scale), matrix[:3, :3] / scale, matrix[:3, 3].copy())
+
+    def inverse(self) -> "Sim3":
+        rotation = self.rotation.T
+        return Sim3(1.0 / self.scale, rotation, -rotation @ self.translation / self.scale)
+
+    def __matmul__(self, other: "Sim3") -> "Sim3":
+        """Returns the transform applying other first, then self."""
+        return Sim3(self.scale * other.scale, self.rotation @ other.rotation,
+                    self.scale * self.rotation @ other.translation + self.translation)
+
+    def transform_points(self, points: np.ndarray) -> np.ndarray:
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        return points @ (self.scale * self.rotation).T + self.translation
+
+
+def umeyama(src: np.ndarray, dst: np.ndarray, estimate_scale: bool = True) -> Sim3:
+    """
+    Estimates the similarity transform mapping the (N, 3) points src to the
+    corresponding points dst in the least squares sense (Umeyama, 1991).
+    Without estimate_scale, the result is the rigid Procrustes solution.
+    """
+    src = np.asarray(src, dtype=np.float64).reshape(-1, 3)
+    dst = np.asarray(dst, dtype=np.float64).reshape(-1, 3)
+    if len(src) != len(dst):
+        raise ValueError("src and dst must have the same number of points")
+    if len(src) < 3:
+        raise ValueError("at least 3 point correspondences required")
+
+    src_mean = src.mean(axis=0)
+    dst_mean = dst.mean(axis=0)
+    src_centered = src - src_mean
+    dst_centered = dst - dst_mean
+
+    covariance = dst_centered.T @ src_centered / len(src)
+    U, S, Vt = np.linalg.svd(covariance)
+
+    # avoid reflections
+    D = np.ones(3)
+    if np.linalg.det(U) * np.linalg.det(Vt) < 0:
+        D[2] = -1.0
+
+    rotation = (U * D) @ Vt
+    if estimate_scale:
+        src_variance = np.mean(np.sum(src_centered * src_centered, axis=1))
+        scale = float(np.sum(S * D) / src_variance)
+    else:
+        scale = 1.0
+
+    translation = dst_mean - scale * rotation @ src_mean
+    return Sim3(scale, rotation, translation)
+
+
+def align_camera_centers(
+    reconstruction: Reconstruction,
+    target_centers: np.ndarray,
+    image_ids: Optional[np.ndarray] = None,
+    estimate_scale: bool = True,
+) -> tuple[Sim3, np.ndarray]:
+    """
+    Estimates the similarity transform aligning the camera centers of the given
+    images (default: all images, in row order) to the target centers. Returns the
+    transform and the residual distance of each image.
+    """
+    rec = reconstruction
+    centers = rec.camera_centers()
+    if image_ids is not None:
+        centers = centers[rec.image_index.rows(image_ids)]
+
+    target_centers = np.asarray(target_centers, dtype=np.float64).reshape(-1, 3)
+    sim3 = umeyama(centers, target_centers, estimate_scale)
+    residuals = np.linalg.norm(sim3.transform_points(centers) - target_centers, axis=1)
+    return sim3, residuals
+
+
+def _quaternion_multiply(q1: np.ndarray, q2: np.ndarray) -> np.ndarray:
+    """Multiplies (N, 4) or (4,) quaternions in (w, x, y, z) order."""
+    w1, x1, y1, z1 = np.moveaxis(q1, -1, 0)
+    w2, x2, y2, z2 = np.moveaxis(q2, -1, 0)
+    return np.stack([
+        w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2,
+        w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+        w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2,
+        w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2,
+    ], axis=-1)
+
+
+def transform_reconstruction(reconstruction: Reconstruction, sim3: Sim3):
+    """
+    Applies the similarity transform to all image poses and 3D points of the
+    reconstruction in place. The world-to-camera pose (R, t) of each image
+    becomes (R @ S^T, scale * t - R @ S^T @ translation), where S is the
+    rotation of the transform. Points are transformed in chunks to bound
+    the size of temporary arrays.
+    """
+    rec = reconstruction
+    rotation = np.asarray(sim3.rotation, dtype=np.float64)
+    translation = np.asarray(sim3.translation, dtype=np.float64)
+
+    # rotate the image poses by the inverse rotation, as quaternions
+    inverse_qvec = rotmat2qvec(rotation) * np.array([1.0, -1.0, -1.0, -1.0])
+    qvecs = _quaternion_multiply(rec.qvecs, inverse_qvec)
+    qvecs /= np.linalg.norm(qvecs, axis=1, keepdims=True)
+    rec.qvecs[:] = qvecs
+
+    # t' = scale * t - R' @ translation
+    rotated_translation = rec.rotmats() @ translation
+    rec.tvecs *= sim3.scale
+    rec.tvecs -= rotated_translation
+
+    if rec.points3D is not None:
+        xyz = rec.points3D.xyz
+        if not xyz.flags.writeable or xyz.dtype != np.float64:
+            xyz = rec.points3D.xyz = np.array(xyz, dtype=np.float64)
+        transform = (sim3.scale * rotation).T
+        for start in range(0, len(xyz), POINT_CHUNK_SIZE):
+            chunk = xyz[start:start + POINT_CHUNK_SIZE]
+            chunk[:] = chunk @ transform
+            chunk += translation
@@ -0,0 +1,400 @@
+# Blender Tools
+# Copyright 2024 Ralph Wiedemeier, Frame Factory GmbH
+# License: MIT
+
+"""
+Benchmarks for the readers, writers and database insert paths of the colmap
+package on synthetic data. Run from the modules directory, e.g.
+
+    python -m ff_tools.colmap.benchmark --scales 1000 10000 --output results.json
+
+Results are written as JSON, with one record per measurement containing the
+name, scale (number of images), duration, throughput and peak memory.
+"""
+
+from pathlib import Path
+from typing import Callable, Optional
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from .database import COLMAPDatabase
+from .image_index import ImagesBinaryIndex
+from .match_graph import MatchGraph
+from .reconstruction import Reconstruction
+from .utils import (
+    CAMERA_MODEL_NAMES,
+    Points3D,
+    read_cameras_binary,
+    read_cameras_text,
+    read_images_binary,
+    read_images_binary_mmap,
+    read_images_text,
+    read_images_text_chunked,
+    read_points3D_binary,
+    read_points3D_text,
+    write_cameras_binary,
+    write_cameras_text,
+    write_points3D_binary,
+    write_points3D_text,
+    _read_images_binary_arrays,
+    _write_images_binary_arrays,
+    _write_images_text_arrays,
+)
+
+
+def synthetic_reconstruction(
+    num_images: int,
+    points_per_image: int = 200,
+    track_length: int = 4,
+    num_cameras: Optional[int] = None,
+    seed: int = 0,
+) -> Reconstruction:
+    """
+    Creates a random reconstruction with SIMPLE_RADIAL cameras, random poses and
+    points_per_image 2D points per image, about 90% of which observe one of the
+    3D points. The tracks of the 3D points are consistent with the observations.
+    """
+    rng = np.random.default_rng(seed)
+    num_cameras = num_cameras or max(num_images // 100, 1)
+    num_points2D = num_images * points_per_image
+    num_points3D = max(num_points2D // track_length, 1)
+    width, height = 1920, 1080
+
+    camera_params = np.empty((num_cameras, 4))
+    camera_params[:, 0] = rng.uniform(1000, 2000, num_cameras)
+    camera_params[:, 1:3] = (width / 2, height / 2)
+    camera_params[:, 3] = rng.normal(0, 0.01, num_cameras)
+
+    qvecs = rng.normal(size=(num_images, 4))
+    qvecs /= np.linalg.norm(qvecs, axis=1, keepdims=True)
+    qvecs *= np.where(qvecs[:, :1] < 0, -1.0, 1.0)
+
+    point2D_offsets = np.arange(num_images + 1, dtype=np.int64) * points_per_image
+    xys = rng.uniform((0, 0), (width, height), (num_points2D, 2))
+    point3D_ids = rng.integers(1, num_points3D + 1, num_points2D)
+    point3D_ids[rng.random(num_points2D) < 0.1] = -1
+
+    # tracks from the observations, grouped by 3D point
+    observations = np.flatnonzero(point3D_ids >= 0)
+    observations = observations[np.argsort(point3D_ids[observations], kind="stable")]
+    track_offsets = np.zeros(num_points3D + 1, dtype=np.int64)
+    np.cumsum(np.bincount(point3D_ids[observations] - 1, minlength=num_points3D),
+              out=track_offsets[1:])
+    image_rows = observations // points_per_image
+
+    points3D = Points3D(
+        ids=np.arange(1, num_points3D + 1, dtype=np.int64),
+        xyz=rng.normal(0, 10, (num_points3D, 3)),
+        rgb=rng.integers(0, 256, (num_points3D, 3), dtype=np.uint8),
+        error=rng.uniform(0, 2, num_points3D),
+        track_offsets=track_offsets,
+        track_image_ids=(image_rows + 1).astype(np.uint32),
+        track_point2D_idxs=(observations % points_per_image).astype(np.uint32))
+
+    return Reconstruction(
+        camera_ids=np.arange(1, num_cameras + 1),
+        camera_model_ids=np.full(num_cameras, CAMERA_MODEL_NAMES["SIMPLE_RADIAL"].model_id),
+        camera_widths=np.full(num_cameras, width),
+        camera_heights=np.full(num_cameras, height),
+        camera_params=list(camera_params),
+        image_ids=np.arange(1, num_images + 1),
+        qvecs=qvecs,
+        tvecs=rng.normal(0, 10, (num_images, 3)),
+        image_camera_ids=rng.integers(1, num_cameras + 1, num_images),
+        names=[f"image_{i:07d}.jpg" for i in range(num_images)],
+        point2D_offsets=point2D_offsets,
+        xys=xys,
+        point3D_ids=point3D_ids,
+        points3D=points3D,
+    )
+
+
+class FeaturePool:
+    """Pre-generated random keypoints, descriptors and matches, cycled through
+    when filling databases so that timings don't include random generation."""
+
+    def __init__(self, num_keypoints: int = 256, num_matches: int = 64, size: int = 32, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        self.keypoints = [
+            rng.uniform(0, 1920, (num_keypoints, 4)).astype(np.float32) for _ in range(size)]
+        self.descriptors = [
+            rng.integers(0, 256, (num_keypoints, 128), dtype=np.uint8) for _ in range(size)]
+        self.matches = [
+            rng.integers(0, num_keypoints, (num_matches, 2)).astype(np.uint32) for _ in range(size)]
+
+    def keypoint_items(self, image_ids):
+        return [(image_id, self.keypoints[i % len(self.keypoints)]) for i, image_id in enumerate(image_ids)]
+
+    def descriptor_items(self, image_ids):
+        return [(image_id, self.descriptors[i % len(self.descriptors)]) for i, image_id in enumerate(image_ids)]
+
+    def match_items(self, image_ids, pairs_per_image: int):
+        """Pairs each image with the next pairs_per_image images."""
+        num_images = len(image_ids)
+        return [
+            (image_ids[i], image_ids[i + offset], self.matches[(i + offset) % len(self.matches)])
+            for i in range(num_images) for offset in range(1, pairs_per_image + 1)
+            if i + offset < num_images]
+
+
+def create_database(path: Path, reconstruction: Reconstruction) -> COLMAPDatabase:
+    """Creates a database with the cameras and images of the reconstruction."""
+    rec = reconstruction
+    db = COLMAPDatabase.connect(path)
+    db.create_tables()
+    with db.import_session():
+        for row, camera_id in enumerate(rec.camera_ids.tolist()):
+            camera = rec.camera_at(row)
+            db.add_camera(CAMERA_MODEL_NAMES[camera.model].model_id, camera.width,
+                          camera.height, camera.params, camera_id=camera_id)
+        db.executemany(
+            "INSERT INTO images (image_id, name, camera_id) VALUES (?, ?, ?)",
+            zip(rec.image_ids.tolist(), rec.names, rec.image_camera_ids.tolist()))
+    return db
+
+
+class Benchmark:
+    """Runs measurements and collects their results."""
+
+    def __init__(self, trace_memory: bool = True):
+        self.trace_memory = trace_memory
+        self.results = []
+
+    def measure(self, name: str, scale: int, fn: Callable, num_items: int, num_bytes=None):
+        """Runs fn once and records duration, throughput and peak memory. num_items
+        and num_bytes are the amount of work done, for throughput figures. num_bytes
+        may be a callable evaluated after the run, e.g. for the size of a written file."""
+        if self.trace_memory:
+            tracemalloc.start()
+            tracemalloc.reset_peak()
+
+        start = time.perf_counter()
+        fn()
+        seconds = time.perf_counter() - start
+
+        peak_memory = None
+        if self.trace_memory:
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        if callable(num_bytes):
+            num_bytes = num_bytes()
+
+        result = dict(
+            name=name,
+            scale=scale,
+            seconds=seconds,
+            items=num_items,
+            items_per_second=num_items / seconds if seconds > 0 else None,
+            bytes=num_bytes,
+            mb_per_second=num_bytes / seconds / 2**20 if num_bytes and seconds > 0 else None,
+            peak_memory_mb=peak_memory / 2**20 if peak_memory is not None else None,
+        )
+        self.results.append(result)
+        print(f"{name:<36} {scale:>8} {seconds:>10.4f}s"
+              + (f" {result['mb_per_second']:>10.1f} MB/s" if result["mb_per_second"] else "")
+              + (f" {result['peak_memory_mb']:>10.1f} MB peak" if peak_memory is not None else ""),
+              file=sys.stderr)
+        return result
+
+
+def benchmark_model(bench: Benchmark, workdir: Path, rec: Reconstruction, legacy_max_images: int):
+    """Times the writers and readers of binary and text models."""
+    scale = rec.num_images
+    num_points2D = len(rec.point3D_ids)
+    cameras, images = rec.to_dicts(images=scale <= legacy_max_images)
+    image_arrays = rec.image_arrays()
+
+    for ext in (".bin", ".txt"):
+        model_dir = workdir / f"model{ext}"
+        model_dir.mkdir(exist_ok=True)
+        cameras_path = model_dir / f"cameras{ext}"
+        images_path = model_dir / f"images{ext}"
+        points3D_path = model_dir / f"points3D{ext}"
+        binary = ext == ".bin"
+        kind = "binary" if binary else "text"
+
+        write_cameras = write_cameras_binary if binary else write_cameras_text
+        write_images = _write_images_binary_arrays if binary else _write_images_text_arrays
+        write_points3D = write_points3D_binary if binary else write_points3D_text
+
+        bench.measure(f"write_cameras_{kind}", scale,
+                      lambda: write_cameras(cameras, cameras_path), rec.num_cameras,
+                      lambda: cameras_path.stat().st_size)
+        bench.measure(f"write_images_{kind}", scale,
+                      lambda: write_images(image_arrays, images_path), num_points2D,
+                      lambda: images_path.stat().st_size)
+        bench.measure(f"write_points3D_{kind}", scale,
+                      lambda: write_points3D(rec.points3D, points3D_path), len(rec.points3D),
+                      lambda: points3D_path.stat().st_size)
+
+        images_size = images_path.stat().st_size
+        points3D_size = points3D_path.stat().st_size
+        if binary:
+            bench.measure("read_cameras_binary", scale,
+                          lambda: read_cameras_binary(cameras_path), rec.num_cameras)
+            bench.measure("read_images_binary_mmap", scale,
+                          lambda: read_images_binary_mmap(images_path), num_points2D, images_size)
+            bench.measure("read_images_binary_arrays", scale,
+                          lambda: _read_images_binary_arrays(images_path), num_points2D, images_size)
+            bench.measure("read_points3D_binary", scale,
+                          lambda: read_points3D_binary(points3D_path), len(rec.points3D), points3D_size)
+            bench.measure("images_binary_index_build", scale,
+                          lambda: ImagesBinaryIndex(images_path, rebuild=True), scale, images_size)
+            if scale <= legacy_max_images:
+                bench.measure("read_images_binary", scale,
+                              lambda: read_images_binary(images_path), num_points2D, images_size)
+        else:
+            bench.measure("read_cameras_text", scale,
+                          lambda: read_cameras_text(cameras_path), rec.num_cameras)
+            bench.measure("read_images_text_chunked", scale,
+                          lambda: read_images_text_chunked(images_path), num_points2D, images_size)
+            bench.measure("read_points3D_text", scale,
+                          lambda: read_points3D_text(points3D_path), len(rec.points3D), points3D_size)
+            if scale <= legacy_max_images:
+                bench.measure("read_images_text", scale,
+                              lambda: read_images_text(images_path), num_points2D, images_size)
+
+        bench.measure(f"reconstruction_read_{kind}", scale,
+                      lambda: Reconstruction.read(model_dir, ext), num_points2D,
+                      images_size + points3D_size)
+
+
+def benchmark_database(
+    bench: Benchmark,
+    workdir: Path,
+    rec: Reconstruction,
+    pool: FeaturePool,
+    pairs_per_image: int,
+    legacy_max_images: int,
+):
+    """Times the insert paths and readers of the database."""
+    scale = rec.num_images
+    image_ids = rec.image_ids.tolist()
+    keypoint_items = pool.keypoint_items(image_ids)
+    descriptor_items = pool.descriptor_items(image_ids)
+    match_items = pool.match_items(image_ids, pairs_per_image)
+    keypoint_bytes = sum(item[1].nbytes for item in keypoint_items)
+    descriptor_bytes = sum(item[1].nbytes for item in descriptor_items)
+    match_bytes = sum(item[2].nbytes for item in match_items)
+
+    # single inserts in one implicit transaction, as in example_usage
+    if scale <= legacy_max_images:
+        db = create_database(workdir / "single.db", rec)
+
+        def add_single():
+            for item in keypoint_items:
+                db.add_keypoints(*item)
+            db.commit()
+
+        bench.measure("add_keypoints", scale, add_single, len(keypoint_items), keypoint_bytes)
+        db.close()
+
+    db = create_database(workdir / "batch.db", rec)
+    bench.measure("add_keypoints_batch", scale,
+                  lambda: db.add_keypoints_batch(keypoint_items), len(keypoint_items), keypoint_bytes)
+    bench.measure("add_descriptors_batch", scale,
+                  lambda: db.add_descriptors_batch(descriptor_items), len(descriptor_items), descriptor_bytes)
+    bench.measure("add_matches_batch", scale,
+                  lambda: db.add_matches_batch(match_items), len(match_items), match_bytes)
+
+    def add_two_view_geometries():
+        with db.import_session():
+            db.add_two_view_geometries_batch(match_items)
+
+    bench.measure("add_two_view_geometries_session", scale,
+                  add_two_view_geometries, len(match_items), match_bytes)
+
+    def iterate(iterator):
+        for _ in iterator:
+            pass
+
+    bench.measure("iter_keypoints", scale,
+                  lambda: iterate(db.iter_keypoints()), len(keypoint_items), keypoint_bytes)
+    bench.measure("iter_descriptors", scale,
+                  lambda: iterate(db.iter_descriptors()), len(descriptor_items), descriptor_bytes)
+    bench.measure("iter_matches", scale,
+                  lambda: iterate(db.iter_matches()), len(match_items), match_bytes)
+
+    rng = np.random.default_rng(0)
+    lookups = rng.choice(image_ids, min(len(image_ids), 10000), replace=False).tolist()
+    bench.measure("get_keypoints_random", scale,
+                  lambda: [db.get_keypoints(image_id) for image_id in lookups], len(lookups))
+    bench.measure("match_graph_from_database", scale,
+                  lambda: MatchGraph.from_database(db, table="matches"), len(match_items))
+    db.close()
+
+    db = create_database(workdir / "store.db", rec)
+    db.enable_descriptor_store()
+    bench.measure("add_descriptors_batch_store", scale,
+                  lambda: db.add_descriptors_batch(descriptor_items), len(descriptor_items), descriptor_bytes)
+    bench.measure("iter_descriptors_store", scale,
+                  lambda: iterate(db.iter_descriptors()), len(descriptor_items), descriptor_bytes)
+    db.disable_descriptor_store()
+    db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scales", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="numbers of images to benchmark")
+    parser.add_argument("--points_per_image", type=int, default=200)
+    parser.add_argument("--keypoints", type=int, default=256,
+                        help="number of keypoints per image in the database")
+    parser.add_argument("--matches", type=int, default=64,
+                        help="number of matches per image pair")
+    parser.add_argument("--pairs_per_image", type=int, default=5)
+    parser.add_argument("--legacy_max_images", type=int, default=10000,
+                        help="largest scale at which the per-record readers and inserts are timed")
+    parser.add_argument("--skip", choices=["model", "database"], nargs="*", default=[])
+    parser.add_argument("--no_memory", action="store_true",
+                        help="don't trace peak memory, which slows down Python code")
+    parser.add_argument("--workdir", default=None,
+                        help="directory for the generated files (default: temporary)")
+    parser.add_argument("--output", default=None, help="JSON output file (default: stdout)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    bench = Benchmark(trace_memory=not args.no_memory)
+    pool = FeaturePool(args.keypoints, args.matches, seed=args.seed)
+
+    for scale in args.scales:
+        workdir = Path(tempfile.mkdtemp(prefix=f"colmap_benchmark_{scale}_", dir=args.workdir))
+        try:
+            rec = synthetic_reconstruction(scale, args.points_per_image, seed=args.seed)
+            if "model" not in args.skip:
+                benchmark_model(bench, workdir, rec, args.legacy_max_images)
+            if "database" not in args.skip:
+                benchmark_database(bench, workdir, rec, pool, args.pairs_per_image,
+                                   args.legacy_max_images)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = dict(
+        environment=dict(
+            python=platform.python_version(),
+            numpy=np.__version__,
+            platform=platform.platform(),
+            cpu_count=os.cpu_count(),
+        ),
+        config=vars(args),
+        results=bench.results,
+    )
+
+    if args.output:
+        with open(args.output, "w") as fid:
+            json.dump(report, fid, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -33,8 +33,14 @@
 
 import sys
 import sqlite3
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
 import numpy as np
 
+from .descriptor_store import (
+    REFERENCE_STRUCT, DescriptorStore, descriptor_reference,
+    parse_descriptor_reference)
+
 
 IS_PYTHON3 = sys.version_info[0] >= 3
 
@@ -120,22 +126,99 @@ def image_ids_to_pair_id(image_id1, image_id2):
 
 def pair_id_to_image_ids(pair_id):
     image_id2 = pair_id % MAX_IMAGE_ID
-    image_id1 = (pair_id - image_id2) / MAX_IMAGE_ID
+    image_id1 = (pair_id - image_id2) // MAX_IMAGE_ID
     return image_id1, image_id2
 
 
+def image_ids_to_pair_ids(image_ids1, image_ids2):
+    """Array version of image_ids_to_pair_id."""
+    image_ids1 = np.asarray(image_ids1, dtype=np.int64)
+    image_ids2 = np.asarray(image_ids2, dtype=np.int64)
+    return (np.minimum(image_ids1, image_ids2) * MAX_IMAGE_ID
+            + np.maximum(image_ids1, image_ids2))
+
+
+def pair_ids_to_image_ids(pair_ids):
+    """Array version of pair_id_to_image_ids."""
+    pair_ids = np.asarray(pair_ids, dtype=np.int64)
+    return pair_ids // MAX_IMAGE_ID, pair_ids % MAX_IMAGE_ID
+
+
 def array_to_blob(array):
     if IS_PYTHON3:
-        return array.tostring()
+        return array.tobytes()
     else:
         return np.getbuffer(array)
 
 
 def blob_to_array(blob, dtype, shape=(-1,)):
-    if IS_PYTHON3:
-        return np.fromstring(blob, dtype=dtype).reshape(*shape)
-    else:
-        return np.frombuffer(blob, dtype=dtype).reshape(*shape)
+    # returns a read-only view on the blob, without copying
+    if blob is None:
+        blob = b""
+    return np.frombuffer(blob, dtype=dtype).reshape(*shape)
+
+
+TwoViewGeometry = namedtuple("TwoViewGeometry", [
+    "matches",
+    "config",
+    "F",
+    "E",
+    "H",
+    "qvec",
+    "tvec"
+])
+
+
+class BlobCache:
+    """Least recently used cache for decoded blobs, bounded by
+    the total number of bytes of the cached arrays."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        num_bytes = _nbytes(value)
+        if num_bytes > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.num_bytes -= _nbytes(previous)
+        self._entries[key] = value
+        self.num_bytes += num_bytes
+        while self.num_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.num_bytes -= _nbytes(evicted)
+
+    def discard(self, key):
+        value = self._entries.pop(key, None)
+        if value is not None:
+            self.num_bytes -= _nbytes(value)
+
+    def clear(self):
+        self._entries.clear()
+        self.num_bytes = 0
+
+
+def _nbytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    return sum(item.nbytes for item in value if isinstance(item, np.ndarray))
 
 
 class COLMAPDatabase(sqlite3.Connection):
@@ -163,6 +246,154 @@ class COLMAPDatabase(sqlite3.Connection):
             lambda: self.executescript(CREATE_MATCHES_TABLE)
         self.create_name_index = lambda: self.executescript(CREATE_NAME_INDEX)
 
+        self.blob_cache = None
+        self.descriptor_store = None
+
+    def enable_cache(self, max_bytes=256 * 2**20):
+        """Enables caching of the arrays returned by the get_* methods,
+        up to the given total size in bytes."""
+        self.blob_cache = BlobCache(max_bytes)
+
+    def disable_cache(self):
+        self.blob_cache = None
+
+    def enable_descriptor_store(self, path=None):
+        """Stores descriptors added from now on in an append-only sidecar
+        file (default: the database path + ".descriptors") instead of the
+        descriptors table, which only keeps their shape and offset. The
+        store is also needed to read descriptors stored this way."""
+        if path is None:
+            database_file = self.execute("PRAGMA database_list").fetchone()[2]
+            if not database_file:
+                raise ValueError("in-memory database, descriptor store path required")
+            path = database_file + ".descriptors"
+        self.disable_descriptor_store()
+        self.descriptor_store = DescriptorStore(path)
+        return self.descriptor_store
+
+    def disable_descriptor_store(self):
+        if self.descriptor_store is not None:
+            self.descriptor_store.close()
+        self.descriptor_store = None
+
+    def get_keypoints(self, image_id):
+        """Returns the keypoints of the given image as (rows, cols) float32
+        array, or None if the image has no keypoints. Like all get_* and
+        iter_* methods, returns read-only views on the blobs."""
+        return self._get_cached(("keypoints", image_id), lambda: self._select_array(
+            "SELECT rows, cols, data FROM keypoints WHERE image_id=?",
+            (image_id,), np.float32))
+
+    def get_descriptors(self, image_id):
+        """Returns the descriptors of the given image as (rows, cols) uint8
+        array, or None if the image has no descriptors."""
+        def select():
+            row = self.execute(
+                "SELECT rows, cols, data FROM descriptors WHERE image_id=?",
+                (image_id,)).fetchone()
+            return self._descriptors_from_row(*row) if row else None
+
+        return self._get_cached(("descriptors", image_id), select)
+
+    def get_matches(self, image_id1, image_id2):
+        """Returns the matches between the given images as (rows, 2) uint32
+        array, the first column indexes the keypoints of image_id1. Returns
+        None if there are no matches for the pair."""
+        pair_id = image_ids_to_pair_id(image_id1, image_id2)
+        matches = self._get_cached(("matches", pair_id), lambda: self._select_array(
+            "SELECT rows, cols, data FROM matches WHERE pair_id=?",
+            (pair_id,), np.uint32))
+        if matches is not None and image_id1 > image_id2:
+            matches = matches[:, ::-1]
+        return matches
+
+    def get_two_view_geometry(self, image_id1, image_id2):
+        """Returns the two-view geometry between the given images as
+        TwoViewGeometry tuple, or None if there is none for the pair.
+        The matches are oriented as in get_matches, the geometry is
+        stored for the pair in ascending image id order."""
+        pair_id = image_ids_to_pair_id(image_id1, image_id2)
+
+        def select():
+            row = self.execute(
+                "SELECT rows, cols, data, config, F, E, H, qvec, tvec "
+                "FROM two_view_geometries WHERE pair_id=?", (pair_id,)).fetchone()
+            if row is None:
+                return None
+            return _two_view_geometry_from_row(row)
+
+        geometry = self._get_cached(("two_view_geometries", pair_id), select)
+        if geometry is not None and image_id1 > image_id2:
+            geometry = geometry._replace(matches=geometry.matches[:, ::-1])
+        return geometry
+
+    def iter_keypoints(self):
+        """Yields (image_id, keypoints) for all images with keypoints."""
+        for image_id, rows, cols, data in self.execute(
+                "SELECT image_id, rows, cols, data FROM keypoints"):
+            yield image_id, blob_to_array(data, np.float32, (rows, cols))
+
+    def iter_descriptors(self):
+        """Yields (image_id, descriptors) for all images with descriptors."""
+        for image_id, rows, cols, data in self.execute(
+                "SELECT image_id, rows, cols, data FROM descriptors"):
+            yield image_id, self._descriptors_from_row(rows, cols, data)
+
+    def iter_matches(self):
+        """Yields (image_id1, image_id2, matches) for all image pairs with
+        matches, with image_id1 < image_id2."""
+        for pair_id, rows, cols, data in self.execute(
+                "SELECT pair_id, rows, cols, data FROM matches"):
+            image_id1, image_id2 = pair_id_to_image_ids(pair_id)
+            yield image_id1, image_id2, \
+                blob_to_array(data, np.uint32, (rows, cols))
+
+    def iter_two_view_geometries(self):
+        """Yields (image_id1, image_id2, geometry) for all image pairs with
+        two-view geometries, with image_id1 < image_id2."""
+        for row in self.execute(
+                "SELECT pair_id, rows, cols, data, config, F, E, H, qvec, tvec "
+                "FROM two_view_geometries"):
+            image_id1, image_id2 = pair_id_to_image_ids(row[0])
+            yield image_id1, image_id2, _two_view_geometry_from_row(row[1:])
+
+    def _select_array(self, sql, parameters, dtype):
+        row = self.execute(sql, parameters).fetchone()
+        if row is None:
+            return None
+        rows, cols, data = row
+        return blob_to_array(data, dtype, (rows, cols))
+
+    def _descriptors_from_row(self, rows, cols, data):
+        offset = parse_descriptor_reference(data, rows, cols)
+        if offset is None:
+            return blob_to_array(data, np.uint8, (rows, cols))
+        if self.descriptor_store is None:
+            raise RuntimeError(
+                "descriptors are kept in a descriptor store, "
+                "call enable_descriptor_store first")
+        return self.descriptor_store.read(offset, rows, cols)
+
+    def _descriptors_row(self, image_id, descriptors):
+        descriptors = np.ascontiguousarray(descriptors, np.uint8)
+        # descriptors of the size of a reference can't be told apart
+        # from one (see parse_descriptor_reference), keep them as blobs
+        if self.descriptor_store is None \
+                or descriptors.nbytes == REFERENCE_STRUCT.size:
+            return descriptors_row(image_id, descriptors)
+        offset = self.descriptor_store.append(descriptors)
+        return (image_id,) + descriptors.shape + (descriptor_reference(offset),)
+
+    def _get_cached(self, key, select):
+        if self.blob_cache is None:
+            return select()
+        value = self.blob_cache.get(key)
+        if value is None:
+            value = select()
+            if value is not None:
+                self.blob_cache.put(key, value)
+        return value
+
     def add_camera(self, model, width, height, params,
                    prior_focal_length=False, camera_id=None):
         params = np.asarray(params, np.float64)
@@ -173,7 +404,7 @@ class COLMAPDatabase(sqlite3.Connection):
         return cursor.lastrowid
 
     def add_image(self, name, camera_id,
-                  prior_q=np.full(4, np.NaN), prior_t=np.full(3, np.NaN), image_id=None):
+                  prior_q=np.full(4, np.nan), prior_t=np.full(3, np.nan), image_id=None):
         cursor = self.execute(
             "INSERT INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
             (image_id, name, camera_id, prior_q[0], prior_q[1], prior_q[2],
@@ -181,55 +412,228 @@ class COLMAPDatabase(sqlite3.Connection):
         return cursor.lastrowid
 
     def add_keypoints(self, image_id, keypoints):
-        assert(len(keypoints.shape) == 2)
-        assert(keypoints.shape[1] in [2, 4, 6])
-
-        keypoints = np.asarray(keypoints, np.float32)
         self.execute(
             "INSERT INTO keypoints VALUES (?, ?, ?, ?)",
-            (image_id,) + keypoints.shape + (array_to_blob(keypoints),))
+            keypoints_row(image_id, keypoints))
 
     def add_descriptors(self, image_id, descriptors):
-        descriptors = np.ascontiguousarray(descriptors, np.uint8)
         self.execute(
             "INSERT INTO descriptors VALUES (?, ?, ?, ?)",
-            (image_id,) + descriptors.shape + (array_to_blob(descriptors),))
+            self._descriptors_row(image_id, descriptors))
 
     def add_matches(self, image_id1, image_id2, matches):
-        assert(len(matches.shape) == 2)
-        assert(matches.shape[1] == 2)
-
-        if image_id1 > image_id2:
-            matches = matches[:,::-1]
-
-        pair_id = image_ids_to_pair_id(image_id1, image_id2)
-        matches = np.asarray(matches, np.uint32)
         self.execute(
             "INSERT INTO matches VALUES (?, ?, ?, ?)",
-            (pair_id,) + matches.shape + (array_to_blob(matches),))
+            matches_row(image_id1, image_id2, matches))
 
     def add_two_view_geometry(self, image_id1, image_id2, matches,
                               F=np.eye(3), E=np.eye(3), H=np.eye(3),
                               qvec=np.array([1.0, 0.0, 0.0, 0.0]),
                               tvec=np.zeros(3), config=2):
-        assert(len(matches.shape) == 2)
-        assert(matches.shape[1] == 2)
-
-        if image_id1 > image_id2:
-            matches = matches[:,::-1]
-
-        pair_id = image_ids_to_pair_id(image_id1, image_id2)
-        matches = np.asarray(matches, np.uint32)
-        F = np.asarray(F, dtype=np.float64)
-        E = np.asarray(E, dtype=np.float64)
-        H = np.asarray(H, dtype=np.float64)
-        qvec = np.asarray(qvec, dtype=np.float64)
-        tvec = np.asarray(tvec, dtype=np.float64)
         self.execute(
             "INSERT INTO two_view_geometries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-            (pair_id,) + matches.shape + (array_to_blob(matches), config,
-             array_to_blob(F), array_to_blob(E), array_to_blob(H),
-             array_to_blob(qvec), array_to_blob(tvec)))
+            two_view_geometry_row(image_id1, image_id2, matches,
+                                  F, E, H, qvec, tvec, config))
+
+    def add_keypoints_batch(self, items):
+        """Inserts (image_id, keypoints) items in one transaction."""
+        with self.transaction():
+            self.executemany(
+                "INSERT INTO keypoints VALUES (?, ?, ?, ?)",
+                (keypoints_row(*item) for item in items))
+
+    def add_descriptors_batch(self, items):
+        """Inserts (image_id, descriptors) items in one transaction."""
+        with self.transaction():
+            self.executemany(
+                "INSERT INTO descriptors VALUES (?, ?, ?, ?)",
+                (self._descriptors_row(*item) for item in items))
+
+    def add_matches_batch(self, items):
+        """Inserts (image_id1, image_id2, matches) items in one transaction."""
+        with self.transaction():
+            self.executemany(
+                "INSERT INTO matches VALUES (?, ?, ?, ?)",
+                (matches_row(*item) for item in items))
+
+    def add_two_view_geometries_batch(self, items):
+        """Inserts (image_id1, image_id2, matches[, F, E, H, qvec, tvec,
+        config]) items in one transaction."""
+        with self.transaction():
+            self.executemany(
+                "INSERT INTO two_view_geometries "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (two_view_geometry_row(*item) for item in items))
+
+    def get_descriptor_offsets(self):
+        """Returns image ids, store offsets, rows and cols of all descriptors
+        kept in the descriptor store, for direct access to the memory-mapped
+        store array (see DescriptorStore.array)."""
+        references = []
+        for image_id, rows, cols, data in self.execute(
+                "SELECT image_id, rows, cols, data FROM descriptors "
+                "WHERE length(data) = ?", (len(descriptor_reference(0)),)):
+            offset = parse_descriptor_reference(data, rows, cols)
+            if offset is not None:
+                references.append((image_id, offset, rows, cols))
+        image_ids, offsets, rows, cols = \
+            np.array(references, dtype=np.int64).reshape(-1, 4).T
+        return image_ids, offsets, rows, cols
+
+    def move_descriptors_to_store(self):
+        """Moves the descriptors stored as blobs in the descriptors table to
+        the descriptor store. Run VACUUM afterwards to shrink the file."""
+        if self.descriptor_store is None:
+            raise RuntimeError("descriptor store not enabled")
+        image_ids = [row[0] for row in self.execute(
+            "SELECT image_id FROM descriptors WHERE length(data) != ?",
+            (len(descriptor_reference(0)),))]
+        with self.transaction():
+            for image_id in image_ids:
+                descriptors = self.get_descriptors(image_id)
+                self.execute(
+                    "UPDATE descriptors SET data=? WHERE image_id=?",
+                    (self._descriptors_row(image_id, descriptors)[3], image_id))
+
+    def export_standard_database(self, output_path):
+        """Writes a copy of the database to the given path, with all
+        descriptors stored as blobs in the standard COLMAP layout. Commits
+        any pending transaction first."""
+        self.commit()
+        output = COLMAPDatabase.connect(output_path)
+        try:
+            self.backup(output)
+            image_ids, offsets, rows, cols = self.get_descriptor_offsets()
+            if len(image_ids) > 0 and self.descriptor_store is None:
+                raise RuntimeError("descriptor store not enabled")
+            with output.transaction():
+                for image_id, offset, num_rows, num_cols in zip(
+                        image_ids.tolist(), offsets.tolist(),
+                        rows.tolist(), cols.tolist()):
+                    descriptors = self.descriptor_store.read(
+                        offset, num_rows, num_cols)
+                    output.execute(
+                        "UPDATE descriptors SET data=? WHERE image_id=?",
+                        (array_to_blob(descriptors), image_id))
+            output.execute("VACUUM")
+        finally:
+            output.close()
+
+    @contextmanager
+    def transaction(self):
+        """Runs the statements in the block in one explicit transaction,
+        which is committed at the end of the block or rolled back on error.
+        If a transaction is already open, the block becomes part of it."""
+        if self.in_transaction:
+            yield self
+            return
+
+        self.execute("BEGIN")
+        try:
+            yield self
+        except BaseException:
+            self.rollback()
+            raise
+        self.commit()
+
+    @contextmanager
+    def import_session(self, synchronous="OFF", cache_size_mb=512):
+        """Sets up the connection for bulk imports and runs the block in one
+        transaction. Switches the database to write-ahead logging (which
+        stays enabled for the database file), sets the synchronous mode
+        (OFF or NORMAL) and the page cache size for the duration of the
+        block."""
+        synchronous = synchronous.upper()
+        if synchronous not in ("OFF", "NORMAL", "FULL", "EXTRA"):
+            raise ValueError(f"invalid synchronous mode: {synchronous}")
+
+        # the journal mode can't be changed inside a transaction
+        self.commit()
+        previous_synchronous = self.execute("PRAGMA synchronous").fetchone()[0]
+        previous_cache_size = self.execute("PRAGMA cache_size").fetchone()[0]
+
+        self.execute("PRAGMA journal_mode=WAL")
+        self.execute(f"PRAGMA synchronous={synchronous}")
+        self.execute(f"PRAGMA cache_size={-int(cache_size_mb * 1024)}")
+        try:
+            with self.transaction():
+                yield self
+        finally:
+            self.execute(f"PRAGMA synchronous={int(previous_synchronous)}")
+            self.execute(f"PRAGMA cache_size={int(previous_cache_size)}")
+
+
+def keypoints_row(image_id, keypoints):
+    assert(len(keypoints.shape) == 2)
+    assert(keypoints.shape[1] in [2, 4, 6])
+
+    keypoints = np.asarray(keypoints, np.float32)
+    return (image_id,) + keypoints.shape + (array_to_blob(keypoints),)
+
+
+def descriptors_row(image_id, descriptors):
+    descriptors = np.ascontiguousarray(descriptors, np.uint8)
+    return (image_id,) + descriptors.shape + (array_to_blob(descriptors),)
+
+
+def matches_row(image_id1, image_id2, matches):
+    assert(len(matches.shape) == 2)
+    assert(matches.shape[1] == 2)
+
+    if image_id1 > image_id2:
+        matches = matches[:,::-1]
+
+    pair_id = image_ids_to_pair_id(image_id1, image_id2)
+    matches = np.asarray(matches, np.uint32)
+    return (pair_id,) + matches.shape + (array_to_blob(matches),)
+
+
+def two_view_geometry_row(image_id1, image_id2, matches,
+                          F=np.eye(3), E=np.eye(3), H=np.eye(3),
+                          qvec=np.array([1.0, 0.0, 0.0, 0.0]),
+                          tvec=np.zeros(3), config=2):
+    assert(len(matches.shape) == 2)
+    assert(matches.shape[1] == 2)
+
+    if image_id1 > image_id2:
+        matches = matches[:,::-1]
+
+    pair_id = image_ids_to_pair_id(image_id1, image_id2)
+    matches = np.asarray(matches, np.uint32)
+    F = np.asarray(F, dtype=np.float64)
+    E = np.asarray(E, dtype=np.float64)
+    H = np.asarray(H, dtype=np.float64)
+    qvec = np.asarray(qvec, dtype=np.float64)
+    tvec = np.asarray(tvec, dtype=np.float64)
+    return (pair_id,) + matches.shape + (array_to_blob(matches), config,
+            array_to_blob(F), array_to_blob(E), array_to_blob(H),
+            array_to_blob(qvec), array_to_blob(tvec))
+
+
+def _two_view_geometry_from_row(row):
+    rows, cols, data, config, F, E, H, qvec, tvec = row
+    return TwoViewGeometry(
+        matches=blob_to_array(data, np.uint32, (rows, cols)),
+        config=config,
+        F=blob_to_array(F, np.float64, (3, 3)) if F else None,
+        E=blob_to_array(E, np.float64, (3, 3)) if E else None,
+        H=blob_to_array(H, np.float64, (3, 3)) if H else None,
+        qvec=blob_to_array(qvec, np.float64) if qvec else None,
+        tvec=blob_to_array(tvec, np.float64) if tvec else None)
+
+
+def iter_stacked(ids, stacked, counts):
+    """Splits an array of stacked rows into per-id items for the batch
+    methods of COLMAPDatabase. ids is either an (N,) array of image ids or
+    an (N, 2) array of image id pairs, counts gives the number of rows
+    of each item. Yields (image_id, rows) or (image_id1, image_id2, rows)."""
+    ends = np.cumsum(counts).tolist()
+    starts = [0] + ends[:-1]
+    for key, start, end in zip(np.asarray(ids).tolist(), starts, ends):
+        if isinstance(key, list):
+            yield (*key, stacked[start:end])
+        else:
+            yield key, stacked[start:end]
 
 
 def example_usage():
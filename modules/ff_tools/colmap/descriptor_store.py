@@ -0,0 +1,92 @@
+# Blender Tools
+# Copyright 2024 Ralph Wiedemeier, Frame Factory GmbH
+# License: MIT
+
+from pathlib import Path
+import struct
+
+import numpy as np
+
+
+STORE_MAGIC = b"FFDESC01"
+
+REFERENCE_MAGIC = b"FFDS"
+REFERENCE_STRUCT = struct.Struct("<4sQ")
+
+
+def descriptor_reference(offset: int) -> bytes:
+    """Returns the blob stored in the data column of the descriptors table
+    in place of the descriptors, pointing to their offset in the store."""
+    return REFERENCE_STRUCT.pack(REFERENCE_MAGIC, offset)
+
+
+def parse_descriptor_reference(data, rows: int, cols: int):
+    """Returns the store offset if the given descriptors blob is a reference,
+    or None if it contains the descriptors themselves."""
+    if data is None or len(data) != REFERENCE_STRUCT.size or rows * cols == REFERENCE_STRUCT.size:
+        return None
+    magic, offset = REFERENCE_STRUCT.unpack(bytes(data))
+    return offset if magic == REFERENCE_MAGIC else None
+
+
+class DescriptorStore:
+    """
+    Append-only binary file holding uint8 descriptor matrices back to back. The
+    descriptors table of the database only keeps their shape and a reference to
+    their offset in the file (see `descriptor_reference`). Reads return read-only
+    views on a memory map of the file, which is extended when the file grows.
+    Descriptors which are appended but never referenced, e.g. after a rolled back
+    transaction, remain as unused bytes in the file.
+    """
+
+    def __init__(self, path: str|Path):
+        self.path = Path(path)
+        if not self.path.exists() or self.path.stat().st_size == 0:
+            with open(self.path, "wb") as fid:
+                fid.write(STORE_MAGIC)
+        else:
+            with open(self.path, "rb") as fid:
+                if fid.read(len(STORE_MAGIC)) != STORE_MAGIC:
+                    raise ValueError(f"not a descriptor store: {self.path}")
+
+        self._file = None
+        self._map = None
+
+    def __repr__(self):
+        return f"DescriptorStore('{self.path}', size={self.size})"
+
+    @property
+    def size(self) -> int:
+        return self.path.stat().st_size
+
+    def append(self, descriptors: np.ndarray) -> int:
+        """Appends the descriptors to the file, returns their offset."""
+        descriptors = np.ascontiguousarray(descriptors, np.uint8)
+        if self._file is None:
+            # unbuffered, each append is one write to the end of the file
+            self._file = open(self.path, "ab", buffering=0)
+        offset = self._file.seek(0, 2)
+        self._file.write(descriptors.data)
+        return offset
+
+    def read(self, offset: int, rows: int, cols: int) -> np.ndarray:
+        """Returns the (rows, cols) descriptors at the given offset as
+        read-only view on the memory-mapped file."""
+        end = offset + rows * cols
+        if self._map is None or len(self._map) < end:
+            self._map = np.memmap(self.path, dtype=np.uint8, mode="r")
+            if len(self._map) < end:
+                raise ValueError(f"descriptors at offset {offset} exceed the store size")
+        return self._map[offset:end].reshape(rows, cols)
+
+    def array(self) -> np.ndarray:
+        """Returns the whole file as flat, memory-mapped uint8 array, the
+        offsets of the descriptors are offsets into this array."""
+        self._map = np.memmap(self.path, dtype=np.uint8, mode="r")
+        return self._map
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._map = None
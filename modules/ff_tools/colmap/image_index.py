@@ -0,0 +1,182 @@
+# Blender Tools
+# Copyright 2024 Ralph Wiedemeier, Frame Factory GmbH
+# License: MIT
+
+from pathlib import Path
+from typing import Optional
+import mmap
+import os
+
+import numpy as np
+
+from .utils import (
+    Image,
+    IMAGE_HEADER_DTYPE,
+    POINT2D_DTYPE,
+    _gather_records,
+    _index_images_binary,
+)
+
+
+INDEX_VERSION = 1
+
+
+class ImagesBinaryIndex:
+    """
+    Random-access index for an images.bin file. A single pass over the file records
+    the byte offset, id, name and number of 2D points of each image. The index is
+    saved as a sidecar file next to images.bin (images.bin.idx.npz) and reused as
+    long as the size and modification time of images.bin are unchanged. Single
+    images are decoded by seeking to their record.
+    """
+
+    def __init__(self, path: str|Path, index_path: Optional[str|Path] = None, rebuild: bool = False):
+        self.path = Path(path)
+        self.index_path = Path(index_path) if index_path else self.path.with_name(self.path.name + ".idx.npz")
+
+        if rebuild or not self._load():
+            self._build()
+            self._save()
+
+        self._id_rows = None
+        self._name_rows = None
+
+    def __len__(self):
+        return len(self.image_ids)
+
+    def __contains__(self, id_or_name) -> bool:
+        try:
+            self.row(id_or_name)
+        except KeyError:
+            return False
+        return True
+
+    def __repr__(self):
+        return f"ImagesBinaryIndex('{self.path}', images={len(self)})"
+
+    @property
+    def names(self) -> list[str]:
+        return self._names
+
+    def row(self, id_or_name: int|str) -> int:
+        """Returns the row of the image with the given id or name,
+        raises KeyError if there is no such image."""
+        if isinstance(id_or_name, str):
+            if self._name_rows is None:
+                self._name_rows = { name: row for row, name in enumerate(self._names) }
+            return self._name_rows[id_or_name]
+
+        if self._id_rows is None:
+            self._id_rows = dict(zip(self.image_ids.tolist(), range(len(self.image_ids))))
+        return self._id_rows[int(id_or_name)]
+
+    def get_image(self, id_or_name: int|str) -> Image:
+        """Decodes the record of the image with the given id or name."""
+        row = self.row(id_or_name)
+        name = self._names[row]
+        num_points2D = int(self.num_points2D[row])
+        header_size = IMAGE_HEADER_DTYPE.itemsize
+        points_start = header_size + len(name.encode("utf-8")) + 9
+        record_size = points_start + num_points2D * POINT2D_DTYPE.itemsize
+
+        with open(self.path, "rb") as fid:
+            fid.seek(int(self.offsets[row]))
+            record = fid.read(record_size)
+        if len(record) < record_size:
+            raise ValueError(f"truncated images.bin, record of image '{name}' exceeds the file size")
+
+        header = np.frombuffer(record, dtype=IMAGE_HEADER_DTYPE, count=1)[0]
+        points = np.frombuffer(record, dtype=POINT2D_DTYPE, offset=points_start)
+
+        return Image(
+            id=int(header["image_id"]), qvec=header["qvec"].copy(), tvec=header["tvec"].copy(),
+            camera_id=int(header["camera_id"]), name=name, path=name,
+            xys=points["xy"].copy(), point3D_ids=points["point3D_id"].copy())
+
+    def get_pose(self, id_or_name: int|str) -> tuple[np.ndarray, np.ndarray]:
+        """Returns qvec and tvec of the image with the given id or name,
+        reading only the fixed size header of its record."""
+        row = self.row(id_or_name)
+        with open(self.path, "rb") as fid:
+            fid.seek(int(self.offsets[row]))
+            record = fid.read(IMAGE_HEADER_DTYPE.itemsize)
+        if len(record) < IMAGE_HEADER_DTYPE.itemsize:
+            raise ValueError("truncated images.bin, image header exceeds the file size")
+
+        header = np.frombuffer(record, dtype=IMAGE_HEADER_DTYPE, count=1)[0]
+        return header["qvec"].copy(), header["tvec"].copy()
+
+    def _file_stamp(self) -> np.ndarray:
+        stat = os.stat(self.path)
+        return np.array([INDEX_VERSION, stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+    def _build(self):
+        with open(self.path, "rb") as fid, \
+                mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            offsets, names, num_points2D = _index_images_binary(buf)
+            if len(offsets) > 0:
+                last_name_size = len(names[-1].encode("utf-8")) + 9
+                end = offsets[-1] + IMAGE_HEADER_DTYPE.itemsize + last_name_size \
+                    + num_points2D[-1] * POINT2D_DTYPE.itemsize
+                if end > len(buf):
+                    raise ValueError("truncated images.bin, 2D points exceed the file size")
+
+            data = np.frombuffer(buf, dtype=np.uint8)
+            try:
+                headers = _gather_records(data, offsets, IMAGE_HEADER_DTYPE)
+            finally:
+                # all views into the mapped file must be gone before it is closed
+                del data
+
+        self.offsets = offsets
+        self.image_ids = headers["image_id"].astype(np.int64)
+        self.num_points2D = num_points2D
+        self._names = names
+        self._stamp = self._file_stamp()
+
+    def _load(self) -> bool:
+        """Loads the sidecar index, returns False if it does not exist,
+        is outdated or can't be read."""
+        if not self.index_path.exists():
+            return False
+
+        try:
+            with np.load(self.index_path) as index:
+                if not np.array_equal(index["stamp"], self._file_stamp()):
+                    return False
+                self.offsets = index["offsets"]
+                self.image_ids = index["image_ids"]
+                self.num_points2D = index["num_points2D"]
+                name_bytes = index["name_bytes"].tobytes()
+                name_offsets = index["name_offsets"].tolist()
+                self._stamp = index["stamp"]
+
+            self._names = [
+                name_bytes[start:end].decode("utf-8")
+                for start, end in zip(name_offsets[:-1], name_offsets[1:])]
+        except Exception:
+            # a corrupt or truncated sidecar (e.g. zipfile.BadZipFile) is rebuilt
+            return False
+
+        return True
+
+    def _save(self):
+        encoded = [name.encode("utf-8") for name in self._names]
+        name_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(name) for name in encoded], out=name_offsets[1:])
+
+        temp_path = self.index_path.with_name(self.index_path.name + ".tmp")
+        try:
+            with open(temp_path, "wb") as fid:
+                np.savez(
+                    fid,
+                    stamp=self._stamp,
+                    offsets=self.offsets,
+                    image_ids=self.image_ids,
+                    num_points2D=self.num_points2D,
+                    name_bytes=np.frombuffer(b"".join(encoded), dtype=np.uint8),
+                    name_offsets=name_offsets)
+            temp_path.replace(self.index_path)
+        except OSError:
+            # the index is still usable if the model directory is read-only
+            temp_path.unlink(missing_ok=True)
@@ -0,0 +1,302 @@
+# Blender Tools
+# Copyright 2024 Ralph Wiedemeier, Frame Factory GmbH
+# License: MIT
+
+from multiprocessing import resource_tracker, shared_memory
+from pathlib import Path
+from typing import Optional
+import logging
+import multiprocessing as mp
+import queue
+import time
+
+import numpy as np
+
+from .database import COLMAPDatabase
+
+
+logger = logging.getLogger(__name__)
+
+KINDS = ("keypoints", "descriptors", "matches", "two_view_geometries")
+
+_STOP = "stop"
+
+# interval in seconds for checking that the writer is still alive while waiting
+_POLL_INTERVAL = 0.5
+
+_client: Optional["FeatureClient"] = None
+
+
+def _create_shared_memory(size: int) -> shared_memory.SharedMemory:
+    """Creates a shared memory block which is not removed when the creating
+    process exits, ownership is handed over to the writer."""
+    try:
+        return shared_memory.SharedMemory(create=True, size=size, track=False)
+    except TypeError:
+        # before Python 3.13, blocks are always registered with the resource tracker
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class FeatureClient:
+    """
+    Sends features and matches to the writer of a FeatureWriter. Clients can be
+    passed to worker processes when they are started, e.g. as initargs of a
+    process pool (see `init_worker`). Arrays of at least shm_threshold bytes are
+    transferred through shared memory, smaller arrays are pickled. Calls block
+    while the writer's queue is full.
+    """
+
+    def __init__(self, queue: mp.Queue, shm_threshold: int):
+        self._queue = queue
+        self._shm_threshold = shm_threshold
+
+    def add_keypoints(self, image_id: int, keypoints: np.ndarray):
+        self._put("keypoints", image_id, np.asarray(keypoints, np.float32))
+
+    def add_descriptors(self, image_id: int, descriptors: np.ndarray):
+        self._put("descriptors", image_id, np.asarray(descriptors, np.uint8))
+
+    def add_matches(self, image_id1: int, image_id2: int, matches: np.ndarray):
+        self._put("matches", image_id1, image_id2, np.asarray(matches, np.uint32))
+
+    def add_two_view_geometry(self, image_id1: int, image_id2: int, matches: np.ndarray, *args):
+        """Sends a two-view geometry, optional arguments are F, E, H, qvec,
+        tvec and config as for COLMAPDatabase.add_two_view_geometry."""
+        self._put("two_view_geometries", image_id1, image_id2, np.asarray(matches, np.uint32), *args)
+
+    def _put(self, kind: str, *args):
+        self._queue.put((kind, tuple(self._encode(arg) for arg in args)))
+
+    def _encode(self, value):
+        if not isinstance(value, np.ndarray) or value.nbytes < self._shm_threshold:
+            return value
+
+        shm = _create_shared_memory(value.nbytes)
+        np.ndarray(value.shape, value.dtype, buffer=shm.buf)[...] = value
+        shm.close()
+        return ("shm", shm.name, value.shape, value.dtype.str)
+
+
+def init_worker(client: FeatureClient):
+    """Process pool initializer, makes the client available through `get_client`."""
+    global _client
+    _client = client
+
+
+def get_client() -> FeatureClient:
+    """Returns the client passed to `init_worker` in this process."""
+    if _client is None:
+        raise RuntimeError("worker not initialized, pass init_worker as process pool initializer")
+    return _client
+
+
+class FeatureWriter:
+    """
+    Single writer for a COLMAP database, fed by any number of processes through
+    a bounded queue. The writer runs in its own process and inserts the received
+    items in batched transactions with write-ahead logging, so that workers never
+    contend for the database lock. The bounded queue provides backpressure,
+    limiting the memory held by items in flight.
+
+    Example:
+        with FeatureWriter("database.db") as writer:
+            with ProcessPoolExecutor(initializer=init_worker, initargs=(writer.client(),)) as pool:
+                pool.map(extract_features, image_ids)
+
+    where extract_features calls get_client().add_keypoints(...) etc.
+    """
+
+    def __init__(
+        self,
+        database_path: str|Path,
+        max_queue_size: int = 64,
+        batch_size: int = 512,
+        batch_bytes: int = 256 << 20,
+        flush_interval: float = 2.0,
+        shm_threshold: int = 1 << 16,
+        synchronous: str = "NORMAL",
+        context: Optional[mp.context.BaseContext] = None,
+    ):
+        """
+        Items are written once batch_size items or batch_bytes bytes are pending,
+        or if no new items arrived within flush_interval seconds.
+        """
+        context = context or mp.get_context()
+        self.database_path = str(database_path)
+        self.shm_threshold = shm_threshold
+        self._queue = context.Queue(max_queue_size)
+        self._results = context.Queue()
+        self._process = context.Process(
+            target=_writer_main,
+            args=(self.database_path, self._queue, self._results,
+                  batch_size, batch_bytes, flush_interval, synchronous),
+            daemon=True)
+        self.stats = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start(self):
+        self._process.start()
+
+    def client(self) -> FeatureClient:
+        return FeatureClient(self._queue, self.shm_threshold)
+
+    def close(self) -> dict:
+        """Writes all pending items, stops the writer and returns the number
+        of written items per table. Raises RuntimeError if the writer failed."""
+        if self.stats is not None:
+            return self.stats
+        if self._process.pid is None:
+            raise RuntimeError("feature writer not started")
+
+        while self._process.is_alive():
+            try:
+                self._queue.put((_STOP, ()), timeout=_POLL_INTERVAL)
+                break
+            except queue.Full:
+                pass
+
+        status, result = self._get_result()
+        self._process.join()
+        if status == "error":
+            raise RuntimeError(f"feature writer failed: {result}")
+
+        self.stats = result
+        return self.stats
+
+    def _get_result(self) -> tuple:
+        """Waits for the result of the writer, raises RuntimeError if it
+        exited without posting one, e.g. if it was killed."""
+        while True:
+            # a result posted before exiting is received by the next get
+            alive = self._process.is_alive()
+            try:
+                return self._results.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                if not alive:
+                    raise RuntimeError("feature writer exited unexpectedly "
+                                       f"with exit code {self._process.exitcode}") from None
+
+
+class _Batch:
+    """Items received by the writer and not written yet, with the shared
+    memory blocks their arrays are mapped from."""
+
+    def __init__(self):
+        self.items = { kind: [] for kind in KINDS }
+        self.blocks = []
+        self.count = 0
+        self.num_bytes = 0
+
+    def add(self, kind: str, args: tuple):
+        self.items[kind].append(tuple(self._decode(arg) for arg in args))
+        self.count += 1
+
+    def _decode(self, value):
+        if isinstance(value, tuple) and len(value) == 4 and value[0] == "shm":
+            _, name, shape, dtype = value
+            shm = shared_memory.SharedMemory(name=name)
+            self.blocks.append(shm)
+            value = np.ndarray(shape, np.dtype(dtype), buffer=shm.buf)
+        if isinstance(value, np.ndarray):
+            self.num_bytes += value.nbytes
+        return value
+
+    def write(self, db: COLMAPDatabase, synchronous: str) -> dict:
+        with db.import_session(synchronous=synchronous):
+            db.add_keypoints_batch(self.items["keypoints"])
+            db.add_descriptors_batch(self.items["descriptors"])
+            db.add_matches_batch(self.items["matches"])
+            db.add_two_view_geometries_batch(self.items["two_view_geometries"])
+        return { kind: len(items) for kind, items in self.items.items() }
+
+    def release(self):
+        # the arrays must be gone before their blocks can be closed
+        self.items = None
+        for shm in self.blocks:
+            try:
+                shm.close()
+            except BufferError:
+                # still referenced elsewhere, unmapped with the last reference
+                pass
+            shm.unlink()
+        self.blocks = []
+
+
+def _writer_main(database_path, items, results, batch_size, batch_bytes, flush_interval, synchronous):
+    stats = { kind: 0 for kind in KINDS }
+    batch = _Batch()
+    db = None
+    stopped = False
+    error = None
+    try:
+        db = COLMAPDatabase.connect(database_path)
+        while not stopped:
+            try:
+                kind, args = items.get(timeout=flush_interval)
+            except queue.Empty:
+                kind, args = None, None
+
+            if kind == _STOP:
+                stopped = True
+            elif kind is not None:
+                batch.add(kind, args)
+                if batch.count < batch_size and batch.num_bytes < batch_bytes:
+                    continue
+
+            if batch.count > 0:
+                start = time.perf_counter()
+                for table, count in batch.write(db, synchronous).items():
+                    stats[table] += count
+                logger.debug(f"wrote {batch.count} items in {time.perf_counter() - start:.3f}s")
+                batch.release()
+                batch = _Batch()
+
+    except Exception as e:
+        error = repr(e)
+
+    # handled outside of the except clause, whose traceback references
+    # the arrays of the failed batch, which would keep their shared memory open
+    _release(batch)
+    if db is not None:
+        db.close()
+
+    if error is None:
+        results.put(("ok", stats))
+        return
+
+    results.put(("error", error))
+    # drain the queue until stopped (unless the error occurred while writing the
+    # last batch), so that clients don't block and the shared memory is released
+    while not stopped:
+        kind, args = items.get()
+        if kind == _STOP:
+            stopped = True
+        else:
+            _drop(kind, args)
+
+
+def _drop(kind: str, args: tuple):
+    """releases the shared memory of an item which is not written."""
+    batch = _Batch()
+    try:
+        batch.add(kind, args)
+    except Exception as e:
+        logger.error(f"failed to receive dropped item: {e!r}")
+    _release(batch)
+
+
+def _release(batch: _Batch):
+    """releases the batch, errors are logged only, so that
+    the writer keeps draining the queue after a failure."""
+    try:
+        batch.release()
+    except Exception as e:
+        logger.error(f"failed to release shared memory: {e!r}")
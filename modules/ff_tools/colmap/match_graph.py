@@ -0,0 +1,173 @@
+# Blender Tools
+# Copyright 2024 Ralph Wiedemeier, Frame Factory GmbH
+# License: MIT
+
+import numpy as np
+
+from .database import COLMAPDatabase, pair_ids_to_image_ids
+
+
+class MatchGraph:
+    """
+    Sparse, undirected graph of matched image pairs in CSR layout. The
+    neighbors of the image in row i are indices[indptr[i]:indptr[i + 1]],
+    sorted by row, with the number of (inlier) matches in weights. Rows
+    correspond to the sorted image_ids.
+    """
+
+    def __init__(self, image_ids1: np.ndarray, image_ids2: np.ndarray, num_matches: np.ndarray):
+        """Builds the graph from the given image id pairs and their
+        number of matches. Each pair must only occur once."""
+        image_ids1 = np.asarray(image_ids1, dtype=np.int64)
+        image_ids2 = np.asarray(image_ids2, dtype=np.int64)
+        num_matches = np.asarray(num_matches, dtype=np.int64)
+
+        self.image_ids = np.unique(np.concatenate([image_ids1, image_ids2]))
+        rows1 = np.searchsorted(self.image_ids, image_ids1)
+        rows2 = np.searchsorted(self.image_ids, image_ids2)
+
+        rows = np.concatenate([rows1, rows2])
+        cols = np.concatenate([rows2, rows1])
+        weights = np.concatenate([num_matches, num_matches])
+        order = np.lexsort((cols, rows))
+
+        self.indptr = np.zeros(len(self.image_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(self.image_ids)), out=self.indptr[1:])
+        self.indices = cols[order]
+        self.weights = weights[order]
+
+    def __repr__(self):
+        return f"MatchGraph(images={self.num_images}, pairs={self.num_pairs})"
+
+    @classmethod
+    def from_database(
+        cls,
+        db: COLMAPDatabase,
+        table: str = "two_view_geometries",
+        min_num_matches: int = 1,
+    ) -> "MatchGraph":
+        """Builds the graph from the matches or two_view_geometries table of
+        the given database. Pairs with less than min_num_matches (inlier)
+        matches are skipped."""
+        if table not in ("matches", "two_view_geometries"):
+            raise ValueError(f"invalid table: {table}")
+
+        rows = db.execute(
+            f"SELECT pair_id, rows FROM {table} WHERE rows >= ?", (min_num_matches,)).fetchall()
+        pairs = np.array(rows, dtype=np.int64).reshape(-1, 2)
+        image_ids1, image_ids2 = pair_ids_to_image_ids(pairs[:, 0])
+        return cls(image_ids1, image_ids2, pairs[:, 1])
+
+    @property
+    def num_images(self) -> int:
+        return len(self.image_ids)
+
+    @property
+    def num_pairs(self) -> int:
+        return len(self.indices) // 2
+
+    @property
+    def degrees(self) -> np.ndarray:
+        """Number of matched partners of each image."""
+        return np.diff(self.indptr)
+
+    def rows(self, image_ids) -> np.ndarray:
+        """Returns the rows of the given image ids, -1 for unknown ids."""
+        image_ids = np.asarray(image_ids, dtype=np.int64)
+        if self.num_images == 0:
+            return np.full(image_ids.shape, -1, dtype=np.int64)
+        pos = np.searchsorted(self.image_ids, image_ids).clip(max=self.num_images - 1)
+        return np.where(self.image_ids[pos] == image_ids, pos, -1)
+
+    def pairs(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Returns all pairs as arrays of image ids (image_id1 < image_id2)
+        and their number of matches."""
+        rows = np.repeat(np.arange(self.num_images), self.degrees)
+        upper = rows < self.indices
+        return (self.image_ids[rows[upper]], self.image_ids[self.indices[upper]],
+                self.weights[upper])
+
+    def neighbors(self, image_id: int) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the ids of the images matched with the given image
+        and the number of matches with each of them."""
+        row = int(self.rows(image_id))
+        if row < 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        start, end = self.indptr[row], self.indptr[row + 1]
+        return self.image_ids[self.indices[start:end]], self.weights[start:end]
+
+    def num_matches(self, image_id1: int, image_id2: int) -> int:
+        """Returns the number of matches between the given images, 0 if none."""
+        row1, row2 = self.rows([image_id1, image_id2]).tolist()
+        if row1 < 0 or row2 < 0:
+            return 0
+        start, end = self.indptr[row1], self.indptr[row1 + 1]
+        pos = start + np.searchsorted(self.indices[start:end], row2)
+        if pos < end and self.indices[pos] == row2:
+            return int(self.weights[pos])
+        return 0
+
+    def top_k(self, image_id: int, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the ids of the k images with the most matches with the
+        given image and their number of matches, in descending order."""
+        neighbor_ids, weights = self.neighbors(image_id)
+        if len(weights) > k:
+            selection = np.argpartition(-weights, k - 1)[:k]
+            neighbor_ids, weights = neighbor_ids[selection], weights[selection]
+        order = np.argsort(-weights, kind="stable")
+        return neighbor_ids[order], weights[order]
+
+    def top_k_all(self, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the top k partners of all images as (num_images, k) arrays of
+        image ids and number of matches, in descending order. Rows of images
+        with less than k partners are padded with -1 ids and 0 matches."""
+        rows = np.repeat(np.arange(self.num_images), self.degrees)
+        order = np.lexsort((-self.weights, rows))
+        rank = np.arange(len(order)) - self.indptr[rows[order]]
+        selected = order[rank < k]
+        selected_rows = rows[selected]
+        selected_rank = rank[rank < k]
+
+        partner_ids = np.full((self.num_images, k), -1, dtype=np.int64)
+        partner_weights = np.zeros((self.num_images, k), dtype=np.int64)
+        partner_ids[selected_rows, selected_rank] = self.image_ids[self.indices[selected]]
+        partner_weights[selected_rows, selected_rank] = self.weights[selected]
+        return partner_ids, partner_weights
+
+    def connected_components(self, min_num_matches: int = 0) -> np.ndarray:
+        """Returns the component label of each image (in the order of
+        image_ids), considering only pairs with at least min_num_matches
+        matches. Components are labeled by decreasing size."""
+        rows = np.repeat(np.arange(self.num_images), self.degrees)
+        mask = (rows < self.indices) & (self.weights >= min_num_matches)
+        src, dst = rows[mask], self.indices[mask]
+
+        # min-label propagation along the edges, with pointer jumping
+        labels = np.arange(self.num_images)
+        while True:
+            edge_labels = np.minimum(labels[src], labels[dst])
+            updated = labels.copy()
+            np.minimum.at(updated, src, edge_labels)
+            np.minimum.at(updated, dst, edge_labels)
+            while True:
+                jumped = updated[updated]
+                if np.array_equal(jumped, updated):
+                    break
+                updated = jumped
+            if np.array_equal(updated, labels):
+                break
+            labels = updated
+
+        _, labels, sizes = np.unique(labels, return_inverse=True, return_counts=True)
+        ranks = np.empty(len(sizes), dtype=np.int64)
+        ranks[np.argsort(-sizes, kind="stable")] = np.arange(len(sizes))
+        return ranks[labels]
+
+    def components(self, min_num_matches: int = 0) -> list[np.ndarray]:
+        """Returns the image ids of each connected component, largest first."""
+        if self.num_images == 0:
+            return []
+        labels = self.connected_components(min_num_matches)
+        order = np.argsort(labels, kind="stable")
+        splits = np.cumsum(np.bincount(labels))[:-1]
+        return np.split(self.image_ids[order], splits)
@@ -0,0 +1,278 @@
+# Blender Tools
+# Copyright 2024 Ralph Wiedemeier, Frame Factory GmbH
+# License: MIT
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from .database import COLMAPDatabase
+from .utils import _expand_ranges, qvecs2rotmats
+
+
+QUERY_CHUNK_SIZE = 1 << 12
+
+
+@dataclass
+class PosePriors:
+    """Pose priors of the images in a database. Images without a
+    rotation or translation prior have NaN rows in qvecs or tvecs."""
+    image_ids: np.ndarray  # (N,) int64
+    names: list[str]
+    qvecs: np.ndarray      # (N, 4) float64
+    tvecs: np.ndarray      # (N, 3) float64
+
+    def __len__(self):
+        return len(self.image_ids)
+
+    @property
+    def has_position(self) -> np.ndarray:
+        return ~np.isnan(self.tvecs).any(axis=1)
+
+    @property
+    def has_rotation(self) -> np.ndarray:
+        return ~np.isnan(self.qvecs).any(axis=1)
+
+    def view_directions(self) -> np.ndarray:
+        """Returns the viewing directions (the camera z axes in world
+        coordinates), NaN for images without rotation prior."""
+        directions = np.full((len(self), 3), np.nan)
+        has_rotation = self.has_rotation
+        qvecs = self.qvecs[has_rotation]
+        qvecs = qvecs / np.linalg.norm(qvecs, axis=1, keepdims=True)
+        directions[has_rotation] = qvecs2rotmats(qvecs)[:, 2, :]
+        return directions
+
+
+def read_pose_priors(db: COLMAPDatabase) -> PosePriors:
+    """
+    Reads the pose priors of all images from the images table. As in COLMAP's
+    spatial matcher, prior_t is interpreted as the camera position, prior_q as the
+    world to camera rotation.
+    """
+    rows = db.execute(
+        "SELECT image_id, name, prior_qw, prior_qx, prior_qy, prior_qz, "
+        "prior_tx, prior_ty, prior_tz FROM images ORDER BY image_id").fetchall()
+
+    image_ids = np.array([row[0] for row in rows], dtype=np.int64)
+    names = [row[1] for row in rows]
+    priors = np.array([row[2:] for row in rows], dtype=np.float64).reshape(-1, 7)
+    return PosePriors(image_ids=image_ids, names=names, qvecs=priors[:, :4], tvecs=priors[:, 4:])
+
+
+class PositionGrid:
+    """
+    Uniform grid over a set of 3D positions for neighborhood queries. Positions
+    are sorted by the key of their grid cell, the positions in a block of cells
+    are found by searching the sorted keys.
+    """
+
+    def __init__(self, positions: np.ndarray, cell_size: Optional[float] = None, points_per_cell: int = 8):
+        """Creates the grid with the given cell size. If no cell size is given,
+        it is chosen such that each occupied cell contains about points_per_cell
+        positions, assuming they are uniformly distributed over their bounding box
+        (in as many dimensions as they span)."""
+        self.positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        self.cell_size = cell_size or self._estimate_cell_size(points_per_cell)
+
+        self.origin = self.positions.min(axis=0) if len(self.positions) else np.zeros(3)
+        self.cells = np.floor((self.positions - self.origin) / self.cell_size).astype(np.int64)
+        self.dims = self.cells.max(axis=0) + 1 if len(self.positions) else np.ones(3, dtype=np.int64)
+
+        keys = self._keys(self.cells)
+        self.order = np.argsort(keys, kind="stable")
+        self.sorted_keys = keys[self.order]
+
+    def __len__(self):
+        return len(self.positions)
+
+    def _estimate_cell_size(self, points_per_cell: int) -> float:
+        if len(self.positions) < 2:
+            return 1.0
+        extent = np.ptp(self.positions, axis=0)
+        spanned = extent[extent > extent.max() * 1e-6]
+        if len(spanned) == 0:
+            return 1.0
+        volume_per_point = np.prod(spanned) / len(self.positions)
+        return float((volume_per_point * points_per_cell) ** (1 / len(spanned)))
+
+    def _keys(self, cells: np.ndarray) -> np.ndarray:
+        return cells[..., 0] + self.dims[0] * (cells[..., 1] + self.dims[1] * cells[..., 2])
+
+    def candidates(self, rows: np.ndarray, radius_cells: int) -> tuple[np.ndarray, np.ndarray]:
+        """Returns pairs of the given query rows and all rows in the block of cells
+        within radius_cells of the query's cell (including the query itself)."""
+        steps = np.arange(-radius_cells, radius_cells + 1)
+        offsets = np.stack(np.meshgrid(steps, steps, steps, indexing="ij"), axis=-1).reshape(-1, 3)
+
+        # only offsets in dimensions the grid extends in
+        offsets = offsets[np.all(np.abs(offsets) < self.dims, axis=1)]
+
+        cells = self.cells[rows][:, None, :] + offsets[None, :, :]
+        valid = np.all((cells >= 0) & (cells < self.dims), axis=2)
+        queries = np.broadcast_to(rows[:, None], valid.shape)[valid]
+        keys = self._keys(cells[valid])
+
+        starts = np.searchsorted(self.sorted_keys, keys, side="left")
+        lengths = np.searchsorted(self.sorted_keys, keys, side="right") - starts
+        return np.repeat(queries, lengths), self.order[_expand_ranges(starts, lengths)]
+
+    def radius_pairs(self, radius: float) -> tuple[np.ndarray, np.ndarray]:
+        """Returns all pairs of rows (row1 < row2) with positions
+        within the given distance."""
+        radius_cells = max(int(np.ceil(radius / self.cell_size)), 1)
+        rows1, rows2 = [], []
+        for start in range(0, len(self), QUERY_CHUNK_SIZE):
+            queries = np.arange(start, min(start + QUERY_CHUNK_SIZE, len(self)))
+            q, c = self.candidates(queries, radius_cells)
+            keep = q < c
+            q, c = q[keep], c[keep]
+            distances = np.linalg.norm(self.positions[q] - self.positions[c], axis=1)
+            within = distances <= radius
+            rows1.append(q[within])
+            rows2.append(c[within])
+
+        return _concatenate(rows1), _concatenate(rows2)
+
+    def nearest_neighbors(self, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the rows of the k nearest neighbors of each position as a
+        (N, k) array, with the distances. Missing neighbors are -1 / inf.
+        The block of cells searched around a query grows until it contains
+        the k nearest neighbors."""
+        num = len(self)
+        k = min(k, max(num - 1, 0))
+        neighbors = np.full((num, k), -1, dtype=np.int64)
+        distances = np.full((num, k), np.inf)
+        if k == 0:
+            return neighbors, distances
+
+        pending = np.arange(num)
+        radius_cells = 1
+        max_radius_cells = int(self.dims.max())
+        while len(pending) > 0:
+            unresolved = []
+            num_offsets = np.prod(np.minimum(2 * radius_cells + 1, 2 * self.dims - 1))
+            chunk_size = max(QUERY_CHUNK_SIZE * 27 // int(num_offsets), 1)
+            for start in range(0, len(pending), chunk_size):
+                queries = pending[start:start + chunk_size]
+                q, c = self.candidates(queries, radius_cells)
+                keep = q != c
+                q, c = q[keep], c[keep]
+                d = np.linalg.norm(self.positions[q] - self.positions[c], axis=1)
+
+                # arrange the candidate distances in a padded (queries, candidates) matrix,
+                # the candidates are grouped by query in the order of the queries
+                local = np.searchsorted(queries, q)
+                counts = np.bincount(local, minlength=len(queries))
+                column = np.arange(len(q)) - (np.cumsum(counts) - counts)[local]
+                width = max(int(counts.max()), k)
+                padded_distances = np.full((len(queries), width), np.inf)
+                padded_rows = np.full((len(queries), width), -1, dtype=np.int64)
+                padded_distances[local, column] = d
+                padded_rows[local, column] = c
+
+                nearest = np.argpartition(padded_distances, k - 1, axis=1)[:, :k]
+                nearest_distances = np.take_along_axis(padded_distances, nearest, axis=1)
+                order = np.argsort(nearest_distances, axis=1, kind="stable")
+                nearest = np.take_along_axis(nearest, order, axis=1)
+                nearest_distances = np.take_along_axis(nearest_distances, order, axis=1)
+
+                # neighbors beyond the searched block could be closer than the kth candidate
+                kth = nearest_distances[:, k - 1]
+                resolved = (kth <= radius_cells * self.cell_size) | (radius_cells >= max_radius_cells)
+                unresolved.append(queries[~resolved])
+
+                resolved_queries = queries[resolved]
+                neighbors[resolved_queries] = np.take_along_axis(padded_rows[resolved], nearest[resolved], axis=1)
+                distances[resolved_queries] = nearest_distances[resolved]
+
+            pending = np.concatenate(unresolved)
+            radius_cells *= 2
+
+        return neighbors, distances
+
+
+def _concatenate(arrays: list[np.ndarray]) -> np.ndarray:
+    return np.concatenate(arrays) if arrays else np.empty(0, dtype=np.int64)
+
+
+def _unique_pairs(rows1: np.ndarray, rows2: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Orders each pair (row1 < row2) and removes duplicates."""
+    lower, upper = np.minimum(rows1, rows2), np.maximum(rows1, rows2)
+    num_rows = int(upper.max()) + 1 if len(upper) else 1
+    keys = np.unique(lower[lower != upper] * num_rows + upper[lower != upper])
+    return keys // num_rows, keys % num_rows
+
+
+def generate_pairs(
+    positions: np.ndarray,
+    directions: Optional[np.ndarray] = None,
+    num_neighbors: int = 20,
+    radius: Optional[float] = None,
+    max_view_angle: Optional[float] = None,
+    cell_size: Optional[float] = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Generates candidate pairs of rows (row1 < row2) from the given (N, 3) camera
+    positions. Each camera is paired with its num_neighbors nearest neighbors and,
+    if radius is given, with all cameras within the radius. If max_view_angle
+    (in degrees) and the (N, 3) viewing directions are given, pairs whose viewing
+    directions differ by more than max_view_angle are removed. Pairs with a
+    missing (NaN) direction are kept.
+    """
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+    grid = PositionGrid(positions, cell_size, points_per_cell=max(num_neighbors // 2, 1))
+
+    rows1, rows2 = [], []
+    if num_neighbors > 0:
+        neighbors, _ = grid.nearest_neighbors(num_neighbors)
+        queries = np.broadcast_to(np.arange(len(grid))[:, None], neighbors.shape)
+        found = neighbors >= 0
+        rows1.append(queries[found])
+        rows2.append(neighbors[found])
+    if radius:
+        pairs = grid.radius_pairs(radius)
+        rows1.append(pairs[0])
+        rows2.append(pairs[1])
+
+    rows1, rows2 = _unique_pairs(_concatenate(rows1), _concatenate(rows2))
+
+    if max_view_angle is not None and directions is not None:
+        directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+        cosines = np.einsum("ij,ij->i", directions[rows1], directions[rows2])
+        keep = np.isnan(cosines) | (cosines >= np.cos(np.radians(max_view_angle)))
+        rows1, rows2 = rows1[keep], rows2[keep]
+
+    return rows1, rows2
+
+
+def generate_pairs_from_database(
+    db: COLMAPDatabase,
+    num_neighbors: int = 20,
+    radius: Optional[float] = None,
+    max_view_angle: Optional[float] = None,
+    cell_size: Optional[float] = None,
+) -> tuple[list[str], list[str]]:
+    """
+    Generates candidate match pairs from the pose priors in the images table of
+    the given database, see `generate_pairs`. Images without position prior are
+    not paired. Returns the image names of the pairs.
+    """
+    priors = read_pose_priors(db)
+    rows = np.flatnonzero(priors.has_position)
+    directions = priors.view_directions()[rows] if max_view_angle is not None else None
+
+    rows1, rows2 = generate_pairs(
+        priors.tvecs[rows], directions, num_neighbors, radius, max_view_angle, cell_size)
+
+    names = priors.names
+    return [names[row] for row in rows[rows1].tolist()], [names[row] for row in rows[rows2].tolist()]
+
+
+def write_match_list(path: str|Path, names1: list[str], names2: list[str]):
+    """Writes the image pairs in COLMAP's match list format, which is
+    read by the matches_importer with --match_type pairs."""
+    with open(path, "w") as fid:
+        fid.writelines(f"{name1} {name2}\n" for name1, name2 in zip(names1, names2))
@@ -0,0 +1,272 @@
+# Blender Tools
+# Copyright 2024 Ralph Wiedemeier, Frame Factory GmbH
+# License: MIT
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from .reconstruction import IdIndex, Reconstruction
+from .utils import (
+    CAMERA_MODEL_IDS,
+    CAMERA_MODEL_NAMES,
+    SINGLE_FOCAL_LENGTH_MODELS,
+    camera_intrinsics,
+)
+
+
+EPSILON = np.finfo(np.float64).eps
+
+OBSERVATION_CHUNK_SIZE = 1 << 18
+
+
+def _fisheye(u, v):
+    """Returns the fisheye angle theta of the normalized coordinates
+    and their radius (1 where the radius vanishes)."""
+    radius = np.sqrt(u * u + v * v)
+    theta = np.arctan(radius)
+    radius = np.where(radius > EPSILON, radius, 1.0)
+    return theta, radius
+
+
+def _fisheye_distortion(u, v, coeffs):
+    """Applies theta_d = theta * (1 + k1 theta^2 + k2 theta^4 + ...)."""
+    theta, radius = _fisheye(u, v)
+    theta2 = theta * theta
+    poly = np.zeros_like(theta)
+    for k in reversed(coeffs):
+        poly = (poly + k) * theta2
+    factor = np.where(theta > EPSILON, theta * (1.0 + poly) / radius, 1.0)
+    return u * factor, v * factor
+
+
+def distort(model_name: str, extra_params: np.ndarray, u: np.ndarray, v: np.ndarray):
+    """
+    Maps the normalized (undistorted) image coordinates u, v to distorted
+    normalized coordinates according to the given camera model.
+    extra_params are the distortion parameters following focal length and
+    principal point, either one row of parameters or one row per coordinate.
+    see: src/base/camera_models.h
+    """
+    p = np.asarray(extra_params, dtype=np.float64)
+    p = [p[..., i] for i in range(p.shape[-1])]
+
+    if model_name in ("SIMPLE_PINHOLE", "PINHOLE"):
+        return u, v
+
+    if model_name in ("SIMPLE_RADIAL", "RADIAL"):
+        r2 = u * u + v * v
+        radial = p[0] * r2
+        if model_name == "RADIAL":
+            radial = radial + p[1] * r2 * r2
+        return u + u * radial, v + v * radial
+
+    if model_name in ("OPENCV", "FULL_OPENCV"):
+        u2, v2, uv = u * u, v * v, u * v
+        r2 = u2 + v2
+        if model_name == "OPENCV":
+            k1, k2, p1, p2 = p
+            radial = 1.0 + r2 * (k1 + r2 * k2)
+        else:
+            k1, k2, p1, p2, k3, k4, k5, k6 = p
+            radial = ((1.0 + r2 * (k1 + r2 * (k2 + r2 * k3)))
+                      / (1.0 + r2 * (k4 + r2 * (k5 + r2 * k6))))
+        x = u * radial + 2.0 * p1 * uv + p2 * (r2 + 2.0 * u2)
+        y = v * radial + 2.0 * p2 * uv + p1 * (r2 + 2.0 * v2)
+        return x, y
+
+    if model_name in ("OPENCV_FISHEYE", "SIMPLE_RADIAL_FISHEYE", "RADIAL_FISHEYE"):
+        return _fisheye_distortion(u, v, p)
+
+    if model_name == "FOV":
+        omega = p[0]
+        r2 = u * u + v * v
+        omega2 = omega * omega
+        tan_half_omega = np.tan(omega * 0.5)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            radius = np.sqrt(r2)
+            factor = np.where(
+                omega2 < 1e-4,
+                omega2 * r2 / 3.0 - omega2 / 12.0 + 1.0,
+                np.where(
+                    r2 < 1e-4,
+                    -2.0 * tan_half_omega * (4.0 * r2 * tan_half_omega * tan_half_omega - 3.0)
+                    / (3.0 * omega),
+                    np.arctan(radius * 2.0 * tan_half_omega) / (radius * omega)))
+        return u * factor, v * factor
+
+    if model_name == "THIN_PRISM_FISHEYE":
+        k1, k2, p1, p2, k3, k4, sx1, sy1 = p
+        theta, radius = _fisheye(u, v)
+        factor = np.where(theta > EPSILON, theta / radius, 1.0)
+        u, v = u * factor, v * factor
+        u2, v2, uv = u * u, v * v, u * v
+        r2 = u2 + v2
+        radial = r2 * (k1 + r2 * (k2 + r2 * (k3 + r2 * k4)))
+        x = u + u * radial + 2.0 * p1 * uv + p2 * (r2 + 2.0 * u2) + sx1 * r2
+        y = v + v * radial + 2.0 * p2 * uv + p1 * (r2 + 2.0 * v2) + sy1 * r2
+        return x, y
+
+    raise ValueError(f"unsupported camera model: {model_name}")
+
+
+def project_points(model_name: str, params: np.ndarray, points_cam: np.ndarray) -> np.ndarray:
+    """
+    Projects the (N, 3) points given in camera coordinates to (N, 2) pixel
+    coordinates. params are the camera parameters, either a single row or one
+    row per point. Points at or behind the image plane project to NaN.
+    """
+    num_params = CAMERA_MODEL_NAMES[model_name].num_params
+    params = np.asarray(params, dtype=np.float64)
+    points_cam = np.asarray(points_cam, dtype=np.float64).reshape(-1, 3)
+
+    fx, fy, cx, cy = camera_intrinsics(model_name, params)
+    num_intrinsics = 3 if model_name in SINGLE_FOCAL_LENGTH_MODELS else 4
+    extra_params = params.reshape(-1, num_params)[:, num_intrinsics:]
+    if len(extra_params) == 1:
+        extra_params = extra_params[0]
+
+    z = points_cam[:, 2]
+    in_front = z > EPSILON
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = np.where(in_front, z, np.nan)
+        x, y = distort(model_name, extra_params, points_cam[:, 0] / z, points_cam[:, 1] / z)
+
+    return np.stack([fx * x + cx, fy * y + cy], axis=1)
+
+
+def world_to_camera(rotmats: np.ndarray, tvecs: np.ndarray, xyz: np.ndarray) -> np.ndarray:
+    """Transforms the (N, 3) world points with the per-point (N, 3, 3)
+    rotations and (N, 3) translations to camera coordinates."""
+    return np.einsum("nij,nj->ni", rotmats, xyz) + tvecs
+
+
+@dataclass
+class ErrorStats:
+    """Reprojection error statistics per image or per 3D point. Rows
+    without valid observations have count 0 and NaN statistics."""
+    count: np.ndarray   # (N,) int64
+    mean: np.ndarray    # (N,) float64
+    rms: np.ndarray     # (N,) float64
+    median: np.ndarray  # (N,) float64
+    max: np.ndarray     # (N,) float64
+
+
+def group_error_stats(groups: np.ndarray, errors: np.ndarray, num_groups: int) -> ErrorStats:
+    """Computes the statistics of the errors grouped by the given row indices.
+    NaN errors are ignored."""
+    valid = ~np.isnan(errors)
+    groups, errors = groups[valid], errors[valid]
+
+    count = np.bincount(groups, minlength=num_groups)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.bincount(groups, errors, num_groups) / count
+        rms = np.sqrt(np.bincount(groups, errors * errors, num_groups) / count)
+
+    order = np.lexsort((errors, groups))
+    sorted_errors = errors[order]
+    starts = np.cumsum(count) - count
+    has_errors = count > 0
+    lower = sorted_errors[(starts + (count - 1) // 2)[has_errors]]
+    upper = sorted_errors[(starts + count // 2)[has_errors]]
+    median = np.full(num_groups, np.nan)
+    median[has_errors] = (lower + upper) * 0.5
+    maximum = np.full(num_groups, np.nan)
+    maximum[has_errors] = sorted_errors[(starts + count - 1)[has_errors]]
+
+    return ErrorStats(count=count, mean=mean, rms=rms, median=median, max=maximum)
+
+
+@dataclass
+class ReprojectionErrors:
+    """Reprojection errors of all observations of a reconstruction, i.e. of all
+    2D points with a 3D point. Observation i is the 2D point point2D_idxs[i] of
+    the image in row image_rows[i], observing the 3D point in row point3D_rows[i].
+    Errors of points behind the camera are NaN."""
+    image_rows: np.ndarray    # (O,) int64
+    point2D_idxs: np.ndarray  # (O,) int64
+    point3D_rows: np.ndarray  # (O,) int64
+    errors: np.ndarray        # (O,) float64
+    num_images: int
+    num_points3D: int
+
+    def __len__(self):
+        return len(self.errors)
+
+    def per_image(self) -> ErrorStats:
+        return group_error_stats(self.image_rows, self.errors, self.num_images)
+
+    def per_point(self) -> ErrorStats:
+        return group_error_stats(self.point3D_rows, self.errors, self.num_points3D)
+
+    def summary(self) -> dict:
+        """Returns the overall statistics as a dictionary."""
+        valid = self.errors[~np.isnan(self.errors)]
+        return dict(
+            num_observations=len(self.errors),
+            num_invalid=len(self.errors) - len(valid),
+            mean=float(valid.mean()) if len(valid) else float("nan"),
+            rms=float(np.sqrt(np.mean(valid * valid))) if len(valid) else float("nan"),
+            median=float(np.median(valid)) if len(valid) else float("nan"),
+            max=float(valid.max()) if len(valid) else float("nan"),
+        )
+
+
+def compute_reprojection_errors(
+    reconstruction: Reconstruction,
+    max_workers: Optional[int] = None,
+    chunk_size: int = OBSERVATION_CHUNK_SIZE,
+) -> ReprojectionErrors:
+    """
+    Projects the 3D points of the reconstruction into all images observing them and
+    returns the distances to the observed 2D points. The observations are processed
+    in chunks of chunk_size on a thread pool with max_workers threads.
+    """
+    rec = reconstruction
+    if rec.points3D is None:
+        raise ValueError("reconstruction has no 3D points")
+
+    observations = np.flatnonzero(rec.point3D_ids >= 0)
+    point3D_rows = IdIndex(rec.points3D.ids).rows(rec.point3D_ids[observations])
+
+    image_rows = np.repeat(np.arange(rec.num_images), rec.num_points2D)[observations]
+    point2D_idxs = observations - rec.point2D_offsets[image_rows]
+
+    rotmats = rec.rotmats()
+    camera_rows = rec.image_camera_rows
+    errors = np.empty(len(observations), dtype=np.float64)
+
+    def process(start: int):
+        end = min(start + chunk_size, len(observations))
+        rows = image_rows[start:end]
+        points_cam = world_to_camera(
+            rotmats[rows], rec.tvecs[rows], rec.points3D.xyz[point3D_rows[start:end]])
+        observed = rec.xys[observations[start:end]]
+        cams = camera_rows[rows]
+        models = rec.camera_model_ids[cams]
+
+        for model_id in np.unique(models).tolist():
+            model_name = CAMERA_MODEL_IDS[model_id].model_name
+            mask = models == model_id
+            params = rec.camera_params[model_name][rec.camera_param_rows[cams[mask]]]
+            projected = project_points(model_name, params, points_cam[mask])
+            errors[start:end][mask] = np.linalg.norm(projected - observed[mask], axis=1)
+
+    starts = range(0, len(observations), chunk_size)
+    if max_workers == 1 or len(starts) <= 1:
+        for start in starts:
+            process(start)
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(process, starts))
+
+    return ReprojectionErrors(
+        image_rows=image_rows,
+        point2D_idxs=point2D_idxs,
+        point3D_rows=point3D_rows,
+        errors=errors,
+        num_images=rec.num_images,
+        num_points3D=len(rec.points3D),
+    )
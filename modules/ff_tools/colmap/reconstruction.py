@@ -0,0 +1,467 @@
+# Blender Tools
+# Copyright 2024 Ralph Wiedemeier, Frame Factory GmbH
+# License: MIT
+
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from .utils import (
+    Camera,
+    Image,
+    Points3D,
+    CAMERA_MODEL_IDS,
+    CAMERA_MODEL_NAMES,
+    blender_matrices_world,
+    camera_centers,
+    camera_intrinsics,
+    qvec2rotmat,
+    qvecs2rotmats,
+    read_cameras_binary,
+    read_cameras_text_chunked,
+    read_points3D_binary,
+    read_points3D_text,
+    write_cameras_binary,
+    write_cameras_text,
+    write_points3D_binary,
+    write_points3D_text,
+    _read_images_binary_arrays,
+    _read_images_text_arrays,
+    _write_images_binary_arrays,
+    _write_images_text_arrays,
+)
+
+
+class IdIndex:
+    """Maps ids to row indices, for single ids through a dictionary
+    and for arrays of ids through a sorted search."""
+
+    def __init__(self, ids: np.ndarray):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self._order = np.argsort(self.ids, kind="stable")
+        self._sorted_ids = self.ids[self._order]
+        self._rows = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, id) -> bool:
+        return int(id) in self._row_dict()
+
+    def row(self, id) -> int:
+        """Returns the row index of the given id, raises KeyError if not found."""
+        return self._row_dict()[int(id)]
+
+    def rows(self, ids) -> np.ndarray:
+        """Returns the row indices of the given array of ids,
+        raises KeyError if any of the ids is not found."""
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(self._sorted_ids) == 0:
+            if ids.size > 0:
+                raise KeyError(f"unknown ids: {ids.ravel()[:10].tolist()}")
+            return np.empty(ids.shape, dtype=np.int64)
+
+        pos = np.searchsorted(self._sorted_ids, ids).clip(max=len(self._sorted_ids) - 1)
+        found = self._sorted_ids[pos] == ids
+        if not np.all(found):
+            raise KeyError(f"unknown ids: {ids[~found][:10].tolist()}")
+        return self._order[pos]
+
+    def _row_dict(self) -> dict:
+        if self._rows is None:
+            self._rows = dict(zip(self.ids.tolist(), range(len(self.ids))))
+        return self._rows
+
+
+class CameraView:
+    """Lightweight view on one camera of a reconstruction, provides the
+    same attributes as utils.Camera."""
+    __slots__ = ("_reconstruction", "_row")
+
+    def __init__(self, reconstruction: "Reconstruction", row: int):
+        self._reconstruction = reconstruction
+        self._row = row
+
+    def __repr__(self):
+        return (f"CameraView(id={self.id}, model={self.model}, "
+                f"width={self.width}, height={self.height}, params={self.params})")
+
+    @property
+    def id(self) -> int:
+        return int(self._reconstruction.camera_ids[self._row])
+
+    @property
+    def model(self) -> str:
+        return CAMERA_MODEL_IDS[int(self._reconstruction.camera_model_ids[self._row])].model_name
+
+    @property
+    def width(self) -> int:
+        return int(self._reconstruction.camera_widths[self._row])
+
+    @property
+    def height(self) -> int:
+        return int(self._reconstruction.camera_heights[self._row])
+
+    @property
+    def params(self) -> np.ndarray:
+        rec = self._reconstruction
+        return rec.camera_params[self.model][rec.camera_param_rows[self._row]]
+
+    @params.setter
+    def params(self, value):
+        self.params[:] = value
+
+
+class ImageView:
+    """Lightweight view on one image of a reconstruction, provides the
+    same attributes as utils.Image. Arrays are views into the arrays
+    of the reconstruction."""
+    __slots__ = ("_reconstruction", "_row")
+
+    def __init__(self, reconstruction: "Reconstruction", row: int):
+        self._reconstruction = reconstruction
+        self._row = row
+
+    def __repr__(self):
+        return (f"ImageView(id={self.id}, name={self.name!r}, camera_id={self.camera_id}, "
+                f"qvec={self.qvec}, tvec={self.tvec}, num_points2D={len(self.point3D_ids)})")
+
+    @property
+    def id(self) -> int:
+        return int(self._reconstruction.image_ids[self._row])
+
+    @property
+    def qvec(self) -> np.ndarray:
+        return self._reconstruction.qvecs[self._row]
+
+    @qvec.setter
+    def qvec(self, value):
+        self._reconstruction.qvecs[self._row] = value
+
+    @property
+    def tvec(self) -> np.ndarray:
+        return self._reconstruction.tvecs[self._row]
+
+    @tvec.setter
+    def tvec(self, value):
+        self._reconstruction.tvecs[self._row] = value
+
+    @property
+    def camera_id(self) -> int:
+        return int(self._reconstruction.image_camera_ids[self._row])
+
+    @property
+    def name(self) -> str:
+        return self._reconstruction.names[self._row]
+
+    @property
+    def path(self) -> str:
+        return self._reconstruction.names[self._row]
+
+    @property
+    def xys(self) -> np.ndarray:
+        rec = self._reconstruction
+        start, end = rec.point2D_offsets[self._row], rec.point2D_offsets[self._row + 1]
+        return rec.xys[start:end]
+
+    @property
+    def point3D_ids(self) -> np.ndarray:
+        rec = self._reconstruction
+        start, end = rec.point2D_offsets[self._row], rec.point2D_offsets[self._row + 1]
+        return rec.point3D_ids[start:end]
+
+    def qvec2rotmat(self):
+        return qvec2rotmat(self.qvec)
+
+    def camera_center(self) -> np.ndarray:
+        return camera_centers(self.qvec, self.tvec)[0]
+
+    def blender_matrix_world(self) -> np.ndarray:
+        return blender_matrices_world(self.qvec, self.tvec)[0]
+
+
+class ViewMapping(Mapping):
+    """Read-only, dictionary-like access to camera or image views by id."""
+
+    def __init__(self, reconstruction: "Reconstruction", index: IdIndex, view_type: type):
+        self._reconstruction = reconstruction
+        self._index = index
+        self._view_type = view_type
+
+    def __getitem__(self, id):
+        return self._view_type(self._reconstruction, self._index.row(id))
+
+    def __iter__(self):
+        return iter(self._index.ids.tolist())
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, id):
+        return id in self._index
+
+
+class Reconstruction:
+    """
+    Array-backed container for a COLMAP model. Cameras, images and
+    3D points are stored in contiguous arrays, the 2D points of image i
+    are the rows point2D_offsets[i]:point2D_offsets[i + 1] of xys and
+    point3D_ids. Camera parameters are grouped by camera model, the
+    parameters of camera i are camera_params[model][camera_param_rows[i]].
+    Per-camera and per-image access is available through the cameras
+    and images mappings, which return lightweight views.
+    """
+
+    def __init__(
+        self,
+        *,
+        camera_ids: np.ndarray,
+        camera_model_ids: np.ndarray,
+        camera_widths: np.ndarray,
+        camera_heights: np.ndarray,
+        camera_params: list[np.ndarray],
+        image_ids: np.ndarray,
+        qvecs: np.ndarray,
+        tvecs: np.ndarray,
+        image_camera_ids: np.ndarray,
+        names: list[str],
+        point2D_offsets: Optional[np.ndarray] = None,
+        xys: Optional[np.ndarray] = None,
+        point3D_ids: Optional[np.ndarray] = None,
+        points3D: Optional[Points3D] = None,
+    ):
+        """Constructs a reconstruction from per-camera and per-image arrays.
+        camera_params is a list with the parameter array of each camera."""
+        self.camera_ids = np.asarray(camera_ids, dtype=np.int64)
+        self.camera_model_ids = np.asarray(camera_model_ids, dtype=np.int64)
+        self.camera_widths = np.asarray(camera_widths, dtype=np.int64)
+        self.camera_heights = np.asarray(camera_heights, dtype=np.int64)
+        self._group_camera_params(camera_params)
+
+        num_images = len(image_ids)
+        self.image_ids = np.asarray(image_ids, dtype=np.int64)
+        self.qvecs = np.ascontiguousarray(qvecs, dtype=np.float64).reshape(num_images, 4)
+        self.tvecs = np.ascontiguousarray(tvecs, dtype=np.float64).reshape(num_images, 3)
+        self.image_camera_ids = np.asarray(image_camera_ids, dtype=np.int64)
+        self.names = list(names)
+
+        if point2D_offsets is None:
+            point2D_offsets = np.zeros(num_images + 1, dtype=np.int64)
+        if xys is None:
+            xys = np.empty((0, 2), dtype=np.float64)
+        if point3D_ids is None:
+            point3D_ids = np.empty(0, dtype=np.int64)
+
+        self.point2D_offsets = np.asarray(point2D_offsets, dtype=np.int64)
+        self.xys = np.ascontiguousarray(xys, dtype=np.float64).reshape(-1, 2)
+        self.point3D_ids = np.asarray(point3D_ids, dtype=np.int64)
+        self.points3D = points3D
+
+        self.camera_index = IdIndex(self.camera_ids)
+        self.image_index = IdIndex(self.image_ids)
+        self._name_rows = None
+
+        self.cameras = ViewMapping(self, self.camera_index, CameraView)
+        self.images = ViewMapping(self, self.image_index, ImageView)
+
+    def __repr__(self):
+        num_points3D = len(self.points3D) if self.points3D is not None else 0
+        return (f"Reconstruction(cameras={self.num_cameras}, images={self.num_images}, "
+                f"points2D={len(self.point3D_ids)}, points3D={num_points3D})")
+
+    @property
+    def num_cameras(self) -> int:
+        return len(self.camera_ids)
+
+    @property
+    def num_images(self) -> int:
+        return len(self.image_ids)
+
+    @property
+    def num_points2D(self) -> np.ndarray:
+        """Number of 2D points of each image."""
+        return np.diff(self.point2D_offsets)
+
+    @property
+    def image_camera_rows(self) -> np.ndarray:
+        """Camera row index of each image."""
+        return self.camera_index.rows(self.image_camera_ids)
+
+    def camera_intrinsics(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Focal lengths and principal points (fx, fy, cx, cy) of all cameras."""
+        intrinsics = np.empty((4, self.num_cameras), dtype=np.float64)
+        for model_name, params in self.camera_params.items():
+            model_id = CAMERA_MODEL_NAMES[model_name].model_id
+            rows = np.flatnonzero(self.camera_model_ids == model_id)
+            intrinsics[:, rows] = np.stack(camera_intrinsics(model_name, params))
+        return tuple(intrinsics)
+
+    def rotmats(self) -> np.ndarray:
+        """World-to-camera rotation matrices of all images, (N, 3, 3)."""
+        return qvecs2rotmats(self.qvecs)
+
+    def camera_centers(self) -> np.ndarray:
+        """World space camera centers of all images, (N, 3)."""
+        return camera_centers(self.qvecs, self.tvecs)
+
+    def blender_matrices_world(self) -> np.ndarray:
+        """Blender camera object matrix_world of all images, (N, 4, 4)."""
+        return blender_matrices_world(self.qvecs, self.tvecs)
+
+    def image_row_by_name(self, name: str) -> int:
+        """Returns the row index of the image with the given name."""
+        if self._name_rows is None:
+            self._name_rows = { name: row for row, name in enumerate(self.names) }
+        return self._name_rows[name]
+
+    def image_by_name(self, name: str) -> ImageView:
+        return ImageView(self, self.image_row_by_name(name))
+
+    def image_at(self, row: int) -> ImageView:
+        return ImageView(self, row)
+
+    def camera_at(self, row: int) -> CameraView:
+        return CameraView(self, row)
+
+    def to_dicts(self, images: bool = True) -> tuple[dict[int, Camera], dict[int, Image]]:
+        """Returns the cameras and images as dictionaries of utils.Camera
+        and utils.Image, as returned by the read_* functions. If images is
+        false, only the cameras are converted."""
+        cameras = {}
+        for row, camera_id in enumerate(self.camera_ids.tolist()):
+            view = CameraView(self, row)
+            cameras[camera_id] = Camera(id=camera_id, model=view.model,
+                                        width=view.width, height=view.height,
+                                        params=view.params.copy())
+        if not images:
+            return cameras, {}
+
+        images = {}
+        for row, image_id in enumerate(self.image_ids.tolist()):
+            view = ImageView(self, row)
+            images[image_id] = Image(id=image_id, qvec=view.qvec.copy(), tvec=view.tvec.copy(),
+                                     camera_id=view.camera_id, name=view.name, path=view.path,
+                                     xys=view.xys.copy(), point3D_ids=view.point3D_ids.copy())
+        return cameras, images
+
+    def image_arrays(self) -> tuple:
+        """Returns the image arrays as tuple of (image_ids, qvecs, tvecs,
+        camera_ids, names, point2D_offsets, xys, point3D_ids)."""
+        return (self.image_ids, self.qvecs, self.tvecs, self.image_camera_ids, self.names,
+                self.point2D_offsets, self.xys, self.point3D_ids)
+
+    def write(self, path: str|Path, ext: str = ".bin"):
+        """Writes the model to the given directory, in binary (.bin)
+        or text (.txt) format."""
+        if ext not in (".bin", ".txt"):
+            raise ValueError(f"invalid model format: '{ext}', expected '.bin' or '.txt'")
+
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        cameras, _ = self.to_dicts(images=False)
+
+        if ext == ".bin":
+            write_cameras_binary(cameras, path / "cameras.bin")
+            _write_images_binary_arrays(self.image_arrays(), path / "images.bin")
+        else:
+            write_cameras_text(cameras, path / "cameras.txt")
+            _write_images_text_arrays(self.image_arrays(), path / "images.txt")
+
+        if self.points3D is not None:
+            if ext == ".bin":
+                write_points3D_binary(self.points3D, path / "points3D.bin")
+            else:
+                write_points3D_text(self.points3D, path / "points3D.txt")
+
+    def _group_camera_params(self, camera_params: list[np.ndarray]):
+        self.camera_params: dict[str, np.ndarray] = {}
+        self.camera_param_rows = np.zeros(len(self.camera_ids), dtype=np.int64)
+
+        for model_id in np.unique(self.camera_model_ids).tolist():
+            camera_model = CAMERA_MODEL_IDS[model_id]
+            rows = np.flatnonzero(self.camera_model_ids == model_id)
+            params = np.empty((len(rows), camera_model.num_params), dtype=np.float64)
+            for i, row in enumerate(rows.tolist()):
+                params[i] = camera_params[row]
+            self.camera_params[camera_model.model_name] = params
+            self.camera_param_rows[rows] = np.arange(len(rows))
+
+    @staticmethod
+    def _camera_arrays(cameras: dict[int, Camera]) -> dict:
+        camera_list = list(cameras.values())
+        return dict(
+            camera_ids=[camera.id for camera in camera_list],
+            camera_model_ids=[CAMERA_MODEL_NAMES[camera.model].model_id for camera in camera_list],
+            camera_widths=[camera.width for camera in camera_list],
+            camera_heights=[camera.height for camera in camera_list],
+            camera_params=[camera.params for camera in camera_list],
+        )
+
+    @classmethod
+    def from_dicts(
+        cls,
+        cameras: dict[int, Camera],
+        images: dict[int, Image],
+        points3D: Optional[Points3D] = None,
+    ) -> "Reconstruction":
+        """Creates a reconstruction from the dictionaries returned
+        by the read_cameras_* and read_images_* functions."""
+        image_list = list(images.values())
+
+        num_points2D = np.array([len(image.point3D_ids) for image in image_list], dtype=np.int64)
+        point2D_offsets = np.zeros(len(image_list) + 1, dtype=np.int64)
+        np.cumsum(num_points2D, out=point2D_offsets[1:])
+        xys = [np.reshape(image.xys, (-1, 2)) for image in image_list]
+        point3D_ids = [np.asarray(image.point3D_ids, dtype=np.int64) for image in image_list]
+
+        return cls(
+            **cls._camera_arrays(cameras),
+            image_ids=[image.id for image in image_list],
+            qvecs=np.reshape([image.qvec for image in image_list], (-1, 4)),
+            tvecs=np.reshape([image.tvec for image in image_list], (-1, 3)),
+            image_camera_ids=[image.camera_id for image in image_list],
+            names=[image.name for image in image_list],
+            point2D_offsets=point2D_offsets,
+            xys=np.concatenate(xys) if xys else None,
+            point3D_ids=np.concatenate(point3D_ids) if point3D_ids else None,
+            points3D=points3D,
+        )
+
+    @classmethod
+    def read(cls, path: str|Path, ext: str = "") -> "Reconstruction":
+        """Reads a COLMAP model from the given directory. The format is
+        detected from the file extension (.bin or .txt), unless given."""
+        path = Path(path)
+        if not ext:
+            ext = ".bin" if (path / "cameras.bin").exists() else ".txt"
+        elif ext not in (".bin", ".txt"):
+            raise ValueError(f"invalid model format: '{ext}', expected '.bin' or '.txt'")
+
+        points3D_path = path / f"points3D{ext}"
+
+        if ext == ".bin":
+            cameras = read_cameras_binary(path / "cameras.bin")
+            image_arrays = _read_images_binary_arrays(path / "images.bin")
+            points3D = read_points3D_binary(points3D_path) if points3D_path.exists() else None
+        else:
+            cameras = read_cameras_text_chunked(path / "cameras.txt")
+            image_arrays = _read_images_text_arrays(path / "images.txt")
+            points3D = read_points3D_text(points3D_path) if points3D_path.exists() else None
+
+        (image_ids, qvecs, tvecs, camera_ids, names,
+         point2D_offsets, xys, point3D_ids) = image_arrays
+
+        return cls(
+            **cls._camera_arrays(cameras),
+            image_ids=image_ids,
+            qvecs=qvecs,
+            tvecs=tvecs,
+            image_camera_ids=camera_ids,
+            names=names,
+            point2D_offsets=point2D_offsets,
+            xys=xys,
+            point3D_ids=point3D_ids,
+            points3D=points3D,
+        )
@@ -0,0 +1,259 @@
+# Blender Tools
+# Copyright 2024 Ralph Wiedemeier, Frame Factory GmbH
+# License: MIT
+
+from hashlib import sha1
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from .projection import distort
+from .utils import Camera, SINGLE_FOCAL_LENGTH_MODELS, camera_intrinsics
+
+
+MAX_CACHED_MAPS = 16
+
+_map_cache: dict[str, np.ndarray] = {}
+_target_cache: dict[str, Camera] = {}
+
+
+def _split_params(model_name: str, params: np.ndarray):
+    params = np.asarray(params, dtype=np.float64).reshape(-1)
+    fx, fy, cx, cy = (float(value[0]) for value in camera_intrinsics(model_name, params))
+    num_intrinsics = 3 if model_name in SINGLE_FOCAL_LENGTH_MODELS else 4
+    return fx, fy, cx, cy, params[num_intrinsics:]
+
+
+def undistort_normalized(
+    model_name: str,
+    extra_params: np.ndarray,
+    x: np.ndarray,
+    y: np.ndarray,
+    max_iterations: int = 100,
+    tolerance: float = 1e-10,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Inverts the distortion of the given camera model for the distorted normalized
+    coordinates x, y using Newton iterations with a numerical Jacobian, applied to
+    all coordinates at once. Coordinates are iterated until they converge.
+    see: src/base/camera_models.h
+        void IterativeUndistortion(const T* params, T* u, T* v)
+    """
+    x0 = np.asarray(x, dtype=np.float64).ravel()
+    y0 = np.asarray(y, dtype=np.float64).ravel()
+    u, v = x0.copy(), y0.copy()
+    active = np.arange(len(u))
+
+    for _ in range(max_iterations):
+        if len(active) == 0:
+            break
+        ua, va = u[active], v[active]
+        step_u = np.maximum(1e-6, np.abs(ua) * 1e-6)
+        step_v = np.maximum(1e-6, np.abs(va) * 1e-6)
+
+        dx, dy = distort(model_name, extra_params, ua, va)
+        xu1, yu1 = distort(model_name, extra_params, ua + step_u, va)
+        xu0, yu0 = distort(model_name, extra_params, ua - step_u, va)
+        xv1, yv1 = distort(model_name, extra_params, ua, va + step_v)
+        xv0, yv0 = distort(model_name, extra_params, ua, va - step_v)
+
+        j00 = (xu1 - xu0) / (2.0 * step_u)
+        j10 = (yu1 - yu0) / (2.0 * step_u)
+        j01 = (xv1 - xv0) / (2.0 * step_v)
+        j11 = (yv1 - yv0) / (2.0 * step_v)
+        det = j00 * j11 - j01 * j10
+
+        rx, ry = dx - x0[active], dy - y0[active]
+        delta_u = (j11 * rx - j01 * ry) / det
+        delta_v = (j00 * ry - j10 * rx) / det
+        u[active] = ua - delta_u
+        v[active] = va - delta_v
+
+        converged = delta_u * delta_u + delta_v * delta_v < tolerance
+        active = active[~converged]
+
+    return u.reshape(np.shape(x)), v.reshape(np.shape(y))
+
+
+def undistort_points(camera: Camera, xy: np.ndarray, **kwargs) -> np.ndarray:
+    """Removes the distortion from the given (N, 2) pixel coordinates, returns
+    the corresponding pixel coordinates of a pinhole camera with the same
+    focal length and principal point."""
+    fx, fy, cx, cy, extra_params = _split_params(camera.model, camera.params)
+    xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    u, v = undistort_normalized(
+        camera.model, extra_params, (xy[:, 0] - cx) / fx, (xy[:, 1] - cy) / fy, **kwargs)
+    return np.stack([u * fx + cx, v * fy + cy], axis=1)
+
+
+def undistorted_camera(camera: Camera, blank_pixels: float = 0.0, max_scale: float = 2.0) -> Camera:
+    """
+    Returns a PINHOLE camera with the focal length of the given camera, whose image
+    covers the undistorted image of the given camera. With blank_pixels = 0, the
+    undistorted image only contains valid pixels, with blank_pixels = 1 it contains
+    all pixels of the distorted image. The size of the undistorted image is limited
+    to max_scale times the size of the distorted image.
+    see: src/base/undistortion.cc
+        Camera UndistortCamera(const UndistortCameraOptions& options,
+                               const Camera& camera)
+    """
+    fx, fy, cx, cy, _ = _split_params(camera.model, camera.params)
+    width, height = camera.width, camera.height
+
+    # undistort the image border
+    xs = np.arange(width + 1, dtype=np.float64)
+    ys = np.arange(height + 1, dtype=np.float64)
+    left = undistort_points(camera, np.stack([np.zeros_like(ys), ys], axis=1))[:, 0]
+    right = undistort_points(camera, np.stack([np.full_like(ys, width), ys], axis=1))[:, 0]
+    top = undistort_points(camera, np.stack([xs, np.zeros_like(xs)], axis=1))[:, 1]
+    bottom = undistort_points(camera, np.stack([xs, np.full_like(xs, height)], axis=1))[:, 1]
+
+    def interpolate(inner, outer):
+        return inner + blank_pixels * (outer - inner)
+
+    min_x = interpolate(np.nanmax(left), np.nanmin(left))
+    max_x = interpolate(np.nanmin(right), np.nanmax(right))
+    min_y = interpolate(np.nanmax(top), np.nanmin(top))
+    max_y = interpolate(np.nanmin(bottom), np.nanmax(bottom))
+
+    # clamp the undistorted image extents around the principal point
+    min_x = max(min_x, cx - cx * max_scale)
+    max_x = min(max_x, cx + (width - cx) * max_scale)
+    min_y = max(min_y, cy - cy * max_scale)
+    max_y = min(max_y, cy + (height - cy) * max_scale)
+
+    # truncate the size as COLMAP does, so that the pixel centers lie within the extents
+    undistorted_width = max(int(max_x - min_x + 1e-6), 1)
+    undistorted_height = max(int(max_y - min_y + 1e-6), 1)
+    params = np.array([fx, fy, cx - min_x, cy - min_y], dtype=np.float64)
+
+    return Camera(id=camera.id, model="PINHOLE",
+                  width=undistorted_width, height=undistorted_height, params=params)
+
+
+def compute_undistortion_map(camera: Camera, target: Camera) -> np.ndarray:
+    """
+    Returns a (height, width, 2) float32 array with the pixel coordinates in the
+    image of the distorted camera for each pixel of the undistorted target camera.
+    """
+    fx, fy, cx, cy, extra_params = _split_params(camera.model, camera.params)
+    tfx, tfy, tcx, tcy, _ = _split_params(target.model, target.params)
+
+    u = (np.arange(target.width, dtype=np.float64) + 0.5 - tcx) / tfx
+    v = (np.arange(target.height, dtype=np.float64) + 0.5 - tcy) / tfy
+    u, v = np.meshgrid(u, v)
+    x, y = distort(camera.model, extra_params, u.ravel(), v.ravel())
+
+    grid = np.empty((target.height, target.width, 2), dtype=np.float32)
+    grid[..., 0] = (x * fx + cx - 0.5).reshape(target.height, target.width)
+    grid[..., 1] = (y * fy + cy - 0.5).reshape(target.height, target.width)
+    return grid
+
+
+def camera_key(camera: Camera) -> str:
+    """Returns a key consisting of the camera model, image size
+    and a hash of the camera parameters."""
+    digest = sha1(np.asarray(camera.params, dtype=np.float64).tobytes()).hexdigest()
+    return f"{camera.model}_{camera.width}x{camera.height}_{digest[:16]}"
+
+
+def undistortion_map_key(camera: Camera, target: Camera) -> str:
+    """Returns the cache key of the undistortion map from
+    the keys of the distorted and the target camera."""
+    target_digest = sha1(camera_key(target).encode()).hexdigest()
+    return f"{camera_key(camera)}_{target_digest[:8]}"
+
+
+def get_undistortion_map(
+    camera: Camera,
+    target: Optional[Camera] = None,
+    cache_dir: Optional[str|Path] = None,
+) -> tuple[np.ndarray, Camera]:
+    """
+    Returns the undistortion map of the given camera and the undistorted target
+    camera (default: undistorted_camera(camera)). The last MAX_CACHED_MAPS maps
+    and target cameras are cached in memory and, if cache_dir is given, maps are
+    cached on disk as .npy files which are memory-mapped when loaded again.
+    Cameras with equal model, size and parameters share a map.
+    """
+    if target is None:
+        target = _target_cache.get(camera_key(camera))
+        if target is None:
+            target = undistorted_camera(camera)
+            _cache_put(_target_cache, camera_key(camera), target)
+
+    key = undistortion_map_key(camera, target)
+
+    grid = _map_cache.get(key)
+    if grid is not None:
+        return grid, target
+
+    cache_path = Path(cache_dir) / f"{key}.npy" if cache_dir else None
+    if cache_path and cache_path.exists():
+        grid = np.load(cache_path, mmap_mode="r")
+    else:
+        grid = compute_undistortion_map(camera, target)
+        if cache_path:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = cache_path.with_suffix(".tmp.npy")
+            np.save(temp_path, grid)
+            temp_path.replace(cache_path)
+            grid = np.load(cache_path, mmap_mode="r")
+
+    _cache_put(_map_cache, key, grid)
+    return grid, target
+
+
+def _cache_put(cache: dict, key: str, value):
+    """Adds the value to the cache, dropping the oldest
+    entry if the cache holds MAX_CACHED_MAPS entries."""
+    if len(cache) >= MAX_CACHED_MAPS:
+        cache.pop(next(iter(cache)))
+    cache[key] = value
+
+
+def clear_undistortion_map_cache():
+    _map_cache.clear()
+    _target_cache.clear()
+
+
+def remap(image: np.ndarray, grid: np.ndarray, fill_value: float = 0.0) -> np.ndarray:
+    """
+    Samples the (H, W) or (H, W, C) image at the pixel coordinates of the given
+    (h, w, 2) map with bilinear interpolation. Samples outside the image are set
+    to fill_value. Returns a float32 image of size (h, w) or (h, w, C).
+    """
+    height, width = image.shape[:2]
+    x = np.asarray(grid[..., 0], dtype=np.float32)
+    y = np.asarray(grid[..., 1], dtype=np.float32)
+    inside = (x >= -0.5) & (x <= width - 0.5) & (y >= -0.5) & (y <= height - 0.5)
+
+    x = x.clip(0, width - 1)
+    y = y.clip(0, height - 1)
+    x0 = np.minimum(x.astype(np.int64), max(width - 2, 0))
+    y0 = np.minimum(y.astype(np.int64), max(height - 2, 0))
+    x1 = np.minimum(x0 + 1, width - 1)
+    y1 = np.minimum(y0 + 1, height - 1)
+    wx = x - x0
+    wy = y - y0
+
+    if image.ndim == 3:
+        wx, wy, inside = wx[..., None], wy[..., None], inside[..., None]
+
+    image = np.asarray(image, dtype=np.float32)
+    top = image[y0, x0] * (1 - wx) + image[y0, x1] * wx
+    bottom = image[y1, x0] * (1 - wx) + image[y1, x1] * wx
+    return np.where(inside, top * (1 - wy) + bottom * wy, np.float32(fill_value))
+
+
+def undistort_image(
+    image: np.ndarray,
+    camera: Camera,
+    target: Optional[Camera] = None,
+    cache_dir: Optional[str|Path] = None,
+) -> tuple[np.ndarray, Camera]:
+    """Undistorts the given image of the camera, returns the undistorted
+    image and the undistorted target camera."""
+    grid, target = get_undistortion_map(camera, target, cache_dir)
+    return remap(image, grid), target
@@ -30,7 +30,9 @@
 # Author: Johannes L. Schoenberger (jsch-at-demuc-dot-de)
 
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
+import mmap
 import struct
 
 import numpy as np
@@ -66,15 +68,55 @@ class Image:
     def qvec2rotmat(self):
         return qvec2rotmat(self.qvec)
 
+    def camera_center(self) -> np.ndarray:
+        return camera_centers(self.qvec, self.tvec)[0]
 
-# @dataclass
-# class Point3D:
-#     id: str
-#     xyz: Any
-#     rgb: Any
-#     error: Any
-#     image_ids: Any
-#     point2D_idxs: Any
+    def blender_matrix_world(self) -> np.ndarray:
+        return blender_matrices_world(self.qvec, self.tvec)[0]
+
+
+@dataclass
+class Points3D:
+    """Struct-of-arrays storage for the 3D points of a reconstruction. The
+    track of point i is stored in rows track_offsets[i]:track_offsets[i + 1]
+    of track_image_ids and track_point2D_idxs."""
+    ids: np.ndarray                 # (N,) int64
+    xyz: np.ndarray                 # (N, 3) float64
+    rgb: np.ndarray                 # (N, 3) uint8
+    error: np.ndarray               # (N,) float64
+    track_offsets: np.ndarray       # (N + 1,) int64
+    track_image_ids: np.ndarray     # (T,) uint32
+    track_point2D_idxs: np.ndarray  # (T,) uint32
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def track_lengths(self) -> np.ndarray:
+        return np.diff(self.track_offsets)
+
+    def track(self, index: int) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the image ids and 2D point indices of the track
+        of the point at the given row index."""
+        start, end = self.track_offsets[index], self.track_offsets[index + 1]
+        return (self.track_image_ids[start:end],
+                self.track_point2D_idxs[start:end])
+
+    def subset(self, indices: np.ndarray) -> "Points3D":
+        """Returns a copy containing the points at the given row indices."""
+        indices = np.asarray(indices, dtype=np.int64)
+        track_lengths = self.track_lengths[indices]
+        track_offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(track_lengths, out=track_offsets[1:])
+        track_rows = _expand_ranges(self.track_offsets[indices], track_lengths)
+        return Points3D(
+            ids=self.ids[indices],
+            xyz=self.xyz[indices],
+            rgb=self.rgb[indices],
+            error=self.error[indices],
+            track_offsets=track_offsets,
+            track_image_ids=self.track_image_ids[track_rows],
+            track_point2D_idxs=self.track_point2D_idxs[track_rows])
 
 
 CAMERA_MODELS = {
@@ -97,6 +139,62 @@ CAMERA_MODEL_IDS = dict([(camera_model.model_id, camera_model)
 CAMERA_MODEL_NAMES = dict([(camera_model.model_name, camera_model)
                            for camera_model in CAMERA_MODELS])
 
+# Camera models with a single focal length parameter. The parameters of
+# these models start with f, cx, cy, all other models start with fx, fy,
+# cx, cy, see src/base/camera_models.h.
+SINGLE_FOCAL_LENGTH_MODELS = {
+    "SIMPLE_PINHOLE",
+    "SIMPLE_RADIAL",
+    "RADIAL",
+    "SIMPLE_RADIAL_FISHEYE",
+    "RADIAL_FISHEYE",
+}
+
+# Fixed-size part of the records in cameras.bin, see
+# Reconstruction::WriteCamerasBinary. The header is followed
+# by the camera parameters (float64).
+CAMERA_HEADER_DTYPE = np.dtype([
+    ("camera_id", "<i4"),
+    ("model_id", "<i4"),
+    ("width", "<u8"),
+    ("height", "<u8"),
+])
+
+# Fixed-size parts of the records in images.bin, see
+# Reconstruction::WriteImagesBinary. The header is followed by the
+# null-terminated image name and the number of 2D points (uint64).
+IMAGE_HEADER_DTYPE = np.dtype([
+    ("image_id", "<i4"),
+    ("qvec", "<f8", (4,)),
+    ("tvec", "<f8", (3,)),
+    ("camera_id", "<i4"),
+])
+
+POINT2D_DTYPE = np.dtype([
+    ("xy", "<f8", (2,)),
+    ("point3D_id", "<i8"),
+])
+
+# Fixed-size part of the records in points3D.bin, see
+# Reconstruction::WritePoints3DBinary. The header is followed by
+# track_length track elements.
+POINT3D_HEADER_DTYPE = np.dtype([
+    ("point3D_id", "<u8"),
+    ("xyz", "<f8", (3,)),
+    ("rgb", "u1", (3,)),
+    ("error", "<f8"),
+    ("track_length", "<u8"),
+])
+
+TRACK_ELEMENT_DTYPE = np.dtype([
+    ("image_id", "<u4"),
+    ("point2D_idx", "<u4"),
+])
+
+# Number of records decoded at once by the vectorized readers and writers,
+# bounds the size of temporary index arrays.
+RECORD_CHUNK_SIZE = 1 << 16
+
 
 def read_cameras_text(path):
     """
@@ -231,6 +329,667 @@ def read_images_binary(path_to_model_file):
     return images
 
 
+def _expand_ranges(starts, lengths, step=1):
+    """Returns the concatenation of the index ranges
+    starts[i]:starts[i] + lengths[i] * step:step as a flat array."""
+    lengths = np.asarray(lengths, dtype=np.int64)
+    total = int(lengths.sum())
+    range_starts = np.cumsum(lengths) - lengths
+    starts = np.asarray(starts, dtype=np.int64) - range_starts * step
+    return np.repeat(starts, lengths) + np.arange(total, dtype=np.int64) * step
+
+
+def _gather_records(data, offsets, dtype):
+    """Gathers records of the given dtype from the byte array data,
+    starting at the given (unaligned) byte offsets."""
+    records = data[offsets[:, None] + np.arange(dtype.itemsize)]
+    return records.view(dtype).reshape(-1)
+
+
+def _index_images_binary(buf):
+    """Scans the records in the given images.bin buffer and returns the byte
+    offsets of the image headers, the image names and the number of 2D points
+    of each image. Only the names and point counts are touched, the search for
+    the name terminators is done by the buffer's find method."""
+    num_reg_images = struct.unpack_from("<Q", buf, 0)[0]
+    header_size = IMAGE_HEADER_DTYPE.itemsize
+    point_size = POINT2D_DTYPE.itemsize
+    unpack_count = struct.Struct("<Q").unpack_from
+    find = buf.find
+
+    offsets = []
+    names = []
+    counts = []
+    offset = 8
+    for _ in range(num_reg_images):
+        name_start = offset + header_size
+        name_end = find(b"\x00", name_start)
+        if name_end < 0:
+            raise ValueError("truncated images.bin, image name not terminated")
+        num_points2D = unpack_count(buf, name_end + 1)[0]
+        offsets.append(offset)
+        names.append(buf[name_start:name_end].decode("utf-8"))
+        counts.append(num_points2D)
+        offset = name_end + 9 + point_size * num_points2D
+
+    return (np.array(offsets, dtype=np.int64), names,
+            np.array(counts, dtype=np.int64))
+
+
+def _read_images_binary_arrays(path_to_model_file):
+    """Reads images.bin into contiguous arrays. Returns a tuple of
+    (image_ids, qvecs, tvecs, camera_ids, names, point_offsets, xys,
+    point3D_ids), where the 2D points of image i are the rows
+    point_offsets[i]:point_offsets[i + 1] of xys and point3D_ids."""
+    with open(path_to_model_file, "rb") as fid, \
+            mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        offsets, names, num_points2D = _index_images_binary(buf)
+
+        header_size = IMAGE_HEADER_DTYPE.itemsize
+        name_lengths = np.array([len(name.encode("utf-8")) for name in names],
+                                dtype=np.int64)
+        point_starts = offsets + header_size + name_lengths + 9
+        point_ends = point_starts + num_points2D * POINT2D_DTYPE.itemsize
+        if len(offsets) > 0 and point_ends[-1] > len(buf):
+            raise ValueError("truncated images.bin, 2D points exceed the file size")
+
+        data = np.frombuffer(buf, dtype=np.uint8)
+        try:
+            headers = _gather_records(data, offsets, IMAGE_HEADER_DTYPE)
+            if len(offsets) > 0:
+                points = np.concatenate([
+                    data[start:end] for start, end in zip(point_starts.tolist(),
+                                                          point_ends.tolist())])
+            else:
+                points = np.empty(0, dtype=np.uint8)
+        finally:
+            # all views into the mapped file must be gone before it is closed,
+            # also if decoding fails, or closing it would raise BufferError
+            del data
+
+    points = points.view(POINT2D_DTYPE)
+    point_offsets = np.zeros(len(num_points2D) + 1, dtype=np.int64)
+    np.cumsum(num_points2D, out=point_offsets[1:])
+
+    return (headers["image_id"].astype(np.int64),
+            np.ascontiguousarray(headers["qvec"]),
+            np.ascontiguousarray(headers["tvec"]),
+            headers["camera_id"].astype(np.int64),
+            names,
+            point_offsets,
+            np.ascontiguousarray(points["xy"]),
+            np.ascontiguousarray(points["point3D_id"]))
+
+
+def read_images_binary_mmap(path_to_model_file):
+    """
+    Same as read_images_binary, but memory-maps the file and decodes the
+    2D points of all images at once with numpy. The arrays of the returned
+    images are views into shared, contiguous arrays.
+    """
+    return _images_from_arrays(_read_images_binary_arrays(path_to_model_file))
+
+
+def _images_from_arrays(arrays):
+    """Creates a dictionary of Image from the tuple of arrays returned by
+    _read_images_binary_arrays. The arrays of the images are views."""
+    (image_ids, qvecs, tvecs, camera_ids, names,
+     point_offsets, xys, point3D_ids) = arrays
+
+    images = {}
+    starts = point_offsets[:-1].tolist()
+    ends = point_offsets[1:].tolist()
+    for i, (image_id, camera_id) in enumerate(zip(image_ids.tolist(),
+                                                  camera_ids.tolist())):
+        images[image_id] = Image(
+            id=image_id, qvec=qvecs[i], tvec=tvecs[i],
+            camera_id=camera_id, name=names[i], path=names[i],
+            xys=xys[starts[i]:ends[i]],
+            point3D_ids=point3D_ids[starts[i]:ends[i]])
+    return images
+
+
+def read_points3D_binary(path_to_model_file):
+    """
+    see: src/base/reconstruction.cc
+        void Reconstruction::ReadPoints3DBinary(const std::string& path)
+        void Reconstruction::WritePoints3DBinary(const std::string& path)
+    """
+    header_size = POINT3D_HEADER_DTYPE.itemsize
+    element_size = TRACK_ELEMENT_DTYPE.itemsize
+    length_offset = POINT3D_HEADER_DTYPE.fields["track_length"][1]
+    unpack_length = struct.Struct("<Q").unpack_from
+
+    with open(path_to_model_file, "rb") as fid, \
+            mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        num_points = struct.unpack_from("<Q", buf, 0)[0]
+
+        ids = np.empty(num_points, dtype=np.int64)
+        xyz = np.empty((num_points, 3), dtype=np.float64)
+        rgb = np.empty((num_points, 3), dtype=np.uint8)
+        error = np.empty(num_points, dtype=np.float64)
+        track_offsets = np.zeros(num_points + 1, dtype=np.int64)
+        track_image_ids = []
+        track_point2D_idxs = []
+
+        data = np.frombuffer(buf, dtype=np.uint8)
+        try:
+            offset = 8
+            for start in range(0, num_points, RECORD_CHUNK_SIZE):
+                end = min(start + RECORD_CHUNK_SIZE, num_points)
+
+                # the records have variable length, so the track lengths of
+                # a chunk are scanned sequentially to locate its records,
+                # which are then decoded at once
+                offsets = [0] * (end - start)
+                for i in range(end - start):
+                    offsets[i] = offset
+                    offset += header_size + element_size * \
+                        unpack_length(buf, offset + length_offset)[0]
+                if offset > len(buf):
+                    raise ValueError("truncated points3D.bin, "
+                                     "tracks exceed the file size")
+
+                offsets = np.array(offsets, dtype=np.int64)
+                headers = _gather_records(data, offsets, POINT3D_HEADER_DTYPE)
+                ids[start:end] = headers["point3D_id"]
+                xyz[start:end] = headers["xyz"]
+                rgb[start:end] = headers["rgb"]
+                error[start:end] = headers["error"]
+
+                track_lengths = headers["track_length"].astype(np.int64)
+                np.cumsum(track_lengths, out=track_offsets[start + 1:end + 1])
+                track_offsets[start + 1:end + 1] += track_offsets[start]
+
+                elements = _gather_records(
+                    data, _expand_ranges(offsets + header_size, track_lengths,
+                                         element_size), TRACK_ELEMENT_DTYPE)
+                track_image_ids.append(elements["image_id"])
+                track_point2D_idxs.append(elements["point2D_idx"])
+        finally:
+            # all views into the mapped file must be gone before it is closed,
+            # also if decoding fails, or closing it would raise BufferError
+            del data
+
+    return Points3D(
+        ids=ids,
+        xyz=xyz,
+        rgb=rgb,
+        error=error,
+        track_offsets=track_offsets,
+        track_image_ids=np.concatenate(
+            track_image_ids or [np.empty(0, dtype=np.uint32)]),
+        track_point2D_idxs=np.concatenate(
+            track_point2D_idxs or [np.empty(0, dtype=np.uint32)]))
+
+
+def _parse_lines(lines):
+    """Converts the whitespace separated numbers in the given lines with a
+    single np.fromstring call. Returns the flat float64 values and the
+    number of values in each line."""
+    values = np.fromstring(" ".join(lines), dtype=np.float64, sep=" ")
+    counts = np.array([line.count(" ") + 1 if line else 0 for line in lines],
+                      dtype=np.int64)
+    if counts.sum() != len(values):
+        counts = np.array([len(line.split()) for line in lines],
+                          dtype=np.int64)
+    return values, counts
+
+
+def _iter_line_blocks(path, block_size):
+    """Reads the given text file in blocks of about block_size bytes
+    and yields the complete lines of each block as list."""
+    with open(path, "rb") as fid:
+        rest = b""
+        while True:
+            block = fid.read(block_size)
+            if not block:
+                break
+            block = rest + block
+            end = block.rfind(b"\n")
+            if end < 0:
+                rest = block
+                continue
+            rest = block[end + 1:]
+            yield block[:end].decode("utf-8").replace("\r", "").split("\n")
+        if rest:
+            yield rest.decode("utf-8").replace("\r", "").split("\n")
+
+
+def _parse_image_records(headers, point_lines):
+    """Parses pairs of image and POINTS2D lines of images.txt. Returns the
+    tuple of _read_images_binary_arrays, but with the number of 2D points
+    per image instead of the offsets. The numbers of all lines are
+    converted with a single np.fromstring call."""
+    names = [line.split(None, 9)[9] for line in headers]
+    lines = [line[:len(line) - len(name)].rstrip()
+             for line, name in zip(headers, names)]
+    lines.extend(line.strip() for line in point_lines)
+    values, counts = _parse_lines(lines)
+
+    num_images = len(headers)
+    if np.any(counts[:num_images] != 9):
+        raise ValueError("malformed image line in images file")
+    counts = counts[num_images:]
+    if np.any(counts % 3 != 0):
+        raise ValueError("malformed POINTS2D line in images file")
+    points = values[num_images * 9:].reshape(-1, 3)
+    values = values[:num_images * 9].reshape(-1, 9)
+
+    return (values[:, 0].astype(np.int64),
+            np.ascontiguousarray(values[:, 1:5]),
+            np.ascontiguousarray(values[:, 5:8]),
+            values[:, 8].astype(np.int64),
+            names,
+            counts // 3,
+            np.ascontiguousarray(points[:, :2]),
+            points[:, 2].astype(np.int64))
+
+
+def _read_images_text_arrays(path, block_size=1 << 26, max_workers=None):
+    """Reads images.txt into the tuple of arrays returned by
+    _read_images_binary_arrays. The file is read in blocks, all POINTS2D
+    lines of a block are converted at once. If max_workers is greater
+    than one, the blocks are parsed in a process pool."""
+    executor = None
+    if max_workers is not None and max_workers > 1:
+        executor = ProcessPoolExecutor(max_workers)
+
+    results = []
+    header = None
+    try:
+        for lines in _iter_line_blocks(path, block_size):
+            headers = []
+            point_lines = []
+            for line in lines:
+                if header is None:
+                    line = line.strip()
+                    if len(line) > 0 and line[0] != "#":
+                        header = line
+                else:
+                    headers.append(header)
+                    point_lines.append(line)
+                    header = None
+
+            if headers:
+                if executor:
+                    results.append(executor.submit(
+                        _parse_image_records, headers, point_lines))
+                else:
+                    results.append(_parse_image_records(headers, point_lines))
+
+        # the last image may not be followed by a POINTS2D line
+        if header is not None:
+            results.append(_parse_image_records([header], [""]))
+
+        if executor:
+            results = [result if isinstance(result, tuple) else result.result()
+                       for result in results]
+    finally:
+        if executor:
+            executor.shutdown()
+
+    if not results:
+        results = [_parse_image_records([], [])]
+
+    names = []
+    for result in results:
+        names.extend(result[4])
+    num_points2D = np.concatenate([result[5] for result in results])
+    point_offsets = np.zeros(len(num_points2D) + 1, dtype=np.int64)
+    np.cumsum(num_points2D, out=point_offsets[1:])
+
+    return (np.concatenate([result[0] for result in results]),
+            np.concatenate([result[1] for result in results]),
+            np.concatenate([result[2] for result in results]),
+            np.concatenate([result[3] for result in results]),
+            names,
+            point_offsets,
+            np.concatenate([result[6] for result in results]),
+            np.concatenate([result[7] for result in results]))
+
+
+def read_images_text_chunked(path, block_size=1 << 26, max_workers=None):
+    """
+    Same as read_images_text, but reads the file in large blocks and converts
+    the POINTS2D lines of each block in bulk. If max_workers is greater than
+    one, the blocks are parsed in a process pool. The result is identical to
+    the one of read_images_binary_mmap for the same model.
+    """
+    return _images_from_arrays(
+        _read_images_text_arrays(path, block_size, max_workers))
+
+
+def read_cameras_text_chunked(path):
+    """
+    Same as read_cameras_text, but converts the parameters
+    of each camera with a single np.fromstring call.
+    """
+    cameras = {}
+    for lines in _iter_line_blocks(path, 1 << 26):
+        for line in lines:
+            line = line.strip()
+            if len(line) > 0 and line[0] != "#":
+                elems = line.split(None, 4)
+                camera_id = int(elems[0])
+                params = np.fromstring(elems[4] if len(elems) > 4 else "",
+                                       dtype=np.float64, sep=" ")
+                cameras[camera_id] = Camera(id=camera_id, model=elems[1],
+                                            width=int(elems[2]),
+                                            height=int(elems[3]),
+                                            params=params)
+    return cameras
+
+
+def read_points3D_text(path):
+    """
+    see: src/base/reconstruction.cc
+        void Reconstruction::ReadPoints3DText(const std::string& path)
+        void Reconstruction::WritePoints3DText(const std::string& path)
+    """
+    with open(path, "r") as fid:
+        lines = [line for line in fid.read().splitlines()
+                 if len(line) > 0 and line[0] != "#"]
+
+    values, counts = _parse_lines(lines)
+    del lines
+
+    track_lengths = (counts - 8) // 2
+    if np.any(track_lengths < 0) or np.any((counts - 8) % 2 != 0):
+        raise ValueError(f"malformed points3D file: {path}")
+
+    line_starts = np.cumsum(counts) - counts
+    track_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(track_lengths, out=track_offsets[1:])
+    tracks = values[_expand_ranges(line_starts + 8, track_lengths * 2)]
+    tracks = tracks.reshape(-1, 2)
+
+    return Points3D(
+        ids=values[line_starts].astype(np.int64),
+        xyz=values[line_starts[:, None] + np.arange(1, 4)],
+        rgb=values[line_starts[:, None] + np.arange(4, 7)].astype(np.uint8),
+        error=values[line_starts + 7],
+        track_offsets=track_offsets,
+        track_image_ids=tracks[:, 0].astype(np.uint32),
+        track_point2D_idxs=tracks[:, 1].astype(np.uint32))
+
+
+def voxel_downsample_indices(xyz, voxel_size):
+    """Returns the sorted row indices of one point per occupied cell of a
+    uniform voxel grid with the given cell size."""
+    xyz = np.asarray(xyz, dtype=np.float64).reshape(-1, 3)
+    if len(xyz) == 0:
+        return np.empty(0, dtype=np.int64)
+    cells = np.floor((xyz - xyz.min(axis=0)) / voxel_size).astype(np.int64)
+    dims = cells.max(axis=0) + 1
+    if np.prod(dims.astype(np.float64)) < 2**62:
+        keys = cells[:, 0] + dims[0] * (cells[:, 1] + dims[1] * cells[:, 2])
+        _, indices = np.unique(keys, return_index=True)
+    else:
+        _, indices = np.unique(cells, axis=0, return_index=True)
+    return np.sort(indices)
+
+
+def random_sample_indices(num_points, max_points, seed=None):
+    """Returns the sorted row indices of a random subset of at most
+    max_points of num_points points."""
+    if num_points <= max_points:
+        return np.arange(num_points, dtype=np.int64)
+    rng = np.random.default_rng(seed)
+    indices = rng.choice(num_points, size=max_points, replace=False)
+    return np.sort(indices).astype(np.int64)
+
+
+def _image_arrays_from_dict(images):
+    """Stacks a dictionary of Image into the tuple of arrays
+    returned by _read_images_binary_arrays."""
+    image_list = list(images.values())
+    qvecs, tvecs = stack_image_poses(images)
+    num_points2D = [len(image.point3D_ids) for image in image_list]
+    point_offsets = np.zeros(len(image_list) + 1, dtype=np.int64)
+    np.cumsum(num_points2D, out=point_offsets[1:])
+    xys = [np.reshape(image.xys, (-1, 2)) for image in image_list]
+    point3D_ids = [np.asarray(image.point3D_ids, dtype=np.int64)
+                   for image in image_list]
+
+    return (np.array([image.id for image in image_list], dtype=np.int64),
+            qvecs,
+            tvecs,
+            np.array([image.camera_id for image in image_list],
+                     dtype=np.int64),
+            [image.name for image in image_list],
+            point_offsets,
+            np.concatenate(xys) if xys else np.empty((0, 2)),
+            np.concatenate(point3D_ids) if point3D_ids
+            else np.empty(0, dtype=np.int64))
+
+
+def _record_chunks(counts, max_count=RECORD_CHUNK_SIZE * 16):
+    """Yields (start, end) ranges of records such that the sum of the given
+    counts per chunk stays below max_count, unless a single record
+    exceeds it."""
+    ends = np.cumsum(counts)
+    start = 0
+    while start < len(counts):
+        done = ends[start - 1] if start > 0 else 0
+        end = int(np.searchsorted(ends, done + max_count, side="right"))
+        end = max(end, start + 1)
+        yield start, end
+        start = end
+
+
+def write_cameras_text(cameras, path):
+    """
+    see: src/base/reconstruction.cc
+        void Reconstruction::WriteCamerasText(const std::string& path)
+        void Reconstruction::ReadCamerasText(const std::string& path)
+    """
+    lines = [
+        "# Camera list with one line of data per camera:",
+        "#   CAMERA_ID, MODEL, WIDTH, HEIGHT, PARAMS[]",
+        f"# Number of cameras: {len(cameras)}",
+    ]
+    for camera in cameras.values():
+        params = " ".join(map(str, np.asarray(camera.params).tolist()))
+        lines.append(f"{camera.id} {camera.model} {camera.width} "
+                     f"{camera.height} {params}")
+
+    with open(path, "w") as fid:
+        fid.write("\n".join(lines) + "\n")
+
+
+def write_cameras_binary(cameras, path_to_model_file):
+    """
+    see: src/base/reconstruction.cc
+        void Reconstruction::WriteCamerasBinary(const std::string& path)
+        void Reconstruction::ReadCamerasBinary(const std::string& path)
+    """
+    camera_list = list(cameras.values())
+    headers = np.empty(len(camera_list), dtype=CAMERA_HEADER_DTYPE)
+    headers["camera_id"] = [camera.id for camera in camera_list]
+    headers["model_id"] = [CAMERA_MODEL_NAMES[camera.model].model_id
+                           for camera in camera_list]
+    headers["width"] = [camera.width for camera in camera_list]
+    headers["height"] = [camera.height for camera in camera_list]
+
+    with open(path_to_model_file, "wb") as fid:
+        fid.write(struct.pack("<Q", len(camera_list)))
+        for header, camera in zip(headers, camera_list):
+            num_params = CAMERA_MODEL_NAMES[camera.model].num_params
+            params = np.asarray(camera.params, dtype="<f8")
+            assert len(params) == num_params
+            fid.write(header.tobytes())
+            fid.write(params.tobytes())
+
+
+def write_images_text(images, path):
+    """
+    see: src/base/reconstruction.cc
+        void Reconstruction::ReadImagesText(const std::string& path)
+        void Reconstruction::WriteImagesText(const std::string& path)
+    """
+    _write_images_text_arrays(_image_arrays_from_dict(images), path)
+
+
+def write_images_binary(images, path_to_model_file):
+    """
+    see: src/base/reconstruction.cc
+        void Reconstruction::ReadImagesBinary(const std::string& path)
+        void Reconstruction::WriteImagesBinary(const std::string& path)
+    """
+    _write_images_binary_arrays(_image_arrays_from_dict(images),
+                                path_to_model_file)
+
+
+def _write_images_text_arrays(arrays, path):
+    (image_ids, qvecs, tvecs, camera_ids, names,
+     point_offsets, xys, point3D_ids) = arrays
+    num_points2D = np.diff(point_offsets)
+    mean_observations = num_points2D.mean() if len(num_points2D) else 0
+
+    with open(path, "w", buffering=1 << 24) as fid:
+        fid.write("# Image list with two lines of data per image:\n"
+                  "#   IMAGE_ID, QW, QX, QY, QZ, TX, TY, TZ, CAMERA_ID, NAME\n"
+                  "#   POINTS2D[] as (X, Y, POINT3D_ID)\n"
+                  f"# Number of images: {len(image_ids)}, "
+                  f"mean observations per image: {mean_observations}\n")
+
+        # the arrays are converted to lists chunk by chunk, str gives the
+        # shortest round-trip representation of floats
+        for start, end in _record_chunks(num_points2D * 3):
+            offsets = point_offsets[start:end + 1].tolist()
+            first = offsets[0]
+            chunk_xys = xys[first:offsets[-1]].tolist()
+            chunk_point3D_ids = point3D_ids[first:offsets[-1]].tolist()
+
+            lines = []
+            for i, (image_id, qvec, tvec, camera_id) in enumerate(zip(
+                    image_ids[start:end].tolist(), qvecs[start:end].tolist(),
+                    tvecs[start:end].tolist(),
+                    camera_ids[start:end].tolist())):
+                lines.append(" ".join(map(str, [
+                    image_id, *qvec, *tvec, camera_id, names[start + i]])))
+                begin, stop = offsets[i] - first, offsets[i + 1] - first
+                lines.append(" ".join(
+                    f"{x} {y} {point3D_id}" for (x, y), point3D_id in zip(
+                        chunk_xys[begin:stop],
+                        chunk_point3D_ids[begin:stop])))
+            fid.write("\n".join(lines) + "\n")
+
+
+def _write_images_binary_arrays(arrays, path_to_model_file):
+    (image_ids, qvecs, tvecs, camera_ids, names,
+     point_offsets, xys, point3D_ids) = arrays
+
+    headers = np.empty(len(image_ids), dtype=IMAGE_HEADER_DTYPE)
+    headers["image_id"] = image_ids
+    headers["qvec"] = qvecs
+    headers["tvec"] = tvecs
+    headers["camera_id"] = camera_ids
+    points = np.empty(len(point3D_ids), dtype=POINT2D_DTYPE)
+    points["xy"] = xys
+    points["point3D_id"] = point3D_ids
+
+    header_bytes = memoryview(headers.view(np.uint8))
+    point_bytes = memoryview(points.view(np.uint8))
+    header_size = IMAGE_HEADER_DTYPE.itemsize
+    point_size = POINT2D_DTYPE.itemsize
+    pack_count = struct.Struct("<Q").pack
+    offsets = point_offsets.tolist()
+
+    with open(path_to_model_file, "wb", buffering=1 << 24) as fid:
+        fid.write(struct.pack("<Q", len(image_ids)))
+        for i, name in enumerate(names):
+            start, end = offsets[i], offsets[i + 1]
+            fid.write(header_bytes[i * header_size:(i + 1) * header_size])
+            fid.write(name.encode("utf-8") + b"\x00")
+            fid.write(pack_count(end - start))
+            fid.write(point_bytes[start * point_size:end * point_size])
+
+
+def write_points3D_text(points3D, path):
+    """
+    see: src/base/reconstruction.cc
+        void Reconstruction::ReadPoints3DText(const std::string& path)
+        void Reconstruction::WritePoints3DText(const std::string& path)
+    """
+    track_lengths = points3D.track_lengths
+    mean_track_length = track_lengths.mean() if len(track_lengths) else 0
+
+    with open(path, "w", buffering=1 << 24) as fid:
+        fid.write("# 3D point list with one line of data per point:\n"
+                  "#   POINT3D_ID, X, Y, Z, R, G, B, ERROR, "
+                  "TRACK[] as (IMAGE_ID, POINT2D_IDX)\n"
+                  f"# Number of points: {len(points3D)}, "
+                  f"mean track length: {mean_track_length}\n")
+
+        for start, end in _record_chunks(track_lengths * 2):
+            offsets = points3D.track_offsets[start:end + 1].tolist()
+            first = offsets[0]
+            tracks = np.column_stack([
+                points3D.track_image_ids[first:offsets[-1]],
+                points3D.track_point2D_idxs[first:offsets[-1]]])
+            tracks = tracks.ravel().tolist()
+
+            lines = []
+            for i, (point3D_id, xyz, rgb, error) in enumerate(zip(
+                    points3D.ids[start:end].tolist(),
+                    points3D.xyz[start:end].tolist(),
+                    points3D.rgb[start:end].tolist(),
+                    points3D.error[start:end].tolist())):
+                track = tracks[2 * (offsets[i] - first):
+                               2 * (offsets[i + 1] - first)]
+                lines.append(" ".join(map(str, [
+                    point3D_id, *xyz, *rgb, error, *track])))
+            fid.write("\n".join(lines) + "\n")
+
+
+def write_points3D_binary(points3D, path_to_model_file):
+    """
+    see: src/base/reconstruction.cc
+        void Reconstruction::ReadPoints3DBinary(const std::string& path)
+        void Reconstruction::WritePoints3DBinary(const std::string& path)
+    """
+    header_size = POINT3D_HEADER_DTYPE.itemsize
+    element_size = TRACK_ELEMENT_DTYPE.itemsize
+    track_lengths = points3D.track_lengths
+
+    with open(path_to_model_file, "wb") as fid:
+        fid.write(struct.pack("<Q", len(points3D)))
+
+        # records are assembled chunk by chunk by scattering the header
+        # and track element bytes to their offsets in the output buffer
+        for start in range(0, len(points3D), RECORD_CHUNK_SIZE):
+            end = min(start + RECORD_CHUNK_SIZE, len(points3D))
+            lengths = track_lengths[start:end]
+
+            headers = np.empty(end - start, dtype=POINT3D_HEADER_DTYPE)
+            headers["point3D_id"] = points3D.ids[start:end]
+            headers["xyz"] = points3D.xyz[start:end]
+            headers["rgb"] = points3D.rgb[start:end]
+            headers["error"] = points3D.error[start:end]
+            headers["track_length"] = lengths
+
+            track_start = points3D.track_offsets[start]
+            track_end = points3D.track_offsets[end]
+            elements = np.empty(track_end - track_start,
+                                dtype=TRACK_ELEMENT_DTYPE)
+            elements["image_id"] = \
+                points3D.track_image_ids[track_start:track_end]
+            elements["point2D_idx"] = \
+                points3D.track_point2D_idxs[track_start:track_end]
+
+            record_sizes = header_size + element_size * lengths
+            record_starts = np.cumsum(record_sizes) - record_sizes
+            data = np.empty(int(record_sizes.sum()), dtype=np.uint8)
+            data[(record_starts[:, None] + np.arange(header_size)).ravel()] = \
+                headers.view(np.uint8)
+            data[_expand_ranges(record_starts + header_size,
+                                lengths * element_size)] = \
+                elements.view(np.uint8)
+            data.tofile(fid)
+
+
 def qvec2rotmat(qvec: np.ndarray) -> np.ndarray:
     return np.array([
         [1 - 2 * qvec[2]**2 - 2 * qvec[3]**2,
@@ -256,3 +1015,184 @@ def rotmat2qvec(R: np.ndarray) -> np.ndarray:
     if qvec[0] < 0:
         qvec *= -1
     return qvec
+
+
+def camera_intrinsics(model_name: str, params: np.ndarray):
+    """Returns the focal lengths and principal points (fx, fy, cx, cy)
+    for the given (N, num_params) parameters of a camera model."""
+    num_params = CAMERA_MODEL_NAMES[model_name].num_params
+    params = np.asarray(params, dtype=np.float64).reshape(-1, num_params)
+    if model_name in SINGLE_FOCAL_LENGTH_MODELS:
+        return params[:, 0], params[:, 0], params[:, 1], params[:, 2]
+    return params[:, 0], params[:, 1], params[:, 2], params[:, 3]
+
+
+def qvecs2rotmats(qvecs: np.ndarray) -> np.ndarray:
+    """Batched version of qvec2rotmat, converts (N, 4) quaternions
+    (w, x, y, z) to (N, 3, 3) rotation matrices."""
+    qvecs = np.asarray(qvecs, dtype=np.float64).reshape(-1, 4)
+    w, x, y, z = qvecs.T
+
+    R = np.empty((len(qvecs), 3, 3), dtype=np.float64)
+    R[:, 0, 0] = 1 - 2 * y**2 - 2 * z**2
+    R[:, 0, 1] = 2 * x * y - 2 * w * z
+    R[:, 0, 2] = 2 * z * x + 2 * w * y
+    R[:, 1, 0] = 2 * x * y + 2 * w * z
+    R[:, 1, 1] = 1 - 2 * x**2 - 2 * z**2
+    R[:, 1, 2] = 2 * y * z - 2 * w * x
+    R[:, 2, 0] = 2 * z * x - 2 * w * y
+    R[:, 2, 1] = 2 * y * z + 2 * w * x
+    R[:, 2, 2] = 1 - 2 * x**2 - 2 * y**2
+    return R
+
+
+def rotmats2qvecs(R: np.ndarray, tolerance: float = 1e-6) -> np.ndarray:
+    """Batched version of rotmat2qvec, converts (N, 3, 3) rotation matrices
+    to (N, 4) quaternions (w, x, y, z) with w >= 0. Proper rotations are
+    converted in closed form (Shepperd's method), matrices deviating from
+    a rotation by more than the given tolerance are converted with the
+    eigenvalue method of rotmat2qvec."""
+    R = np.asarray(R, dtype=np.float64).reshape(-1, 3, 3)
+    qvecs = np.empty((len(R), 4), dtype=np.float64)
+
+    # pick the numerically most stable of the four solutions per matrix,
+    # depending on the largest of the trace and the diagonal elements
+    diagonal = np.stack([R[:, 0, 0] + R[:, 1, 1] + R[:, 2, 2],
+                         R[:, 0, 0], R[:, 1, 1], R[:, 2, 2]], axis=1)
+    case = np.argmax(diagonal, axis=1)
+
+    m = case == 0
+    r = R[m]
+    s = 2 * np.sqrt(1 + diagonal[m, 0])
+    qvecs[m] = np.stack([0.25 * s,
+                         (r[:, 2, 1] - r[:, 1, 2]) / s,
+                         (r[:, 0, 2] - r[:, 2, 0]) / s,
+                         (r[:, 1, 0] - r[:, 0, 1]) / s], axis=1)
+    m = case == 1
+    r = R[m]
+    s = 2 * np.sqrt(1 + r[:, 0, 0] - r[:, 1, 1] - r[:, 2, 2])
+    qvecs[m] = np.stack([(r[:, 2, 1] - r[:, 1, 2]) / s,
+                         0.25 * s,
+                         (r[:, 0, 1] + r[:, 1, 0]) / s,
+                         (r[:, 0, 2] + r[:, 2, 0]) / s], axis=1)
+    m = case == 2
+    r = R[m]
+    s = 2 * np.sqrt(1 - r[:, 0, 0] + r[:, 1, 1] - r[:, 2, 2])
+    qvecs[m] = np.stack([(r[:, 0, 2] - r[:, 2, 0]) / s,
+                         (r[:, 0, 1] + r[:, 1, 0]) / s,
+                         0.25 * s,
+                         (r[:, 1, 2] + r[:, 2, 1]) / s], axis=1)
+    m = case == 3
+    r = R[m]
+    s = 2 * np.sqrt(1 - r[:, 0, 0] - r[:, 1, 1] + r[:, 2, 2])
+    qvecs[m] = np.stack([(r[:, 1, 0] - r[:, 0, 1]) / s,
+                         (r[:, 0, 2] + r[:, 2, 0]) / s,
+                         (r[:, 1, 2] + r[:, 2, 1]) / s,
+                         0.25 * s], axis=1)
+
+    # fall back to the least squares solution for matrices
+    # which are not orthonormal or not right-handed
+    deviation = np.abs(R @ R.transpose(0, 2, 1) - np.eye(3)).max(axis=(1, 2))
+    invalid = (deviation > tolerance) | (np.linalg.det(R) <= 0)
+    if np.any(invalid):
+        r = R[invalid]
+        Rxx, Ryx, Rzx = r[:, 0, 0], r[:, 0, 1], r[:, 0, 2]
+        Rxy, Ryy, Rzy = r[:, 1, 0], r[:, 1, 1], r[:, 1, 2]
+        Rxz, Ryz, Rzz = r[:, 2, 0], r[:, 2, 1], r[:, 2, 2]
+        zero = np.zeros(len(r))
+        K = np.stack([
+            np.stack([Rxx - Ryy - Rzz, zero, zero, zero], axis=1),
+            np.stack([Ryx + Rxy, Ryy - Rxx - Rzz, zero, zero], axis=1),
+            np.stack([Rzx + Rxz, Rzy + Ryz, Rzz - Rxx - Ryy, zero], axis=1),
+            np.stack([Ryz - Rzy, Rzx - Rxz, Rxy - Ryx, Rxx + Ryy + Rzz],
+                     axis=1),
+        ], axis=1) / 3.0
+        eigvals, eigvecs = np.linalg.eigh(K, UPLO="L")
+        largest = np.argmax(eigvals, axis=1)
+        eigvecs = eigvecs[np.arange(len(r)), :, largest]
+        qvecs[invalid] = eigvecs[:, [3, 0, 1, 2]]
+
+    qvecs /= np.linalg.norm(qvecs, axis=1, keepdims=True)
+    qvecs[qvecs[:, 0] < 0] *= -1
+    return qvecs
+
+
+def camera_centers(qvecs: np.ndarray, tvecs: np.ndarray) -> np.ndarray:
+    """Returns the (N, 3) world space camera centers -R^T * t for
+    the given (N, 4) quaternions and (N, 3) translations."""
+    R = qvecs2rotmats(qvecs)
+    tvecs = np.asarray(tvecs, dtype=np.float64).reshape(-1, 3)
+    return -np.einsum("nji,nj->ni", R, tvecs)
+
+
+def blender_matrices_world(qvecs: np.ndarray, tvecs: np.ndarray) -> np.ndarray:
+    """Returns (N, 4, 4) camera-to-world matrices to be used as Blender camera
+    object matrix_world for the given COLMAP world-to-camera poses. COLMAP
+    cameras look down +z with y pointing down, Blender cameras look down -z
+    with y pointing up."""
+    R = qvecs2rotmats(qvecs)
+    tvecs = np.asarray(tvecs, dtype=np.float64).reshape(-1, 3)
+
+    matrices = np.zeros((len(R), 4, 4), dtype=np.float64)
+    R_inv = R.transpose(0, 2, 1)
+    matrices[:, :3, :3] = R_inv * np.array([1.0, -1.0, -1.0])
+    matrices[:, :3, 3] = -np.einsum("nij,nj->ni", R_inv, tvecs)
+    matrices[:, 3, 3] = 1.0
+    return matrices
+
+
+def poses_from_blender_matrices(matrices: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Inverse of blender_matrices_world, returns (N, 4) quaternions and
+    (N, 3) translations of the COLMAP world-to-camera poses for the given
+    (N, 4, 4) Blender camera matrix_world. Scale is removed from the
+    rotation part of the matrices."""
+    matrices = np.asarray(matrices, dtype=np.float64).reshape(-1, 4, 4)
+    axes = matrices[:, :3, :3]
+    axes = axes / np.linalg.norm(axes, axis=1, keepdims=True)
+
+    R = (axes * np.array([1.0, -1.0, -1.0])).transpose(0, 2, 1)
+    tvecs = -np.einsum("nij,nj->ni", R, matrices[:, :3, 3])
+    return rotmats2qvecs(R), tvecs
+
+
+def blender_camera_intrinsics(lens, sensor_width, sensor_height, sensor_fit, shift_x, shift_y, width, height):
+    """Returns the PINHOLE parameters (fx, fy, cx, cy) of Blender perspective
+    cameras rendered at width x height with square pixels. Arguments are scalars
+    or arrays of per-camera values. As in Blender, the sensor width applies to
+    the image width for HORIZONTAL fit and to the larger image dimension for
+    AUTO fit, the sensor height to the image height for VERTICAL fit. Lens shift
+    is relative to the same image dimension."""
+    lens, sensor_width, sensor_height, shift_x, shift_y, width, height = (
+        np.asarray(value, dtype=np.float64)
+        for value in (lens, sensor_width, sensor_height, shift_x, shift_y, width, height))
+    sensor_fit = np.asarray(sensor_fit)
+
+    vertical = (sensor_fit == "VERTICAL") | ((sensor_fit == "AUTO") & (height > width))
+    fit_size = np.where(vertical, height, width)
+    sensor_size = np.where(sensor_fit == "VERTICAL", sensor_height, sensor_width)
+
+    focal_length = lens / sensor_size * fit_size
+    return (focal_length, focal_length.copy(),
+            width * 0.5 - shift_x * fit_size, height * 0.5 + shift_y * fit_size)
+
+
+def blender_camera_settings(fx, fy, cx, cy, width, height, sensor_size=36.0):
+    """Inverse of blender_camera_intrinsics for cameras with a square sensor of
+    sensor_size, fit to the larger image dimension. Returns arrays of the
+    sensor fit (True for HORIZONTAL, False for VERTICAL), lens, shift_x and
+    shift_y. The focal length along the fit dimension is used."""
+    fx, fy, cx, cy, width, height = (
+        np.asarray(value, dtype=np.float64) for value in (fx, fy, cx, cy, width, height))
+
+    horizontal = width >= height
+    fit_size = np.maximum(width, height)
+    lens = np.where(horizontal, fx, fy) / fit_size * sensor_size
+    return horizontal, lens, (width * 0.5 - cx) / fit_size, (cy - height * 0.5) / fit_size
+
+
+def stack_image_poses(images: dict[int, Image]) -> tuple[np.ndarray, np.ndarray]:
+    """Returns the poses of the given images as (N, 4) quaternions
+    and (N, 3) translations, in the order of the dictionary."""
+    qvecs = np.array([image.qvec for image in images.values()], dtype=np.float64)
+    tvecs = np.array([image.tvec for image in images.values()], dtype=np.float64)
+    return qvecs.reshape(-1, 4), tvecs.reshape(-1, 3)
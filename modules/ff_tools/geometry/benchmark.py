@@ -0,0 +1,153 @@
+# Blender Tools
+# Copyright 2024 Ralph Wiedemeier, Frame Factory GmbH
+# License: MIT
+
+"""
+Benchmarks for the mesh quality analysis on synthetic triangulated grids. Run
+from the modules directory, with Blender's Python module installed, e.g.
+
+    python -m ff_tools.geometry.benchmark --sizes 400 1600 --output results.json
+
+A grid of size 1600 has 5.12M triangles. Results are written as JSON, with
+one record per measurement as for the colmap benchmarks.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+
+import numpy as np
+
+from ..colmap.benchmark import Benchmark
+from .mesh_quality import MeshArrays, analyze_mesh_arrays, _count_duplicates
+
+
+def grid_mesh_arrays(
+    size: int,
+    num_materials: int = 2,
+    uv_tiles: int = 4,
+) -> MeshArrays:
+    """
+    Creates a flat grid of size x size unit quads, each split into two
+    consistently oriented triangles. The rows of quads are assigned to
+    num_materials bands of materials, the UVs are split into
+    uv_tiles x uv_tiles islands.
+    """
+    n = size
+    rows, cols = np.divmod(np.arange(n * n, dtype=np.int64), n)
+    v00 = rows * (n + 1) + cols
+    v01, v10, v11 = v00 + 1, v00 + n + 1, v00 + n + 2
+
+    # horizontal, vertical and diagonal edges
+    num_horizontal = (n + 1) * n
+    num_vertical = n * (n + 1)
+    vertex_rows, vertex_cols = np.divmod(
+        np.arange((n + 1) ** 2, dtype=np.int64), n + 1)
+    horizontal = np.flatnonzero(vertex_cols < n)
+    vertical = np.arange(num_vertical, dtype=np.int64)
+    edge_vertices = np.concatenate([
+        np.column_stack([ horizontal, horizontal + 1 ]),
+        np.column_stack([ vertical, vertical + n + 1 ]),
+        np.column_stack([ v00, v11 ]),
+    ])
+    bottom = rows * n + cols
+    left = num_horizontal + rows * (n + 1) + cols
+    diagonal = num_horizontal + num_vertical + rows * n + cols
+
+    # triangles (v00, v01, v11) and (v00, v11, v10) of each quad
+    loop_vertices = np.column_stack(
+        [ v00, v01, v11, v00, v11, v10 ]).ravel()
+    loop_edges = np.column_stack(
+        [ bottom, left + 1, diagonal, diagonal, bottom + n, left ]).ravel()
+    num_faces = 2 * n * n
+
+    positions = np.column_stack([
+        vertex_cols, vertex_rows, np.zeros_like(vertex_cols)
+    ]).astype(np.float64)
+
+    # UVs of the grid, offset per tile, so that tiles don't share UVs
+    tiles = np.column_stack([ cols, rows ]) * uv_tiles // n
+    uvs = positions[loop_vertices, :2] / n \
+        + np.repeat(tiles * 0.01, 6, axis=0)
+
+    return MeshArrays(
+        positions=positions,
+        edge_vertices=edge_vertices,
+        loop_start=np.arange(num_faces, dtype=np.int64) * 3,
+        loop_total=np.full(num_faces, 3, dtype=np.int64),
+        material_indices=np.repeat(rows * num_materials // n, 2),
+        loop_vertices=loop_vertices,
+        loop_edges=loop_edges,
+        uvs=uvs,
+    )
+
+
+def benchmark_mesh_quality(
+    bench: Benchmark,
+    size: int,
+    num_materials: int,
+    uv_tiles: int,
+    merge_distance: float,
+    seed: int,
+):
+    """Times the analysis of a grid, and the search for duplicates among
+    its vertices and a copy displaced by less than merge_distance."""
+    arrays = grid_mesh_arrays(size, num_materials, uv_tiles)
+    num_faces = len(arrays.loop_start)
+    bench.measure("analyze_mesh_arrays", size,
+                  lambda: analyze_mesh_arrays(
+                      arrays, merge_distance=merge_distance),
+                  num_faces)
+
+    rng = np.random.default_rng(seed)
+    positions = arrays.positions
+    offsets = rng.uniform(-1.0, 1.0, positions.shape) * merge_distance * 0.5
+    duplicates = np.concatenate([ positions, positions + offsets ])
+    bench.measure("count_duplicates_near", size,
+                  lambda: _count_duplicates(duplicates, merge_distance),
+                  len(duplicates))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1600],
+                        help="numbers of quads per side of the grids")
+    parser.add_argument("--materials", type=int, default=2)
+    parser.add_argument("--uv_tiles", type=int, default=4,
+                        help="number of UV islands per side of the grids")
+    parser.add_argument("--merge_distance", type=float, default=1e-5)
+    parser.add_argument("--no_memory", action="store_true",
+                        help="don't trace peak memory")
+    parser.add_argument("--output", default=None,
+                        help="JSON output file (default: stdout)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    bench = Benchmark(trace_memory=not args.no_memory)
+    for size in args.sizes:
+        benchmark_mesh_quality(bench, size, args.materials, args.uv_tiles,
+                               args.merge_distance, args.seed)
+
+    report = dict(
+        environment=dict(
+            python=platform.python_version(),
+            numpy=np.__version__,
+            platform=platform.platform(),
+            cpu_count=os.cpu_count(),
+        ),
+        config=vars(args),
+        results=bench.results,
+    )
+
+    if args.output:
+        with open(args.output, "w") as fid:
+            json.dump(report, fid, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
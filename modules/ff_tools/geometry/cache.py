@@ -0,0 +1,202 @@
+# Blender Tools
+# Copyright 2024 Ralph Wiedemeier, Frame Factory GmbH
+# License: MIT
+
+"""
+Cache for statistics and bounds derived from objects and meshes, keyed on
+datablock identity (ID.session_uid). Entries record the datablocks they depend
+on and are invalidated by a depsgraph_update_post handler when these receive
+geometry or transform updates, and by a frame_change_post handler for animated
+changes. Entries which can't be validated otherwise are
+only stored while the handler is registered. The handler is registered on the
+first query, or explicitly with register_module.
+"""
+
+from typing import Iterable, Optional
+
+import bpy
+from bpy import types as bt
+from bpy.app.handlers import persistent
+
+
+MAX_CACHED_ENTRIES = 1 << 16
+
+# dependency kinds
+GEOMETRY = "geometry"
+TRANSFORM = "transform"
+RELATIONS = "relations"
+
+# dependency on any change of collection contents, e.g. deleted objects
+ANY_RELATIONS = (None, RELATIONS)
+
+MISSING = object()
+
+_entries: dict[tuple, object] = {}
+_dependents: dict[tuple, set[tuple]] = {}
+_dependencies: dict[tuple, list[tuple]] = {}
+_counters = { "hits": 0, "misses": 0, "invalidations": 0 }
+_registered = False
+
+
+def is_registered() -> bool:
+    return _registered
+
+
+def get(key: tuple):
+    """returns the cached value for the given key, or MISSING.
+       Registers the update handler if it isn't registered yet."""
+    if not _registered:
+        register_module()
+
+    value = _entries.get(key, MISSING)
+    _counters["hits" if value is not MISSING else "misses"] += 1
+    return value
+
+
+def put(
+    key: tuple,
+    value,
+    geometry: Iterable[bt.ID] = (),
+    transform: Iterable[bt.ID] = (),
+    relations: Iterable[bt.ID] = (),
+    requires_handler: bool = True,
+):
+    """
+    Stores the value, to be invalidated on geometry or transform updates of the
+    given datablocks, or if objects are parented to one of the relations
+    datablocks. Entries with relations are also invalidated if the contents
+    of any collection change. Values are only stored while the update handler
+    is registered, unless requires_handler is False, e.g. for entries whose
+    key already identifies the state they depend on.
+    """
+    if requires_handler and not _registered:
+        return
+
+    # a replaced entry drops its previous dependencies and is not evicted
+    _remove(key)
+    if len(_entries) >= MAX_CACHED_ENTRIES:
+        _remove(next(iter(_entries)))
+    _entries[key] = value
+
+    relations = [ (id.session_uid, RELATIONS) for id in relations ]
+    dependencies = [ (id.session_uid, GEOMETRY) for id in geometry ]
+    dependencies += [ (id.session_uid, TRANSFORM) for id in transform ]
+    if relations:
+        dependencies += relations + [ ANY_RELATIONS ]
+
+    _dependencies[key] = dependencies
+    for dependency in dependencies:
+        _dependents.setdefault(dependency, set()).add(key)
+
+
+def get_or_compute(key: tuple, compute, **dependencies):
+    """returns the cached value for the given key, or computes and stores it.
+       See put for the dependency arguments."""
+    value = get(key)
+    if value is MISSING:
+        value = compute()
+        put(key, value, **dependencies)
+    return value
+
+
+def invalidate(id: Optional[bt.ID], kind: str):
+    """removes all entries depending on the given kind of update of the
+       datablock, or of any datablock if id is None."""
+    keys = _dependents.pop((id.session_uid if id is not None else None, kind), None)
+    if not keys:
+        return
+
+    for key in keys:
+        if _remove(key):
+            _counters["invalidations"] += 1
+
+
+def clear(kind: Optional[str] = None):
+    """removes all entries, or the entries whose key starts with kind."""
+    if kind is None:
+        _entries.clear()
+        _dependents.clear()
+        _dependencies.clear()
+        return
+
+    for key in [ key for key in _entries if key[0] == kind ]:
+        _remove(key)
+
+
+def _remove(key: tuple) -> bool:
+    """removes the entry and its references from the dependents of its
+       dependencies, returns False if the key is not cached."""
+    if _entries.pop(key, MISSING) is MISSING:
+        return False
+
+    for dependency in _dependencies.pop(key, ()):
+        keys = _dependents.get(dependency)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del _dependents[dependency]
+    return True
+
+
+def get_stats() -> dict:
+    """returns the number of hits, misses, invalidations and cached entries."""
+    return dict(_counters, entries=len(_entries))
+
+
+def reset_stats():
+    for name in _counters:
+        _counters[name] = 0
+
+
+@persistent
+def _on_depsgraph_update(scene: bt.Scene, depsgraph: bt.Depsgraph):
+    for update in depsgraph.updates:
+        id = update.id.original
+        if isinstance(id, bt.Collection):
+            invalidate(None, RELATIONS)
+            continue
+
+        if update.is_updated_geometry:
+            invalidate(id, GEOMETRY)
+
+        if update.is_updated_transform:
+            invalidate(id, TRANSFORM)
+            if isinstance(id, bt.Object):
+                # the object may have been parented to a new hierarchy
+                parent = id.parent
+                while parent:
+                    invalidate(parent, RELATIONS)
+                    parent = parent.parent
+
+
+@persistent
+def _on_load_post(*args):
+    clear()
+
+
+def register_module():
+    global _registered
+    if _on_depsgraph_update not in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.append(_on_depsgraph_update)
+    # animated changes are only reported with frame changes
+    if _on_depsgraph_update not in bpy.app.handlers.frame_change_post:
+        bpy.app.handlers.frame_change_post.append(_on_depsgraph_update)
+    if _on_load_post not in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.append(_on_load_post)
+
+    # entries stored before may be outdated
+    clear()
+    _registered = True
+
+
+def unregister_module():
+    global _registered
+    if _on_depsgraph_update in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.remove(_on_depsgraph_update)
+    if _on_depsgraph_update in bpy.app.handlers.frame_change_post:
+        bpy.app.handlers.frame_change_post.remove(_on_depsgraph_update)
+    if _on_load_post in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.remove(_on_load_post)
+
+    _registered = False
+    clear()
@@ -2,35 +2,169 @@
 # Copyright 2024 Ralph Wiedemeier, Frame Factory GmbH
 # License: MIT
 
-from typing import cast
+from dataclasses import dataclass, field
+from typing import Iterable, cast
+import bpy
+import bmesh
 from bpy import types as bt
-from mathutils import Vector
-from math import inf
+from mathutils import Matrix, Vector
 
+import numpy as np
 
-def get_bounding_box(obj: bt.Object, camera: bt.Object=None, recursive=True):
+from . import cache
+
+
+def get_bounding_box(obj: bt.Object, camera: bt.Object=None, recursive=True, exact=False):
     """returns a tuple of (min, max) vectors describing the axis aligned
-       bounding box of the given object (in world or camera coordinates)"""
-    v_min = Vector((inf, inf, inf))
-    v_max = Vector((-inf, -inf, -inf))
-    _get_bound_box_recursive(v_min, v_max, obj, camera, recursive)
-    return (v_min, v_max)
+       bounding box of the given object (in world or camera coordinates).
+       If exact is set, the box encloses the evaluated mesh vertices
+       instead of the objects' local bound boxes (see get_hull_points).
+       World space boxes are cached while the geometry cache is registered."""
+    key = ("bounds", obj.session_uid, recursive, exact)
+    bounds = cache.get(key) if camera is None else cache.MISSING
+
+    if bounds is cache.MISSING:
+        objects = get_hierarchy(obj) if recursive else [ obj ]
+        bounds = get_bounds_array(objects, camera, exact)
+        if camera is None:
+            cache.put(key, bounds, geometry=objects + _get_meshes(objects), transform=objects,
+                      relations=objects if recursive else ())
+
+    return (Vector(bounds[0]), Vector(bounds[1]))
 
 
-def _get_bound_box_recursive(v_min: Vector, v_max: Vector, obj: bt.Object, camera: bt.Object, recursive=True):
-    mat = obj.matrix_world
+def get_hierarchy(obj: bt.Object) -> list[bt.Object]:
+    """returns the object followed by all its descendants."""
+    return [ obj ] + list(obj.children_recursive)
+
+
+def get_bounds_array(objects: Iterable[bt.Object], camera: bt.Object=None, exact=False) -> np.ndarray:
+    """returns a (2, 3) array with the min and max corner of the axis aligned
+       bounding box of the given objects' bound boxes, in world coordinates or
+       in the local space of the camera. Bound boxes of all objects are
+       transformed in one batch. If exact is set, the convex hull points of
+       mesh objects are used instead of their bound boxes."""
+    objects = list(objects)
+    matrices, corners = get_object_arrays(objects)
+    if len(matrices) == 0:
+        return np.array([ (np.inf,) * 3, (-np.inf,) * 3 ])
+
     if camera:
-        mat = camera.convert_space(matrix=mat, from_space='WORLD', to_space='LOCAL')
+        # the conversion from world to local space is a multiplication from the
+        # left by a matrix that only depends on the camera, compute it once
+        conversion = camera.convert_space(matrix=Matrix.Identity(4), from_space='WORLD', to_space='LOCAL')
+        matrices = np.array(conversion) @ matrices
+
+    if exact:
+        points, rows = _get_exact_points(objects, corners)
+        points = np.einsum("nij,nj->ni", matrices[rows, :3, :3], points) + matrices[rows, :3, 3]
+    else:
+        points = corners @ matrices[:, :3, :3].transpose(0, 2, 1) + matrices[:, None, :3, 3]
+        points = points.reshape(-1, 3)
+
+    return np.stack([ points.min(axis=0), points.max(axis=0) ])
+
+
+def _get_exact_points(objects: list[bt.Object], corners: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """returns the local hull points of mesh objects and the bound box corners
+       of other objects and of meshes without vertices, concatenated, with the
+       object index of each point."""
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    points = []
+    for obj, obj_corners in zip(objects, corners):
+        obj_points = get_hull_points(obj, depsgraph) if obj.type == 'MESH' else obj_corners
+        points.append(obj_points if len(obj_points) > 0 else obj_corners)
+
+    rows = np.repeat(np.arange(len(objects)), [ len(obj_points) for obj_points in points ])
+    return np.concatenate(points), rows
+
+
+def get_hull_points(obj: bt.Object, depsgraph: bt.Depsgraph=None) -> np.ndarray:
+    """returns the (N, 3) vertices of the convex hull of the evaluated mesh of
+       the given mesh object, in object coordinates. The extent of the mesh in
+       any direction is the extent of its hull points, so framing a transformed
+       object only needs to transform these points.
+       Hulls are cached per mesh datablock (per object if it has modifiers or
+       shape keys) while the geometry cache is registered, and invalidated on
+       geometry updates of the object or its mesh, which include deformation
+       by modifiers, shape keys and armatures."""
+    # evaluating the depsgraph first reports pending updates to the cache
+    depsgraph = depsgraph or bpy.context.evaluated_depsgraph_get()
+    key = _hull_cache_key(obj)
+    points = cache.get(key)
+    if points is cache.MISSING:
+        points = _compute_hull_points(obj.evaluated_get(depsgraph))
+        cache.put(key, points, geometry=(obj, obj.data))
+
+    return points
+
+
+def clear_hull_cache():
+    cache.clear("hull")
+
+
+def _hull_cache_key(obj: bt.Object) -> tuple:
+    mesh = cast(bt.Mesh, obj.data)
+    if len(obj.modifiers) == 0 and mesh.shape_keys is None:
+        return ("hull", mesh.session_uid)
+
+    # evaluated geometry depends on the object
+    return ("hull", mesh.session_uid, obj.session_uid)
+
+
+def _compute_hull_points(obj_eval: bt.Object) -> np.ndarray:
+    mesh = obj_eval.to_mesh()
+    try:
+        co = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+        mesh.vertices.foreach_get("co", co)
+        co = co.reshape(-1, 3)
+        if len(co) <= 8:
+            return co.astype(np.float64)
+
+        bm = bmesh.new()
+        try:
+            bm.from_mesh(mesh)
+            bm.verts.index_update()
+            # the hull is built from the input vertices, which keep their index
+            result = bmesh.ops.convex_hull(bm, input=bm.verts[:], use_existing_faces=False)
+            indices = [ ele.index for ele in result["geom"] if isinstance(ele, bmesh.types.BMVert) ]
+        finally:
+            bm.free()
+    finally:
+        obj_eval.to_mesh_clear()
+
+    if len(indices) < 4:
+        # flat or degenerate mesh without a volume hull
+        return np.unique(co, axis=0).astype(np.float64)
+
+    return co[np.unique(indices)].astype(np.float64)
+
+
+def get_object_arrays(objects: Iterable[bt.Object]) -> tuple[np.ndarray, np.ndarray]:
+    """returns the world matrices (N, 4, 4) and local bound box corners (N, 8, 3)
+       of the given objects. For large sets of objects, the properties of all
+       objects in the file are read with foreach_get and the given ones selected."""
+    objects = list(objects)
+    all_objects = bpy.data.objects
+
+    if len(objects) * 4 < len(all_objects):
+        matrices = np.array([ obj.matrix_world for obj in objects ], dtype=np.float64)
+        corners = np.array([ obj.bound_box for obj in objects ], dtype=np.float64)
+        return matrices.reshape(-1, 4, 4), corners.reshape(-1, 8, 3)
 
-    bb = [ mat @ Vector(corner) for corner in obj.bound_box ] # world or camera space
-    for v in bb:
-        for i in range(3):
-            v_min[i] = min(v_min[i], v[i])
-            v_max[i] = max(v_max[i], v[i])
+    num_objects = len(all_objects)
+    matrices = np.empty(num_objects * 16, dtype=np.float32)
+    corners = np.empty(num_objects * 24, dtype=np.float32)
+    all_objects.foreach_get("matrix_world", matrices)
+    all_objects.foreach_get("bound_box", corners)
 
-    if recursive:
-        for child in obj.children:
-            _get_bound_box_recursive(v_min, v_max, child, camera, recursive)
+    rows = { obj: row for row, obj in enumerate(all_objects) }
+    rows = np.array([ rows[obj] for obj in objects ], dtype=np.int64)
+
+    # matrices are stored column by column
+    matrices = matrices.reshape(-1, 4, 4).transpose(0, 2, 1)[rows].astype(np.float64)
+    corners = corners.reshape(-1, 8, 3)[rows].astype(np.float64)
+    return matrices, corners
 
 
 def get_pose_info(obj: bt.Object) -> dict:
@@ -74,70 +208,124 @@ def get_pose_info(obj: bt.Object) -> dict:
 
 def get_vertex_count(obj: bt.Object) -> int:
     """returns the total number of vertices in the object and all its children."""
-    if obj.type == 'MESH':
-        data = cast(bt.Mesh, obj.data)
-        count = len(data.vertices)
-    else:
-        count = 0
-    
-    for child in obj.children:
-        count += get_vertex_count(child)
-
-    return count
+    return inspect_hierarchy(obj).instances.vertices
 
 
 def get_face_count(obj: bt.Object) -> int:
     """returns the total number of faces in the object and all its children."""
-    if obj.type == 'MESH':
-        data = cast(bt.Mesh, obj.data)
-        count = len(data.polygons)
-    else:
-        count = 0
-    
-    for child in obj.children:
-        count += get_face_count(child)
-
-    return count
+    return inspect_hierarchy(obj).instances.faces
 
 
 def get_polygon_types(obj: bt.Object) -> tuple[int, int, int]:
     """returns the number of triangles, quads, and ngons in the object
        and all its children."""
-    tris = 0
-    quads = 0
-    ngons = 0
+    stats = inspect_hierarchy(obj).instances
+    return stats.triangles, stats.quads, stats.ngons
 
-    if obj.type == 'MESH':
-        data = cast(bt.Mesh, obj.data)
 
-        for poly in data.polygons:
-            if len(poly.vertices) == 3:
-                tris += 1
-            elif len(poly.vertices) == 4:
-                quads += 1
-            else:
-                ngons += 1
+def get_materials(obj: bt.Object) -> set[bt.Material]:
+    """returns a list of all materials assigned to the object
+       and its children."""
+    return set(inspect_hierarchy(obj).materials)
 
-    for child in obj.children:
-        t, q, n = get_polygon_types(child)
-        tris += t
-        quads += q
-        ngons += n
 
-    return tris, quads, ngons
+@dataclass
+class MeshStats:
+    """Element counts of one or more meshes."""
+    vertices: int = 0
+    faces: int = 0
+    triangles: int = 0
+    quads: int = 0
+    ngons: int = 0
 
+    def add(self, other: "MeshStats", count: int = 1):
+        self.vertices += other.vertices * count
+        self.faces += other.faces * count
+        self.triangles += other.triangles * count
+        self.quads += other.quads * count
+        self.ngons += other.ngons * count
 
-def get_materials(obj: bt.Object) -> set[bt.Material]:
-    """returns a list of all materials assigned to the object
-       and its children."""
-    materials = set()
 
-    for slot in obj.material_slots:
-        if slot and slot.material:
-            materials.add(slot.material)
+@dataclass
+class HierarchyStats:
+    """Statistics of an object and all its children. instances counts each
+       mesh object, as rendered, unique counts meshes shared by several objects
+       (linked duplicates) once, as stored in memory."""
+    objects: int = 0
+    mesh_objects: int = 0
+    meshes: int = 0
+    instances: MeshStats = field(default_factory=MeshStats)
+    unique: MeshStats = field(default_factory=MeshStats)
+    materials: set[bt.Material] = field(default_factory=set)
 
-    for child in obj.children:
-        materials = materials.union(get_materials(child))
 
-    return materials
+def inspect_hierarchy(obj: bt.Object) -> HierarchyStats:
+    """returns element counts and materials of the object and all its children,
+       walking the hierarchy once and reading each distinct mesh once. Results
+       are cached while the geometry cache is registered and must not be modified."""
+    key = ("hierarchy_stats", obj.session_uid)
+    stats = cache.get(key)
+    if stats is not cache.MISSING:
+        return stats
+
+    objects = get_hierarchy(obj)
+
+    mesh_instances: dict[bt.Mesh, int] = {}
+    for o in objects:
+        if o.type == 'MESH':
+            mesh = cast(bt.Mesh, o.data)
+            mesh_instances[mesh] = mesh_instances.get(mesh, 0) + 1
 
+    stats = HierarchyStats(
+        objects=len(objects),
+        mesh_objects=sum(mesh_instances.values()),
+        meshes=len(mesh_instances),
+        materials=_get_slot_materials(objects),
+    )
+
+    for mesh, count in mesh_instances.items():
+        mesh_stats = get_mesh_stats(mesh)
+        stats.unique.add(mesh_stats)
+        stats.instances.add(mesh_stats, count)
+
+    cache.put(key, stats, geometry=objects + list(mesh_instances), relations=objects)
+    return stats
+
+
+def get_mesh_stats(mesh: bt.Mesh) -> MeshStats:
+    """returns the element counts of the given mesh, with polygons
+       classified by their number of corners."""
+    key = ("mesh_stats", mesh.session_uid)
+    stats = cache.get(key)
+    if stats is not cache.MISSING:
+        return stats
+
+    loop_totals = np.empty(len(mesh.polygons), dtype=np.int32)
+    mesh.polygons.foreach_get("loop_total", loop_totals)
+    # bins 0-2 are empty, 3: triangles, 4: quads, 5: ngons
+    counts = np.bincount(np.minimum(loop_totals, 5), minlength=6)
+
+    stats = MeshStats(
+        vertices=len(mesh.vertices),
+        faces=len(loop_totals),
+        triangles=int(counts[3]),
+        quads=int(counts[4]),
+        ngons=int(counts[5]),
+    )
+
+    cache.put(key, stats, geometry=(mesh,))
+    return stats
+
+
+def _get_meshes(objects: Iterable[bt.Object]) -> list[bt.Mesh]:
+    return [ o.data for o in objects if o.type == 'MESH' ]
+
+
+def _get_slot_materials(objects: Iterable[bt.Object]) -> set[bt.Material]:
+    materials = set()
+    for o in objects:
+        for slot in o.material_slots:
+            if slot and slot.material:
+                materials.add(slot.material)
+
+    return materials
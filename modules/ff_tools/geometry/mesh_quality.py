@@ -0,0 +1,680 @@
+# Blender Tools
+# Copyright 2024 Ralph Wiedemeier, Frame Factory GmbH
+# License: MIT
+
+from dataclasses import asdict, dataclass, field
+from typing import Optional, cast
+import bpy
+from bpy import types as bt
+
+import numpy as np
+
+from .inspect import get_hierarchy
+
+
+LOOP_CHUNK_SIZE = 1 << 22
+PAIR_CHUNK_SIZE = 1 << 20
+
+
+@dataclass
+class MeshArrays:
+    """Flat arrays of a mesh as read with foreach_get. Loops are stored face
+       by face, face i owns loops loop_start[i]:loop_start[i] + loop_total[i].
+    """
+    positions: np.ndarray           # (V, 3) float64
+    edge_vertices: np.ndarray       # (E, 2) int64
+    loop_start: np.ndarray          # (F,) int64
+    loop_total: np.ndarray          # (F,) int64
+    material_indices: np.ndarray    # (F,) int64
+    loop_vertices: np.ndarray       # (L,) int64
+    loop_edges: np.ndarray          # (L,) int64
+    uvs: Optional[np.ndarray]       # (L, 2) float64, active UV layer
+
+
+@dataclass
+class MaterialQuality:
+    """UV statistics of the faces using one material slot. Texel density is
+       in texels per world unit, for square textures of texture_size."""
+    index: int
+    name: Optional[str] = None
+    faces: int = 0
+    area: float = 0.0
+    uv_area: float = 0.0
+    texture_size: Optional[int] = None
+    texel_density: Optional[float] = None
+
+
+@dataclass
+class MeshQuality:
+    """Quality report of a mesh. Edges are non-manifold if used by more than
+       two faces and inconsistent if both of their faces traverse them in the
+       same direction, i.e. if one of the faces has a flipped normal.
+       inward_normals is only set for closed, consistently oriented meshes."""
+    name: str = ""
+    vertices: int = 0
+    edges: int = 0
+    faces: int = 0
+    boundary_edges: int = 0
+    non_manifold_edges: int = 0
+    loose_edges: int = 0
+    inconsistent_edges: int = 0
+    inward_normals: Optional[bool] = None
+    degenerate_faces: int = 0
+    duplicate_vertices: int = 0
+    mesh_islands: int = 0
+    uv_islands: Optional[int] = None
+    materials: list[MaterialQuality] = field(default_factory=list)
+
+
+def read_mesh_arrays(mesh: bt.Mesh, matrix=None) -> MeshArrays:
+    """reads the mesh with foreach_get. Positions are transformed
+       by the given 4x4 matrix, e.g. the object's world matrix."""
+    num_vertices = len(mesh.vertices)
+    num_edges = len(mesh.edges)
+    num_faces = len(mesh.polygons)
+    num_loops = len(mesh.loops)
+
+    positions = np.empty(num_vertices * 3, dtype=np.float32)
+    mesh.vertices.foreach_get("co", positions)
+    positions = positions.reshape(-1, 3).astype(np.float64)
+    if matrix is not None:
+        matrix = np.array(matrix, dtype=np.float64)
+        positions = positions @ matrix[:3, :3].T + matrix[:3, 3]
+
+    edge_vertices = np.empty(num_edges * 2, dtype=np.int32)
+    mesh.edges.foreach_get("vertices", edge_vertices)
+
+    face_arrays = []
+    for name in ("loop_start", "loop_total", "material_index"):
+        values = np.empty(num_faces, dtype=np.int32)
+        mesh.polygons.foreach_get(name, values)
+        face_arrays.append(values.astype(np.int64))
+
+    loop_arrays = []
+    for name in ("vertex_index", "edge_index"):
+        values = np.empty(num_loops, dtype=np.int32)
+        mesh.loops.foreach_get(name, values)
+        loop_arrays.append(values.astype(np.int64))
+
+    uvs = None
+    uv_layer = mesh.uv_layers.active
+    if uv_layer is not None:
+        uvs = np.empty(num_loops * 2, dtype=np.float32)
+        uv_layer.data.foreach_get("uv", uvs)
+        uvs = uvs.reshape(-1, 2).astype(np.float64)
+
+    return MeshArrays(
+        positions=positions,
+        edge_vertices=edge_vertices.reshape(-1, 2).astype(np.int64),
+        loop_start=face_arrays[0],
+        loop_total=face_arrays[1],
+        material_indices=face_arrays[2],
+        loop_vertices=loop_arrays[0],
+        loop_edges=loop_arrays[1],
+        uvs=uvs,
+    )
+
+
+def analyze_mesh_arrays(
+    arrays: MeshArrays,
+    merge_distance: float = 1e-5,
+    area_tolerance: float = 1e-12,
+    uv_tolerance: float = 1e-5,
+) -> MeshQuality:
+    """
+    Analyzes the mesh with vectorized adjacency computations:
+    - vertices within merge_distance of each other are merged into clusters,
+      all but one vertex of each cluster are counted as duplicates (with a
+      merge_distance of zero, only coincident vertices are merged)
+    - faces with an area of at most area_tolerance are degenerate
+    - UV islands are groups of faces connected by edges whose UVs
+      match within uv_tolerance
+    """
+    if not merge_distance >= 0:
+        raise ValueError(
+            f"merge_distance must not be negative: {merge_distance}")
+
+    a = arrays
+    num_faces = len(a.loop_start)
+    num_edges = len(a.edge_vertices)
+    report = MeshQuality(
+        vertices=len(a.positions), edges=num_edges, faces=num_faces)
+    if num_faces == 0:
+        report.loose_edges = num_edges
+        report.duplicate_vertices = _count_duplicates(
+            a.positions, merge_distance)
+        return report
+
+    loop_faces = np.repeat(np.arange(num_faces), a.loop_total)
+    next_loops = _next_loops(a.loop_start, a.loop_total)
+
+    # edge usage and orientation, +1 if a face traverses the edge
+    # from its first to its second vertex, -1 otherwise
+    edge_faces = np.bincount(a.loop_edges, minlength=num_edges)
+    first_vertices = np.take(a.edge_vertices[:, 0], a.loop_edges)
+    forward = a.loop_vertices == first_vertices
+    edge_directions = 2 * np.bincount(
+        a.loop_edges[forward], minlength=num_edges) - edge_faces
+
+    report.boundary_edges = int(np.count_nonzero(edge_faces == 1))
+    report.non_manifold_edges = int(np.count_nonzero(edge_faces > 2))
+    report.loose_edges = int(np.count_nonzero(edge_faces == 0))
+    report.inconsistent_edges = int(np.count_nonzero(
+        (edge_faces == 2) & (edge_directions != 0)))
+
+    # face areas and signed volume
+    vector_areas, uv_areas = _face_areas(a, next_loops)
+    areas = np.sqrt(np.einsum("ij,ij->i", vector_areas, vector_areas))
+    report.degenerate_faces = int(np.count_nonzero(areas <= area_tolerance))
+
+    closed = report.boundary_edges == 0 and report.non_manifold_edges == 0
+    if closed and report.inconsistent_edges == 0:
+        first_positions = np.take(
+            a.positions, a.loop_vertices[a.loop_start], axis=0)
+        volume = np.einsum("ij,ij->", first_positions, vector_areas) / 3.0
+        report.inward_normals = bool(volume < 0)
+
+    report.duplicate_vertices = _count_duplicates(a.positions, merge_distance)
+
+    # face adjacency across shared edges, from the loops of each edge
+    loops1, loops2 = _shared_edge_loops(a.loop_edges, edge_faces)
+    faces1, faces2 = loop_faces[loops1], loop_faces[loops2]
+    report.mesh_islands = _count_components(num_faces, faces1, faces2)
+
+    if a.uvs is not None:
+        # the faces are connected in UV space if the UVs of the
+        # edge's end points are the same in both faces
+        next1, next2 = next_loops[loops1], next_loops[loops2]
+        if report.inconsistent_edges == 0 and report.non_manifold_edges == 0:
+            # consistently oriented faces traverse shared edges in
+            # opposite directions
+            start2, end2 = next2, loops2
+        else:
+            same_direction = (a.loop_vertices[loops1]
+                              == a.loop_vertices[loops2])
+            start2 = np.where(same_direction, loops2, next2)
+            end2 = np.where(same_direction, next2, loops2)
+        connected = (
+            _uvs_match(a.uvs, loops1, start2, uv_tolerance) &
+            _uvs_match(a.uvs, next1, end2, uv_tolerance))
+        report.uv_islands = _count_components(
+            num_faces, faces1[connected], faces2[connected])
+
+    # per material statistics
+    num_materials = int(a.material_indices.max()) + 1
+    face_counts = np.bincount(a.material_indices, minlength=num_materials)
+    material_areas = np.bincount(
+        a.material_indices, weights=areas, minlength=num_materials)
+    material_uv_areas = None
+    if uv_areas is not None:
+        material_uv_areas = np.bincount(
+            a.material_indices, weights=np.abs(uv_areas),
+            minlength=num_materials)
+
+    for index in np.flatnonzero(face_counts):
+        report.materials.append(MaterialQuality(
+            index=int(index),
+            faces=int(face_counts[index]),
+            area=float(material_areas[index]),
+            uv_area=float(material_uv_areas[index])
+            if material_uv_areas is not None else 0.0,
+        ))
+
+    return report
+
+
+def analyze_object(
+    obj: bt.Object,
+    evaluated: bool = False,
+    texture_size: Optional[int] = None,
+    **tolerances,
+) -> MeshQuality:
+    """
+    Analyzes the mesh of the given object in world space (see
+    analyze_mesh_arrays for the tolerances), the evaluated mesh with
+    modifiers applied if evaluated is set. Texel densities use the given
+    texture size, or the largest image texture of each material.
+    """
+    if evaluated:
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+        obj_eval = obj.evaluated_get(depsgraph)
+        try:
+            arrays = read_mesh_arrays(obj_eval.to_mesh(), obj.matrix_world)
+        finally:
+            obj_eval.to_mesh_clear()
+    else:
+        arrays = read_mesh_arrays(
+            cast(bt.Mesh, obj.data), obj.matrix_world)
+
+    report = analyze_mesh_arrays(arrays, **tolerances)
+    report.name = obj.name
+
+    slots = obj.material_slots
+    for material_report in report.materials:
+        material = None
+        if material_report.index < len(slots):
+            material = slots[material_report.index].material
+        size = texture_size
+        if material is not None:
+            material_report.name = material.name
+            size = size or _get_texture_size(material)
+        if size and material_report.area > 0:
+            material_report.texture_size = size
+            material_report.texel_density = size * float(np.sqrt(
+                material_report.uv_area / material_report.area))
+
+    return report
+
+
+def get_quality_info(obj: bt.Object, **kwargs) -> dict:
+    """Returns a dictionary with the quality reports of the mesh objects
+    in the object's hierarchy and their totals (see analyze_object)."""
+    reports = [ analyze_object(o, **kwargs)
+                for o in get_hierarchy(obj) if o.type == 'MESH' ]
+
+    totals = {}
+    for name in ("vertices", "edges", "faces", "boundary_edges",
+                 "non_manifold_edges", "loose_edges", "inconsistent_edges",
+                 "degenerate_faces", "duplicate_vertices", "mesh_islands"):
+        totals[name] = sum(getattr(report, name) for report in reports)
+    totals["uv_islands"] = sum(report.uv_islands or 0 for report in reports)
+    totals["inward_normals"] = sum(
+        1 for report in reports if report.inward_normals)
+
+    return {
+        "unit": "m",
+        "totals": totals,
+        "objects": [ asdict(report) for report in reports ],
+    }
+
+
+def _next_loops(loop_start: np.ndarray, loop_total: np.ndarray) -> np.ndarray:
+    """returns the index of the next loop in the same face for each loop."""
+    next_loops = np.arange(1, int(loop_total.sum()) + 1, dtype=np.int64)
+    next_loops[loop_start + loop_total - 1] = loop_start
+    return next_loops
+
+
+def _shared_edge_loops(
+    loop_edges: np.ndarray,
+    edge_faces: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray]:
+    """returns the pairs of loops that are consecutive among the loops of
+       the same edge, the first loop of each pair being the smaller one.
+       Edges of two faces pair their first and last loop, only the loops
+       of non-manifold edges are sorted."""
+    num_loops = len(loop_edges)
+    loops = np.arange(num_loops)
+    first = np.full(len(edge_faces), num_loops)
+    last = np.full(len(edge_faces), -1)
+    np.minimum.at(first, loop_edges, loops)
+    np.maximum.at(last, loop_edges, loops)
+    manifold = edge_faces == 2
+    loops1, loops2 = first[manifold], last[manifold]
+
+    if np.any(edge_faces > 2):
+        # sorted by edge and index, as one key, which sorts much faster
+        # than a stable argsort of the edges
+        shared = np.flatnonzero(edge_faces[loop_edges] > 2)
+        keys = np.sort(loop_edges[shared] * num_loops + shared)
+        pairs = np.flatnonzero(
+            keys[1:] // num_loops == keys[:-1] // num_loops)
+        loops1 = np.concatenate((loops1, keys[pairs] % num_loops))
+        loops2 = np.concatenate((loops2, keys[pairs + 1] % num_loops))
+    return loops1, loops2
+
+
+def _face_areas(
+    a: MeshArrays,
+    next_loops: np.ndarray,
+) -> tuple[np.ndarray, Optional[np.ndarray]]:
+    """returns the (F, 3) vector areas (normal times area) and the signed UV
+       areas of all faces, summed over triangle fans in chunks of whole
+       faces."""
+    num_faces = len(a.loop_start)
+    num_loops = len(a.loop_vertices)
+    vector_areas = np.empty((num_faces, 3))
+    uv_areas = np.empty(num_faces) if a.uvs is not None else None
+
+    face_size = int(a.loop_total[0])
+    if np.all(a.loop_total == face_size):
+        _uniform_face_areas(a, face_size, vector_areas, uv_areas)
+        return vector_areas, uv_areas
+
+    face_bounds = np.searchsorted(
+        a.loop_start, np.arange(0, num_loops, LOOP_CHUNK_SIZE))
+    face_bounds = np.append(face_bounds, num_faces)
+
+    for first_face, end_face in zip(face_bounds[:-1], face_bounds[1:]):
+        faces = slice(first_face, end_face)
+        first_loop = a.loop_start[first_face]
+        end_loop = a.loop_start[end_face - 1] + a.loop_total[end_face - 1]
+        loop_start = a.loop_start[faces] - first_loop
+        loop_total = a.loop_total[faces]
+        next_loops_chunk = next_loops[first_loop:end_loop] - first_loop
+
+        # relative to the first corner, for precision far from the origin
+        p1 = np.take(
+            a.positions, a.loop_vertices[first_loop:end_loop], axis=0)
+        p1 -= np.repeat(np.take(p1, loop_start, axis=0), loop_total, axis=0)
+        p2 = np.take(p1, next_loops_chunk, axis=0)
+        for axis in range(3):
+            i, j = (axis + 1) % 3, (axis + 2) % 3
+            cross = p1[:, i] * p2[:, j] - p1[:, j] * p2[:, i]
+            vector_areas[faces, axis] = np.add.reduceat(cross, loop_start)
+
+        if uv_areas is not None:
+            uv1 = a.uvs[first_loop:end_loop]
+            uv2 = np.take(uv1, next_loops_chunk, axis=0)
+            shoelace = uv1[:, 0] * uv2[:, 1] - uv2[:, 0] * uv1[:, 1]
+            uv_areas[faces] = np.add.reduceat(shoelace, loop_start)
+
+    vector_areas *= 0.5
+    if uv_areas is not None:
+        uv_areas *= 0.5
+    return vector_areas, uv_areas
+
+
+def _uniform_face_areas(
+    a: MeshArrays,
+    face_size: int,
+    vector_areas: np.ndarray,
+    uv_areas: Optional[np.ndarray],
+):
+    """computes the face areas of meshes whose faces all have face_size
+       corners, e.g. triangulated meshes, from contiguous arrays of the
+       coordinates of each corner instead of reducing over the loops."""
+    columns = [ np.ascontiguousarray(a.positions[:, axis])
+                for axis in range(3) ]
+    chunk_size = max(LOOP_CHUNK_SIZE // face_size, 1)
+    for begin in range(0, len(a.loop_start), chunk_size):
+        faces = slice(begin, begin + chunk_size)
+        loops = slice(begin * face_size, (begin + chunk_size) * face_size)
+        corner_vertices = a.loop_vertices[loops].reshape(-1, face_size)
+
+        # relative to the first corner, for precision far from the origin
+        first = [ np.take(column, corner_vertices[:, 0])
+                  for column in columns ]
+        fan = [ [ np.take(column, corner_vertices[:, corner]) - start
+                  for column, start in zip(columns, first) ]
+                for corner in range(1, face_size) ]
+        vector_areas[faces] = 0.0
+        for p1, p2 in zip(fan[:-1], fan[1:]):
+            for axis in range(3):
+                i, j = (axis + 1) % 3, (axis + 2) % 3
+                vector_areas[faces, axis] += p1[i] * p2[j] - p1[j] * p2[i]
+
+        if uv_areas is not None:
+            uvs = a.uvs[loops].reshape(-1, face_size, 2)
+            uv_fan = [ uvs[:, corner] - uvs[:, 0]
+                       for corner in range(1, face_size) ]
+            uv_areas[faces] = 0.0
+            for u1, u2 in zip(uv_fan[:-1], uv_fan[1:]):
+                uv_areas[faces] += u1[:, 0] * u2[:, 1] - u2[:, 0] * u1[:, 1]
+
+    vector_areas *= 0.5
+    if uv_areas is not None:
+        uv_areas *= 0.5
+
+
+def _uvs_match(
+    uvs: np.ndarray,
+    loops1: np.ndarray,
+    loops2: np.ndarray,
+    tolerance: float,
+) -> np.ndarray:
+    close = np.abs(
+        np.take(uvs, loops1, axis=0) - np.take(uvs, loops2, axis=0)
+    ) <= tolerance
+    # faster than reducing the short rows with np.all
+    return close[:, 0] & close[:, 1]
+
+
+def _count_duplicates(positions: np.ndarray, merge_distance: float) -> int:
+    """returns the number of vertices removed by merging all vertices within
+       merge_distance of each other, i.e. the number of vertices minus the
+       number of clusters. Vertices are sorted into a grid with cells of
+       size merge_distance and coincident vertices of each cell are merged
+       first. Pairs are then compared within cells and with the occupied
+       cells among their neighbours, visiting each pair of cells once."""
+    if not np.all(np.isfinite(positions)):
+        positions = positions[np.all(np.isfinite(positions), axis=1)]
+    # -0.0 and 0.0 are the same position, but not the same bytes
+    positions = positions + 0.0
+    if merge_distance == 0 or len(positions) < 2:
+        return len(positions) - len(_unique_rows(positions))
+
+    cells, dims = _grid_cells(positions, merge_distance)
+    columns = cells[:, 0] + dims[0] * cells[:, 1]
+    if np.prod(dims.astype(np.float64)) < 2.0 ** 62:
+        keys = columns * dims[2] + cells[:, 2]
+    else:
+        # rank of the (x, y) column, which keeps the keys within int64
+        ranks = np.unique(columns, return_inverse=True)[1]
+        keys = ranks * dims[2] + cells[:, 2]
+
+    order = np.argsort(keys)
+    keys = keys[order]
+    starts = _run_starts(keys)
+    counts = np.diff(np.append(starts, len(keys)))
+
+    # coincident vertices share a cell, only cells with several
+    # vertices are searched for them
+    num_duplicates = 0
+    shared = np.repeat(counts > 1, counts)
+    if np.any(shared):
+        members = order[shared]
+        unique = np.zeros(len(members), dtype=bool)
+        unique[_unique_rows(positions[members])] = True
+        num_duplicates = len(members) - int(np.count_nonzero(unique))
+        if num_duplicates > 0:
+            keep = np.ones(len(order), dtype=bool)
+            keep[shared] = unique
+            order, keys = order[keep], keys[keep]
+            starts = _run_starts(keys)
+            counts = np.diff(np.append(starts, len(keys)))
+
+    # vertices are numbered in cell order from here on
+    positions = np.take(positions, order, axis=0)
+    cells = np.take(cells, order[starts], axis=0)
+    max_distance2 = merge_distance * merge_distance
+    nodes1, nodes2 = [], []
+    cells1 = np.flatnonzero(counts > 1)
+    for cell_pairs in [ (cells1, cells1) ] + _neighbour_cells(cells, dims):
+        for vertices1, vertices2 in _cell_vertex_pairs(
+                starts, counts, *cell_pairs):
+            differences = (np.take(positions, vertices1, axis=0)
+                           - np.take(positions, vertices2, axis=0))
+            distances2 = np.einsum("ij,ij->i", differences, differences)
+            close = distances2 <= max_distance2
+            nodes1.append(vertices1[close])
+            nodes2.append(vertices2[close])
+
+    if not nodes1:
+        return num_duplicates
+
+    num_clusters = _count_components(
+        len(positions), np.concatenate(nodes1), np.concatenate(nodes2))
+    return num_duplicates + len(positions) - num_clusters
+
+
+def _unique_rows(values: np.ndarray) -> np.ndarray:
+    """returns the indices of the first occurrences of the distinct rows,
+       compared by their bytes in a single sort of a void view."""
+    values = np.ascontiguousarray(values)
+    rows = values.view(np.dtype((np.void, values.dtype.itemsize
+                                 * values.shape[1]))).ravel()
+    return np.unique(rows, return_index=True)[1]
+
+
+def _run_starts(sorted_values: np.ndarray) -> np.ndarray:
+    """returns the indices at which runs of equal values start."""
+    if len(sorted_values) == 0:
+        return np.empty(0, dtype=np.int64)
+    changes = np.flatnonzero(sorted_values[1:] != sorted_values[:-1]) + 1
+    return np.concatenate(([0], changes))
+
+
+def _grid_cells(
+    positions: np.ndarray,
+    cell_size: float,
+) -> tuple[np.ndarray, np.ndarray]:
+    """returns the (N, 3) int64 grid coordinates of the positions and the
+       grid dimensions. Coordinates start at 1, so that neighbours of
+       occupied cells are inside the grid. If the product of the dimensions
+       doesn't fit into int64, gaps between occupied cells are shortened to
+       a single empty cell, so that at least x and y keys fit."""
+    coordinates = np.floor(positions / cell_size)
+    low, high = coordinates.min(axis=0), coordinates.max(axis=0)
+    if np.prod(high - low + 3) < 2.0 ** 62:
+        cells = (coordinates - (low - 1)).astype(np.int64)
+        return cells, (high - low + 3).astype(np.int64)
+
+    cells = np.empty(positions.shape, dtype=np.int64)
+    for axis in range(3):
+        values, inverse = np.unique(
+            coordinates[:, axis], return_inverse=True)
+        steps = np.minimum(np.diff(values), 2.0).astype(np.int64)
+        cells[:, axis] = np.concatenate(([1], 1 + np.cumsum(steps)))[inverse]
+    return cells, cells.max(axis=0) + 2
+
+
+def _neighbour_cells(
+    cells: np.ndarray,
+    dims: np.ndarray,
+) -> list[tuple[np.ndarray, np.ndarray]]:
+    """returns pairs of indices of occupied neighbouring cells, for half of
+       the 26 neighbour offsets, so that each pair is found once. The cells
+       are sorted by column (x, y) and z. Neighbouring columns are looked
+       up first, which skips all cells of columns without neighbours."""
+    num_cells = len(cells)
+    columns = cells[:, 0] + dims[0] * cells[:, 1]
+    column_starts = _run_starts(columns)
+    column_values = columns[column_starts]
+    column_rows = np.repeat(np.arange(len(column_starts)),
+                            np.diff(np.append(column_starts, num_cells)))
+    # increasing keys of the cells, from the column rank and z
+    cell_keys = column_rows * dims[2] + cells[:, 2]
+
+    # the next cell above in the same column
+    above = np.flatnonzero((column_rows[1:] == column_rows[:-1])
+                           & (cells[1:, 2] == cells[:-1, 2] + 1))
+    pairs = [ (above, above + 1) ]
+
+    # the next column in x, and the columns at x - 1, x and x + 1 in the
+    # next row, whose keys are consecutive and found with a single search
+    num_columns = len(column_values)
+    lookups = [ (np.arange(1, num_columns + 1), column_values + 1) ]
+    targets = column_values + (dims[0] - 1)
+    ranks = np.searchsorted(column_values, targets)
+    for _ in range(3):
+        lookups.append((ranks, targets))
+        found = column_values[ranks.clip(max=num_columns - 1)] == targets
+        ranks, targets = ranks + found, targets + 1
+
+    for ranks, targets in lookups:
+        ranks = ranks.clip(max=num_columns - 1)
+        found = column_values[ranks] == targets
+        if not np.any(found):
+            continue
+
+        cells1 = np.flatnonzero(found[column_rows])
+        base_keys = ranks[column_rows[cells1]] * dims[2] + cells[cells1, 2]
+        for dz in (-1, 0, 1):
+            cells2 = np.searchsorted(cell_keys, base_keys + dz)
+            cells2 = cells2.clip(max=num_cells - 1)
+            hit = cell_keys[cells2] == base_keys + dz
+            pairs.append((cells1[hit], cells2[hit]))
+
+    return pairs
+
+
+def _cell_vertex_pairs(
+    starts: np.ndarray,
+    counts: np.ndarray,
+    cells1: np.ndarray,
+    cells2: np.ndarray,
+):
+    """yields all pairs of vertices of the given pairs of cells, whose
+       vertices are numbered consecutively from starts, in chunks of whole
+       pairs of cells. Pairs of a cell with itself only include each pair
+       of distinct vertices once."""
+    sizes = counts[cells1] * counts[cells2]
+    offsets = np.cumsum(sizes) - sizes
+    chunk_bounds = np.searchsorted(
+        offsets, np.arange(0, int(sizes.sum()), PAIR_CHUNK_SIZE),
+        side="right") - 1
+    chunk_bounds = np.unique(np.append(chunk_bounds, len(sizes)))
+
+    for begin, end in zip(chunk_bounds[:-1], chunk_bounds[1:]):
+        pair_cells = np.repeat(np.arange(begin, end), sizes[begin:end])
+        local = np.arange(len(pair_cells)) + offsets[begin] \
+            - offsets[pair_cells]
+        counts2 = counts[cells2[pair_cells]]
+        vertices1 = starts[cells1[pair_cells]] + local // counts2
+        vertices2 = starts[cells2[pair_cells]] + local % counts2
+
+        ordered = (cells1[pair_cells] != cells2[pair_cells]) \
+            | (vertices1 < vertices2)
+        yield vertices1[ordered], vertices2[ordered]
+
+
+def _count_components(
+    num_nodes: int,
+    nodes1: np.ndarray,
+    nodes2: np.ndarray,
+) -> int:
+    """returns the number of connected components of the graph with the
+       given edges. Trees are merged by hooking roots onto smaller roots and
+       flattened by pointer jumping, edges are then replaced by the edges
+       between the roots of their nodes, until no edge connects different
+       trees."""
+    # smaller indices for fewer bytes per pointer jumping pass
+    dtype = np.int32 if num_nodes < 2 ** 31 else np.int64
+    parents = np.arange(num_nodes, dtype=dtype)
+    while len(nodes1) > 0:
+        roots1, roots2 = parents[nodes1], parents[nodes2]
+        different = roots1 != roots2
+        nodes1, nodes2 = roots1[different], roots2[different]
+        # with concurrent writes, one of the smaller roots wins,
+        # which keeps the trees acyclic
+        hooked = np.maximum(nodes1, nodes2)
+        parents[hooked] = np.minimum(nodes1, nodes2)
+        parents = _flatten(parents, hooked)
+
+    return int(np.count_nonzero(parents == np.arange(num_nodes)))
+
+
+def _flatten(parents: np.ndarray, hooked: np.ndarray) -> np.ndarray:
+    """returns the parents with all nodes pointing directly at their roots,
+       after the hooked roots were given new parents. All other nodes point
+       at roots, so that once the few hooked roots are flattened, a single
+       pass over all nodes suffices. Otherwise, pointer jumping over all
+       nodes halves the depth of the trees with each pass."""
+    is_hooked = np.zeros(len(parents), dtype=bool)
+    is_hooked[hooked] = True
+    hooked = np.flatnonzero(is_hooked)
+    if len(hooked) <= len(parents) // 8:
+        while True:
+            hooked_parents = parents[hooked]
+            grandparents = parents[hooked_parents]
+            if np.array_equal(grandparents, hooked_parents):
+                return np.take(parents, parents)
+            parents[hooked] = grandparents
+
+    grandparents = np.empty_like(parents)
+    while True:
+        np.take(parents, parents, out=grandparents)
+        if np.array_equal(grandparents, parents):
+            return parents
+        parents, grandparents = grandparents, parents
+
+
+def _get_texture_size(material: bt.Material) -> Optional[int]:
+    """returns the largest dimension of the material's image textures."""
+    if not material.use_nodes or material.node_tree is None:
+        return None
+
+    sizes = [ max(node.image.size) for node in material.node_tree.nodes
+              if node.type == 'TEX_IMAGE' and node.image is not None ]
+    return max(sizes) if sizes else None
@@ -0,0 +1,200 @@
+# Blender Tools
+# Copyright 2024 Ralph Wiedemeier, Frame Factory GmbH
+# License: MIT
+
+from pathlib import Path
+from queue import Queue
+from threading import Thread
+import logging
+
+import numpy as np
+
+import bpy
+from bpy import types as bt
+
+from ff_tools.colmap.database import COLMAPDatabase
+from ff_tools.colmap.reconstruction import Reconstruction
+from ff_tools.colmap.utils import CAMERA_MODEL_NAMES, blender_camera_intrinsics, poses_from_blender_matrices
+from ff_tools.rendering.camera import get_all_camera_objects
+from ff_tools.rendering.render import render_still_jpeg, render_still_png
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_camera_intrinsics(
+    camera_objects: list[bt.Object],
+    width: int,
+    height: int,
+) -> np.ndarray:
+    """
+    Returns the (N, 4) PINHOLE parameters (fx, fy, cx, cy) of the given
+    perspective camera objects for renders of the given size, taking
+    sensor fit and lens shift into account (see blender_camera_intrinsics).
+    Pixels are assumed to be square.
+    """
+    cam_datas: list[bt.Camera] = [ obj.data for obj in camera_objects ]
+    fx, fy, cx, cy = blender_camera_intrinsics(
+        [ cam_data.lens for cam_data in cam_datas ],
+        [ cam_data.sensor_width for cam_data in cam_datas ],
+        [ cam_data.sensor_height for cam_data in cam_datas ],
+        [ cam_data.sensor_fit for cam_data in cam_datas ],
+        [ cam_data.shift_x for cam_data in cam_datas ],
+        [ cam_data.shift_y for cam_data in cam_datas ],
+        width, height)
+
+    params = np.stack([ fx, fy, cx, cy ], axis=-1).reshape(-1, 4)
+    return params
+
+
+def export_colmap_dataset(
+    output_dir: str|Path,
+    camera_objects: list[bt.Object] = None,
+    width: int = 1920,
+    height: int = 1080,
+    file_format: str = "JPEG",
+    quality: int = 90,
+    skip_existing: bool = False,
+    model_ext: str = ".bin",
+    batch_size: int = 64,
+) -> Reconstruction:
+    """
+    Renders the scene from each of the given cameras (default: all perspective
+    cameras, sorted by name) and writes a COLMAP dataset with ground truth
+    intrinsics and poses to output_dir:
+    - images/: the rendered images (file_format JPEG or PNG)
+    - database.db: cameras and images, with the rotations and camera positions
+      as pose priors (prior_q, prior_t), as read by colmap.pair_generation
+    - sparse/0/: the sparse model with cameras and images, without 3D points
+
+    Cameras with equal intrinsics share a COLMAP camera. Intrinsics and poses are
+    computed for all views upfront, the database rows are written by a background
+    thread in batches of batch_size images while the next views are rendered.
+    Existing images are not rendered again if skip_existing is set.
+    """
+    if file_format not in ("JPEG", "PNG"):
+        raise ValueError(f"unsupported file format: {file_format}")
+
+    output_dir = Path(output_dir)
+    image_dir = output_dir / "images"
+    model_dir = output_dir / "sparse" / "0"
+    image_dir.mkdir(parents=True, exist_ok=True)
+    model_dir.mkdir(parents=True, exist_ok=True)
+
+    if camera_objects is None:
+        camera_objects = sorted(get_all_camera_objects(), key=lambda obj: obj.name)
+
+    perspective = [ obj.data.type == "PERSP" for obj in camera_objects ]
+    if not all(perspective):
+        logger.warning(f"skipping {perspective.count(False)} non-perspective cameras")
+        camera_objects = [ obj for obj, persp in zip(camera_objects, perspective) if persp ]
+
+    # intrinsics and poses of all views
+    params = get_camera_intrinsics(camera_objects, width, height)
+    unique_params, image_camera_rows = np.unique(params, axis=0, return_inverse=True)
+    camera_ids = np.arange(1, len(unique_params) + 1)
+    image_camera_ids = camera_ids[image_camera_rows.reshape(-1)]
+
+    matrices = np.array([ np.array(obj.matrix_world) for obj in camera_objects ]).reshape(-1, 4, 4)
+    qvecs, tvecs = poses_from_blender_matrices(matrices)
+
+    suffix = ".jpg" if file_format == "JPEG" else ".png"
+    names = [ f"{obj.name}{suffix}" for obj in camera_objects ]
+
+    reconstruction = Reconstruction(
+        camera_ids=camera_ids,
+        camera_model_ids=np.full(len(camera_ids), CAMERA_MODEL_NAMES["PINHOLE"].model_id),
+        camera_widths=np.full(len(camera_ids), width),
+        camera_heights=np.full(len(camera_ids), height),
+        camera_params=list(unique_params),
+        image_ids=np.arange(1, len(names) + 1),
+        qvecs=qvecs,
+        tvecs=tvecs,
+        image_camera_ids=image_camera_ids,
+        names=names,
+    )
+
+    # database rows are written by a background thread while rendering
+    rows = Queue(maxsize=batch_size * 2)
+    errors = []
+    writer = Thread(
+        target=_write_database,
+        args=(output_dir / "database.db", reconstruction, rows, batch_size, errors))
+    writer.start()
+
+    scene = bpy.context.scene
+    previous_camera = scene.camera
+    previous_percentage = scene.render.resolution_percentage
+    scene.render.resolution_percentage = 100
+
+    try:
+        for row, (obj, name) in enumerate(zip(camera_objects, names)):
+            file_path = image_dir / name
+            if not (skip_existing and file_path.exists()):
+                scene.camera = obj
+                if file_format == "JPEG":
+                    render_still_jpeg(width, height, quality, file_path)
+                else:
+                    render_still_png(width, height, False, file_path)
+                logger.info(f"rendered view {row + 1}/{len(names)}: {name}")
+            rows.put(row)
+    finally:
+        rows.put(None)
+        writer.join()
+        scene.camera = previous_camera
+        scene.render.resolution_percentage = previous_percentage
+
+    if errors:
+        raise errors[0]
+
+    reconstruction.write(model_dir, ext=model_ext)
+    logger.info(f"exported {len(names)} views with {len(camera_ids)} cameras to '{output_dir}'")
+    return reconstruction
+
+
+def _write_database(
+    database_path: Path,
+    reconstruction: Reconstruction,
+    rows: Queue,
+    batch_size: int,
+    errors: list,
+):
+    """Writes the cameras of the reconstruction, then the images whose rows
+    arrive through the queue (until None), committing each batch. An exception
+    is appended to errors, to be raised by the rendering thread."""
+    rec = reconstruction
+    db = None
+    done = False
+
+    try:
+        centers = rec.camera_centers()
+        database_path.unlink(missing_ok=True)
+        db = COLMAPDatabase.connect(database_path)
+        db.create_tables()
+        with db.import_session(synchronous="NORMAL"):
+            for row, camera_id in enumerate(rec.camera_ids.tolist()):
+                camera = rec.camera_at(row)
+                db.add_camera(CAMERA_MODEL_NAMES[camera.model].model_id,
+                              camera.width, camera.height, camera.params, camera_id=camera_id)
+
+        while not done:
+            batch = [ rows.get() ]
+            while len(batch) < batch_size and not rows.empty():
+                batch.append(rows.get())
+            done = batch[-1] is None
+            batch = [ row for row in batch if row is not None ]
+
+            with db.import_session(synchronous="NORMAL"):
+                for row in batch:
+                    db.add_image(rec.names[row], int(rec.image_camera_ids[row]),
+                                 prior_q=rec.qvecs[row], prior_t=centers[row],
+                                 image_id=int(rec.image_ids[row]))
+    except Exception as e:
+        logger.error(f"failed to write database: '{database_path}'")
+        errors.append(e)
+        # keep consuming rows, so that the rendering loop doesn't block
+        while not done:
+            done = rows.get() is None
+    finally:
+        if db is not None:
+            db.close()
@@ -0,0 +1,235 @@
+# Blender Tools
+# Copyright 2024 Ralph Wiedemeier, Frame Factory GmbH
+# License: MIT
+
+from pathlib import Path
+import logging
+
+import numpy as np
+
+import bpy
+from bpy import types as bt
+from mathutils import Matrix
+
+from ff_tools.colmap.reconstruction import Reconstruction
+from ff_tools.colmap.utils import (
+    Points3D, blender_camera_settings, random_sample_indices, voxel_downsample_indices)
+from ff_tools.rendering.camera import set_background_image
+
+
+logger = logging.getLogger(__name__)
+
+BACKGROUND_MODES = ("NONE", "LAZY", "PROXY")
+
+
+def import_colmap_cameras(
+    reconstruction: Reconstruction,
+    collection: bt.Collection = None,
+    image_dir: str|Path = None,
+    background: str = "LAZY",
+    proxy_size: int = 512,
+    proxy_dir: str|Path = None,
+    sensor_width: float = 36.0,
+    name_prefix: str = "",
+) -> list[bt.Object]:
+    """
+    Creates a camera object for each registered image of the given reconstruction
+    and adds it to the given collection. Lens, sensor and shift are derived from the
+    COLMAP camera parameters, poses from the image rotations and translations.
+    Images sharing a COLMAP camera share a single camera datablock unless a
+    background image is attached, which requires a datablock per image.
+    Datablocks of lazily loaded backgrounds are copied when they are attached.
+
+    background controls how the images are attached as camera backgrounds:
+    - "NONE": no background images
+    - "LAZY": only the image path is stored in the object's "colmap_image_path"
+      property, use `load_background_images` to attach them later on demand
+    - "PROXY": downscaled copies of the images (longest side proxy_size) are
+      written to proxy_dir (default: image_dir/proxies) and attached
+    """
+    if background not in BACKGROUND_MODES:
+        raise ValueError(f"invalid background mode: {background}")
+
+    collection = collection or bpy.context.collection
+    image_dir = Path(image_dir) if image_dir else None
+    rec = reconstruction
+
+    camera_datas = _create_camera_datas(rec, sensor_width, name_prefix)
+    matrices = rec.blender_matrices_world()
+    camera_rows = rec.image_camera_rows.tolist()
+    image_ids = rec.image_ids.tolist()
+    per_image_data = background == "PROXY" and image_dir is not None
+
+    objects = []
+    for row, name in enumerate(rec.names):
+        cam_data = camera_datas[camera_rows[row]]
+        if per_image_data:
+            cam_data = cam_data.copy()
+            cam_data.name = f"{name_prefix}{name}"
+
+        obj = bpy.data.objects.new(f"{name_prefix}{name}", cam_data)
+        obj.matrix_world = Matrix(matrices[row].tolist())
+        obj["colmap_image_id"] = image_ids[row]
+        if image_dir:
+            obj["colmap_image_path"] = str(image_dir / name)
+
+        collection.objects.link(obj)
+        objects.append(obj)
+
+    # the shared datablocks are only templates if each image has its own copy
+    if per_image_data:
+        for cam_data in camera_datas:
+            bpy.data.cameras.remove(cam_data)
+
+    logger.info(f"imported {len(objects)} cameras into collection '{collection.name}'")
+
+    if background == "PROXY" and image_dir:
+        proxy_dir = Path(proxy_dir) if proxy_dir else image_dir / "proxies"
+        load_background_images(objects, proxy_size, proxy_dir)
+
+    return objects
+
+
+def load_background_images(
+    objects: list[bt.Object],
+    proxy_size: int = 0,
+    proxy_dir: str|Path = None,
+) -> list[bt.CameraBackgroundImage]:
+    """
+    Attaches the images referenced by the "colmap_image_path" property of the given
+    camera objects as background images. If proxy_size is given, downscaled copies
+    of the images are created in proxy_dir (or reused if they already exist) and
+    attached instead of the full resolution images. Objects sharing their
+    camera datablock get their own copy before the image is attached.
+    """
+    proxy_dir = Path(proxy_dir) if proxy_dir else None
+    if proxy_size and proxy_dir:
+        proxy_dir.mkdir(parents=True, exist_ok=True)
+
+    bg_images = []
+    for obj in objects:
+        image_path = obj.get("colmap_image_path")
+        if not image_path:
+            continue
+
+        cam_data: bt.Camera = obj.data
+        if cam_data.background_images:
+            continue
+
+        try:
+            if proxy_size and proxy_dir:
+                image = _load_proxy_image(Path(image_path), proxy_size, proxy_dir)
+            else:
+                image = bpy.data.images.load(image_path, check_existing=True)
+        except RuntimeError as e:
+            logger.warning(f"failed to load background image: '{image_path}'")
+            logger.warning(e)
+            continue
+
+        if cam_data.users > 1:
+            cam_data = cam_data.copy()
+            cam_data.name = obj.name
+            obj.data = cam_data
+
+        bg_images.append(set_background_image(cam_data, image))
+        cam_data.show_background_images = True
+
+    return bg_images
+
+
+def import_colmap_points(
+    points3D: Points3D,
+    collection: bt.Collection = None,
+    name: str = "colmap_points",
+    voxel_size: float = None,
+    max_points: int = None,
+    seed: int = None,
+) -> bt.Object:
+    """
+    Creates a single mesh object with one vertex per 3D point and adds it to the
+    given collection. Point colors are written to the "color" byte color attribute,
+    reprojection errors and track lengths to the "error" and "track_length"
+    attributes. For display, the points can be decimated first by keeping one point
+    per voxel of size voxel_size and/or a random subset of at most max_points points.
+    """
+    collection = collection or bpy.context.collection
+
+    num_points = len(points3D)
+    if voxel_size:
+        points3D = points3D.subset(voxel_downsample_indices(points3D.xyz, voxel_size))
+    if max_points is not None:
+        points3D = points3D.subset(random_sample_indices(len(points3D), max_points, seed))
+
+    count = len(points3D)
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(count)
+    mesh.vertices.foreach_set("co", points3D.xyz.astype(np.float32).ravel())
+
+    colors = np.ones((count, 4), dtype=np.float32)
+    colors[:, :3] = points3D.rgb * np.float32(1 / 255)
+    color_attr = mesh.attributes.new("color", "BYTE_COLOR", "POINT")
+    color_attr.data.foreach_set("color_srgb", colors.ravel())
+    mesh.color_attributes.active_color = color_attr
+
+    error_attr = mesh.attributes.new("error", "FLOAT", "POINT")
+    error_attr.data.foreach_set("value", points3D.error.astype(np.float32))
+
+    track_attr = mesh.attributes.new("track_length", "INT", "POINT")
+    track_attr.data.foreach_set("value", points3D.track_lengths.astype(np.int32))
+
+    mesh.update()
+
+    obj = bpy.data.objects.new(name, mesh)
+    collection.objects.link(obj)
+
+    logger.info(f"imported {count} of {num_points} points into collection '{collection.name}'")
+    return obj
+
+
+def _create_camera_datas(
+    reconstruction: Reconstruction,
+    sensor_width: float,
+    name_prefix: str,
+) -> list[bt.Camera]:
+    """
+    Creates one camera datablock per COLMAP camera. The sensor is fit to the larger
+    image dimension, the principal point offset is expressed as lens shift.
+    Distortion parameters are ignored.
+    """
+    rec = reconstruction
+    horizontal, lenses, shifts_x, shifts_y = blender_camera_settings(
+        *rec.camera_intrinsics(), rec.camera_widths, rec.camera_heights, sensor_width)
+
+    camera_datas = []
+    for row, camera_id in enumerate(rec.camera_ids.tolist()):
+        cam_data = bpy.data.cameras.new(f"{name_prefix}colmap_camera_{camera_id}")
+        cam_data.sensor_fit = "HORIZONTAL" if horizontal[row] else "VERTICAL"
+        cam_data.sensor_width = sensor_width
+        cam_data.sensor_height = sensor_width
+        cam_data.lens = float(lenses[row])
+        cam_data.shift_x = float(shifts_x[row])
+        cam_data.shift_y = float(shifts_y[row])
+        cam_data["colmap_camera_id"] = camera_id
+        camera_datas.append(cam_data)
+
+    return camera_datas
+
+
+def _load_proxy_image(image_path: Path, proxy_size: int, proxy_dir: Path) -> bt.Image:
+    """
+    Returns a downscaled copy of the given image with its longest side scaled to
+    proxy_size. The copy is written to proxy_dir, existing copies are reused.
+    """
+    proxy_path = proxy_dir / f"{image_path.stem}_{proxy_size}{image_path.suffix}"
+
+    if not proxy_path.exists():
+        image = bpy.data.images.load(str(image_path))
+        width, height = image.size
+        scale = proxy_size / max(width, height, 1)
+        if scale < 1.0:
+            image.scale(max(round(width * scale), 1), max(round(height * scale), 1))
+        image.filepath_raw = str(proxy_path)
+        image.save()
+        bpy.data.images.remove(image)
+
+    return bpy.data.images.load(str(proxy_path), check_existing=True)
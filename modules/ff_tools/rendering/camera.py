@@ -59,11 +59,13 @@ def set_background_image(camera: bt.Camera, image: bt.Image) -> bt.CameraBackgro
 def ortho_camera_frame_top_down(
     camera: bt.Object,
     target: bt.Object,
+    exact: bool = False,
 ) -> list[float, float]:
     """
     Adjusts the orthographic camera such that it frames the target object
     in a top-down view. Returns the target object's size to be used to frame
-    the target object precisely.
+    the target object precisely. If exact is set, the target is framed by its
+    mesh vertices instead of the (looser) bounding boxes of its objects.
     """
     cam_data: bt.Camera = camera.data
     cam_data.type = "ORTHO"
@@ -72,7 +74,7 @@ def ortho_camera_frame_top_down(
     # ensure matrices are updated for bounding box calculation
     bpy.context.evaluated_depsgraph_get()
     
-    bb = get_bounding_box(target)
+    bb = get_bounding_box(target, exact=exact)
     center = (bb[0] + bb[1]) * 0.5
     extent = bb[1] - bb[0]
 
@@ -89,6 +91,7 @@ def camera_dolly_frame_object(
     orientation: float,
     tilt: float,
     zoom: float = 1.0,
+    exact: bool = False,
 ):
     """
     Adjusts the camera and dolly to frame the target object.
@@ -97,6 +100,8 @@ def camera_dolly_frame_object(
     The orientation angle (in degrees) affects the target orientation.
     The zoom factor scales the distance to the target. Values < 1
     zoom in on the target, values > 1 move further away.
+    If exact is set, the target is framed by its mesh vertices instead of
+    the (looser) bounding boxes of its objects.
     """
     cam_data: bt.Camera = camera.data
     fov = cam_data.angle
@@ -112,7 +117,7 @@ def camera_dolly_frame_object(
     
     # Aligns the object such that is centered by x and y
     # and its bottom aligned with the xy-plane.
-    bb = get_bounding_box(target)
+    bb = get_bounding_box(target, exact=exact)
     center = (bb[0] + bb[1]) * 0.5
     extent = bb[1] - bb[0]
     target.location -= center
@@ -122,7 +127,7 @@ def camera_dolly_frame_object(
     dolly.location = (0, 0, extent.z * 0.5)
 
     # calculate and set camera distance
-    bb = get_bounding_box(target, camera) # bounding box in camera space
+    bb = get_bounding_box(target, camera, exact=exact) # bounding box in camera space
     extent = bb[1] - bb[0]
     distance = extent.y * 0.4
     distance += max(extent) / (2 * tan(fov / 2))
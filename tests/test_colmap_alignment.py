@@ -0,0 +1,133 @@
+import numpy as np
+import pytest
+
+from ff_tools.colmap import alignment
+from ff_tools.colmap.alignment import (
+    Sim3,
+    align_camera_centers,
+    transform_reconstruction,
+    umeyama,
+)
+from ff_tools.colmap.benchmark import synthetic_reconstruction
+
+
+def random_sim3(seed=0):
+    rng = np.random.default_rng(seed)
+    rotation, _ = np.linalg.qr(rng.normal(size=(3, 3)))
+    if np.linalg.det(rotation) < 0:
+        rotation[:, 0] *= -1
+    return Sim3(float(rng.uniform(0.1, 10.0)), rotation, rng.normal(0, 5, 3))
+
+
+def assert_sim3_close(result, expected, atol=1e-9):
+    assert result.scale == pytest.approx(expected.scale, rel=atol)
+    np.testing.assert_allclose(result.rotation, expected.rotation, atol=atol)
+    np.testing.assert_allclose(result.translation, expected.translation, atol=atol * 10)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_umeyama_recovers_transform(seed):
+    sim3 = random_sim3(seed)
+    src = np.random.default_rng(seed + 10).normal(0, 3, (50, 3))
+    dst = sim3.transform_points(src)
+    assert_sim3_close(umeyama(src, dst), sim3)
+
+    # the minimal number of points
+    assert_sim3_close(umeyama(src[:3], dst[:3]), sim3, atol=1e-7)
+
+    # noisy correspondences
+    noisy = dst + np.random.default_rng(seed + 20).normal(0, 1e-4 * sim3.scale, dst.shape)
+    assert_sim3_close(umeyama(src, noisy), sim3, atol=1e-3)
+
+
+def test_umeyama_without_scale():
+    sim3 = random_sim3(1)
+    src = np.random.default_rng(1).normal(0, 3, (20, 3))
+    rigid = Sim3(1.0, sim3.rotation, sim3.translation)
+    assert_sim3_close(umeyama(src, rigid.transform_points(src), estimate_scale=False), rigid)
+
+    # with a scaled target, the rotation is still recovered
+    result = umeyama(src, sim3.transform_points(src), estimate_scale=False)
+    assert result.scale == 1.0
+    np.testing.assert_allclose(result.rotation, sim3.rotation, atol=1e-9)
+
+
+def test_umeyama_avoids_reflections():
+    src = np.random.default_rng(2).normal(size=(30, 3))
+    result = umeyama(src, src * np.array([1.0, 1.0, -1.0]))
+    assert np.linalg.det(result.rotation) == pytest.approx(1.0)
+
+
+def test_umeyama_errors():
+    with pytest.raises(ValueError):
+        umeyama(np.zeros((4, 3)), np.zeros((5, 3)))
+    with pytest.raises(ValueError):
+        umeyama(np.zeros((2, 3)), np.zeros((2, 3)))
+
+
+def test_sim3_operations():
+    a, b = random_sim3(3), random_sim3(4)
+    points = np.random.default_rng(3).normal(size=(10, 3))
+
+    homogeneous = np.column_stack([ points, np.ones(len(points)) ])
+    np.testing.assert_allclose((homogeneous @ a.matrix().T)[:, :3], a.transform_points(points))
+    assert_sim3_close(Sim3.from_matrix(a.matrix()), a)
+
+    np.testing.assert_allclose(a.inverse().transform_points(a.transform_points(points)), points)
+    np.testing.assert_allclose((a @ b).transform_points(points),
+                               a.transform_points(b.transform_points(points)))
+    np.testing.assert_allclose((a @ b).matrix(), a.matrix() @ b.matrix())
+
+
+def test_align_camera_centers():
+    rec = synthetic_reconstruction(30, 10, seed=5)
+    sim3 = random_sim3(5)
+    targets = sim3.transform_points(rec.camera_centers())
+
+    result, residuals = align_camera_centers(rec, targets)
+    assert_sim3_close(result, sim3, atol=1e-8)
+    assert residuals.shape == (30,)
+    np.testing.assert_allclose(residuals, 0.0, atol=1e-8)
+
+    # a subset of the images, in the given order
+    image_ids = rec.image_ids[[ 7, 2, 19, 11 ]]
+    result, residuals = align_camera_centers(rec, targets[[ 7, 2, 19, 11 ]], image_ids)
+    assert_sim3_close(result, sim3, atol=1e-8)
+    assert residuals.shape == (4,)
+
+    # without scale, only the rigid part of the transform is recovered
+    rigid = Sim3(1.0, sim3.rotation, sim3.translation)
+    result, residuals = align_camera_centers(rec, rigid.transform_points(rec.camera_centers()),
+                                             estimate_scale=False)
+    assert_sim3_close(result, rigid, atol=1e-8)
+
+    # residuals of outliers
+    targets[4] += (1.0, 0.0, 0.0)
+    _, residuals = align_camera_centers(rec, targets)
+    assert np.argmax(residuals) == 4
+
+
+@pytest.mark.parametrize("chunk_size", [ 1 << 20, 7 ])
+def test_transform_reconstruction(monkeypatch, chunk_size):
+    monkeypatch.setattr(alignment, "POINT_CHUNK_SIZE", chunk_size)
+    rec = synthetic_reconstruction(20, 20, seed=6)
+    original = synthetic_reconstruction(20, 20, seed=6)
+    rec.points3D.xyz.flags.writeable = False
+    sim3 = random_sim3(6)
+
+    transform_reconstruction(rec, sim3)
+    np.testing.assert_allclose(rec.camera_centers(), sim3.transform_points(original.camera_centers()),
+                               atol=1e-9)
+    np.testing.assert_allclose(rec.points3D.xyz, sim3.transform_points(original.points3D.xyz), atol=1e-9)
+    np.testing.assert_allclose(np.linalg.norm(rec.qvecs, axis=1), 1.0)
+
+    # points in camera coordinates are scaled, so their projections don't change
+    for row in range(rec.num_images):
+        local = original.points3D.xyz @ original.rotmats()[row].T + original.tvecs[row]
+        transformed = rec.points3D.xyz @ rec.rotmats()[row].T + rec.tvecs[row]
+        np.testing.assert_allclose(transformed, sim3.scale * local, atol=1e-8)
+
+    # transforming back restores the reconstruction
+    transform_reconstruction(rec, sim3.inverse())
+    np.testing.assert_allclose(rec.camera_centers(), original.camera_centers(), atol=1e-9)
+    np.testing.assert_allclose(rec.points3D.xyz, original.points3D.xyz, atol=1e-9)
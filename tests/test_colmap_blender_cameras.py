@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from ff_tools.colmap.utils import blender_camera_intrinsics, blender_camera_settings
+
+
+@pytest.mark.parametrize("width, height", [(1920, 1080), (1080, 1920), (1000, 1000)])
+def test_auto_fit_uses_sensor_width_on_larger_side(width, height):
+    fx, fy, cx, cy = blender_camera_intrinsics(50.0, 36.0, 24.0, "AUTO", 0.1, -0.05, width, height)
+    max_size = max(width, height)
+    assert fx == pytest.approx(50.0 / 36.0 * max_size)
+    assert fy == pytest.approx(fx)
+    assert cx == pytest.approx(width / 2 - 0.1 * max_size)
+    assert cy == pytest.approx(height / 2 - 0.05 * max_size)
+
+
+@pytest.mark.parametrize("width, height", [(1920, 1080), (1080, 1920)])
+def test_explicit_fit_uses_fit_dimension(width, height):
+    fx, _, cx, cy = blender_camera_intrinsics(50.0, 36.0, 24.0, "HORIZONTAL", 0.1, 0.2, width, height)
+    assert fx == pytest.approx(50.0 / 36.0 * width)
+    assert cx == pytest.approx(width / 2 - 0.1 * width)
+    assert cy == pytest.approx(height / 2 + 0.2 * width)
+
+    fx, _, cx, cy = blender_camera_intrinsics(50.0, 36.0, 24.0, "VERTICAL", 0.1, 0.2, width, height)
+    assert fx == pytest.approx(50.0 / 24.0 * height)
+    assert cx == pytest.approx(width / 2 - 0.1 * height)
+    assert cy == pytest.approx(height / 2 + 0.2 * height)
+
+
+@pytest.mark.parametrize("width, height", [(1920, 1080), (1080, 1920), (640, 640)])
+def test_import_export_round_trip(width, height):
+    # settings as created by import_colmap_cameras, intrinsics as computed by export_colmap_dataset
+    rng = np.random.default_rng(0)
+    num_cameras = 5
+    focal_lengths = rng.uniform(500, 3000, num_cameras)
+    cx = width / 2 + rng.uniform(-50, 50, num_cameras)
+    cy = height / 2 + rng.uniform(-50, 50, num_cameras)
+    widths = np.full(num_cameras, width)
+    heights = np.full(num_cameras, height)
+
+    horizontal, lenses, shifts_x, shifts_y = blender_camera_settings(
+        focal_lengths, focal_lengths, cx, cy, widths, heights, 36.0)
+    sensor_fit = np.where(horizontal, "HORIZONTAL", "VERTICAL")
+    params = blender_camera_intrinsics(lenses, 36.0, 36.0, sensor_fit, shifts_x, shifts_y, widths, heights)
+    np.testing.assert_allclose(np.stack(params, axis=1), np.stack([focal_lengths, focal_lengths, cx, cy], axis=1))
+
+    # AUTO fit gives the same result for a sensor fit to the larger side
+    params = blender_camera_intrinsics(lenses, 36.0, 24.0, "AUTO", shifts_x, shifts_y, widths, heights)
+    np.testing.assert_allclose(np.stack(params, axis=1), np.stack([focal_lengths, focal_lengths, cx, cy], axis=1))
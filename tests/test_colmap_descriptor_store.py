@@ -0,0 +1,138 @@
+import numpy as np
+import pytest
+
+from ff_tools.colmap.database import COLMAPDatabase
+from ff_tools.colmap.descriptor_store import (
+    REFERENCE_STRUCT,
+    STORE_MAGIC,
+    DescriptorStore,
+    descriptor_reference,
+    parse_descriptor_reference,
+)
+
+
+def random_descriptors(rng, num_rows, num_cols=128):
+    return rng.integers(0, 256, (num_rows, num_cols), dtype=np.uint8)
+
+
+@pytest.fixture
+def database(tmp_path):
+    db = COLMAPDatabase.connect(str(tmp_path / "database.db"))
+    db.create_tables()
+    camera_id = db.add_camera(0, 640, 480, np.array([500.0, 320.0, 240.0]))
+    for image_id in range(1, 7):
+        db.add_image(f"image{image_id}.jpg", camera_id, image_id=image_id)
+    db.commit()
+    yield db
+    db.disable_descriptor_store()
+    db.close()
+
+
+def test_store_append_and_read(tmp_path):
+    rng = np.random.default_rng(0)
+    store = DescriptorStore(tmp_path / "store")
+    assert store.size == len(STORE_MAGIC)
+
+    arrays = [ random_descriptors(rng, num_rows) for num_rows in (10, 0, 3, 200) ]
+    offsets = [ store.append(descriptors) for descriptors in arrays ]
+    assert offsets[0] == len(STORE_MAGIC)
+    for descriptors, offset in zip(arrays, offsets):
+        result = store.read(offset, *descriptors.shape)
+        np.testing.assert_array_equal(result, descriptors)
+        assert not result.flags.writeable
+
+    # the map is extended when the file grows
+    last = random_descriptors(rng, 5)
+    offset = store.append(last)
+    np.testing.assert_array_equal(store.read(offset, 5, 128), last)
+    with pytest.raises(ValueError):
+        store.read(offset, 6, 128)
+    store.close()
+
+    store = DescriptorStore(tmp_path / "store")
+    np.testing.assert_array_equal(store.read(offsets[3], 200, 128), arrays[3])
+    assert store.array()[offset:].tobytes() == last.tobytes()
+    store.close()
+
+    (tmp_path / "other").write_bytes(b"not a store")
+    with pytest.raises(ValueError):
+        DescriptorStore(tmp_path / "other")
+
+
+def test_parse_descriptor_reference():
+    reference = descriptor_reference(12345)
+    assert parse_descriptor_reference(reference, 100, 128) == 12345
+    assert parse_descriptor_reference(np.zeros(REFERENCE_STRUCT.size, np.uint8).tobytes(), 1, 128) is None
+    assert parse_descriptor_reference(np.zeros((2, 128), np.uint8).tobytes(), 2, 128) is None
+    assert parse_descriptor_reference(None, 0, 0) is None
+    # descriptors of the same size as a reference are never references
+    assert parse_descriptor_reference(reference, 1, REFERENCE_STRUCT.size) is None
+
+
+def test_database_with_descriptor_store(database, tmp_path):
+    rng = np.random.default_rng(1)
+    descriptors = { image_id: random_descriptors(rng, 10 * image_id) for image_id in range(1, 7) }
+    descriptors[5] = random_descriptors(rng, 1, REFERENCE_STRUCT.size)
+    database.add_descriptors(1, descriptors[1])
+
+    store = database.enable_descriptor_store()
+    assert store.path == tmp_path / "database.db.descriptors"
+    database.add_descriptors(2, descriptors[2])
+    database.add_descriptors_batch((image_id, descriptors[image_id]) for image_id in (3, 4, 5, 6))
+    database.commit()
+
+    for image_id, expected in descriptors.items():
+        np.testing.assert_array_equal(database.get_descriptors(image_id), expected)
+
+    image_ids, offsets, rows, cols = database.get_descriptor_offsets()
+    np.testing.assert_array_equal(image_ids, [ 2, 3, 4, 6 ])
+    for image_id, offset, num_rows, num_cols in zip(image_ids, offsets, rows, cols):
+        assert store.array()[offset:offset + num_rows * num_cols].tobytes() == descriptors[image_id].tobytes()
+
+    # the stored descriptors can't be read without the store
+    database.disable_descriptor_store()
+    np.testing.assert_array_equal(database.get_descriptors(1), descriptors[1])
+    with pytest.raises(RuntimeError):
+        database.get_descriptors(2)
+
+    database.enable_descriptor_store()
+    database.move_descriptors_to_store()
+    image_ids, _, _, _ = database.get_descriptor_offsets()
+    np.testing.assert_array_equal(image_ids, [ 1, 2, 3, 4, 6 ])
+    np.testing.assert_array_equal(database.get_descriptors(1), descriptors[1])
+
+
+def test_export_standard_database(database, tmp_path):
+    rng = np.random.default_rng(2)
+    descriptors = { image_id: random_descriptors(rng, 7 * image_id) for image_id in range(1, 7) }
+    database.add_descriptors(1, descriptors[1])
+    database.enable_descriptor_store()
+    database.add_descriptors_batch((image_id, descriptors[image_id]) for image_id in range(2, 7))
+    database.add_keypoints(1, rng.random((7, 2), dtype=np.float32))
+
+    # pending rows are committed before the export
+    output_path = tmp_path / "standard.db"
+    database.export_standard_database(str(output_path))
+    assert not database.in_transaction
+
+    output = COLMAPDatabase.connect(str(output_path))
+    try:
+        assert output.descriptor_store is None
+        for image_id, rows, cols, data in output.execute("SELECT image_id, rows, cols, data FROM descriptors"):
+            assert (rows, cols) == descriptors[image_id].shape
+            assert len(data) == rows * cols
+            np.testing.assert_array_equal(output.get_descriptors(image_id), descriptors[image_id])
+        image_ids, _, _, _ = output.get_descriptor_offsets()
+        assert len(image_ids) == 0
+        np.testing.assert_array_equal(output.get_keypoints(1), database.get_keypoints(1))
+        assert output.execute("SELECT count(*) FROM images").fetchone()[0] == 6
+    finally:
+        output.close()
+
+    # the source database still references the store
+    image_ids, _, _, _ = database.get_descriptor_offsets()
+    np.testing.assert_array_equal(image_ids, [ 2, 3, 4, 5, 6 ])
+
+    database.disable_descriptor_store()
+    with pytest.raises(RuntimeError):
+        database.export_standard_database(str(tmp_path / "failed.db"))
@@ -0,0 +1,70 @@
+import struct
+
+import numpy as np
+import pytest
+
+from ff_tools.colmap.image_index import ImagesBinaryIndex
+from ff_tools.colmap.utils import POINT2D_DTYPE, read_images_binary
+
+from test_colmap_model_io import create_reconstruction
+
+
+@pytest.fixture
+def images_path(tmp_path):
+    create_reconstruction(6, None).write(tmp_path, ext=".bin")
+    return tmp_path / "images.bin"
+
+
+def assert_index_matches(index, images_path):
+    images = read_images_binary(images_path)
+    assert len(index) == len(images)
+    for image_id, image in images.items():
+        assert index.row(image.name) == index.row(image_id)
+        indexed = index.get_image(image_id)
+        assert indexed.name == image.name
+        np.testing.assert_allclose(indexed.qvec, image.qvec)
+        np.testing.assert_array_equal(indexed.point3D_ids, image.point3D_ids)
+
+
+def test_index_is_saved_and_reused(images_path):
+    index = ImagesBinaryIndex(images_path)
+    assert index.index_path.exists()
+    assert index._load()
+    assert_index_matches(ImagesBinaryIndex(images_path), images_path)
+
+
+@pytest.mark.parametrize("corrupt", [
+    lambda data: b"not an index",
+    lambda data: data[:len(data) // 2],
+    lambda data: b"",
+], ids=["garbage", "truncated", "empty"])
+def test_corrupt_index_is_rebuilt(images_path, corrupt):
+    index_path = ImagesBinaryIndex(images_path).index_path
+    index_path.write_bytes(corrupt(index_path.read_bytes()))
+
+    assert_index_matches(ImagesBinaryIndex(images_path), images_path)
+    assert ImagesBinaryIndex(images_path)._load()
+
+
+def test_truncated_images_binary_is_rejected(images_path):
+    images_path.write_bytes(images_path.read_bytes()[:-1])
+    with pytest.raises((ValueError, struct.error)):
+        ImagesBinaryIndex(images_path, rebuild=True)
+
+
+def test_get_image_rejects_records_past_the_end(tmp_path):
+    reconstruction = create_reconstruction(5, 0)
+    reconstruction.point2D_offsets[-1] += 2
+    reconstruction.xys = np.concatenate([reconstruction.xys, np.zeros((2, 2))])
+    reconstruction.point3D_ids = np.concatenate([reconstruction.point3D_ids, [-1, -1]])
+    reconstruction.write(tmp_path, ext=".bin")
+
+    images_path = tmp_path / "images.bin"
+    index = ImagesBinaryIndex(images_path)
+    last_id = int(reconstruction.image_ids[-1])
+    assert len(index.get_image(last_id).point3D_ids) > 0
+
+    # the sidecar is only revalidated on construction
+    images_path.write_bytes(images_path.read_bytes()[:-POINT2D_DTYPE.itemsize])
+    with pytest.raises(ValueError):
+        index.get_image(last_id)
@@ -0,0 +1,109 @@
+import multiprocessing as mp
+import threading
+
+import numpy as np
+import pytest
+
+from ff_tools.colmap.database import COLMAPDatabase
+from ff_tools.colmap.ingest import FeatureWriter
+
+
+def create_database(path, num_images=4):
+    db = COLMAPDatabase.connect(path)
+    db.create_tables()
+    camera_id = db.add_camera(0, 640, 480, np.array([500.0, 320.0, 240.0]))
+    for i in range(num_images):
+        db.add_image(f"{i}.jpg", camera_id, image_id=i + 1)
+    db.commit()
+    db.close()
+
+
+def close_writer(writer, timeout=30.0):
+    """closes the writer, fails instead of hanging if it doesn't stop.
+    Returns the exception raised by close, if any."""
+    result = {}
+
+    def close():
+        try:
+            writer.close()
+        except Exception as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=close, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        writer._process.kill()
+        pytest.fail("feature writer did not stop")
+    return result.get("error")
+
+
+@pytest.fixture
+def database_path(tmp_path):
+    path = tmp_path / "database.db"
+    create_database(path)
+    return path
+
+
+def test_writer_writes_items(database_path):
+    keypoints = np.random.default_rng(0).random((100, 2)).astype(np.float32)
+    with FeatureWriter(database_path, shm_threshold=256) as writer:
+        client = writer.client()
+        for image_id in range(1, 5):
+            client.add_keypoints(image_id, keypoints)
+        client.add_matches(1, 2, np.array([[0, 1], [2, 3]]))
+
+    assert writer.stats["keypoints"] == 4
+    assert writer.stats["matches"] == 1
+    db = COLMAPDatabase.connect(database_path)
+    np.testing.assert_array_equal(db.get_keypoints(3), keypoints)
+    db.close()
+
+
+@pytest.mark.parametrize("shm_threshold", [1 << 16, 0])
+def test_writer_error_in_last_batch(database_path, shm_threshold):
+    # duplicate image ids violate the primary key when the batch is written at close
+    keypoints = np.zeros((10, 2), dtype=np.float32)
+    writer = FeatureWriter(database_path, shm_threshold=shm_threshold, context=mp.get_context("spawn"))
+    writer.start()
+    client = writer.client()
+    client.add_keypoints(1, keypoints)
+    client.add_keypoints(1, keypoints)
+
+    error = close_writer(writer)
+    assert isinstance(error, RuntimeError) and "IntegrityError" in str(error)
+    assert not writer._process.is_alive()
+
+
+def test_writer_error_drains_queue(database_path):
+    keypoints = np.zeros((10, 2), dtype=np.float32)
+    writer = FeatureWriter(database_path, batch_size=2, max_queue_size=2, shm_threshold=0)
+    writer.start()
+    client = writer.client()
+    client.add_keypoints(1, keypoints)
+    client.add_keypoints(1, keypoints)
+    # the writer failed on the first batch, further items must not block
+    for _ in range(10):
+        client.add_keypoints(2, keypoints)
+
+    assert isinstance(close_writer(writer), RuntimeError)
+    assert not writer._process.is_alive()
+
+
+def test_close_without_start(database_path):
+    writer = FeatureWriter(database_path)
+    error = close_writer(writer)
+    assert isinstance(error, RuntimeError) and "not started" in str(error)
+
+
+@pytest.mark.parametrize("max_queue_size", [64, 1])
+def test_close_after_writer_was_killed(database_path, max_queue_size):
+    writer = FeatureWriter(database_path, max_queue_size=max_queue_size, flush_interval=60.0)
+    writer.start()
+    writer._process.kill()
+    writer._process.join()
+    # fills the queue, so that the stop request can't be sent
+    writer.client().add_keypoints(1, np.zeros((10, 2), dtype=np.float32))
+
+    error = close_writer(writer)
+    assert isinstance(error, RuntimeError) and "exit code" in str(error)
@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+from ff_tools.colmap.database import (
+    COLMAPDatabase,
+    image_ids_to_pair_id,
+    image_ids_to_pair_ids,
+    pair_id_to_image_ids,
+    pair_ids_to_image_ids,
+)
+from ff_tools.colmap.match_graph import MatchGraph
+
+
+PAIRS = [ (1, 2, 50), (2, 3, 10), (1, 3, 30), (4, 5, 5), (7, 1, 2) ]
+
+
+@pytest.fixture
+def database(tmp_path):
+    db = COLMAPDatabase.connect(tmp_path / "database.db")
+    db.create_tables()
+    db.add_two_view_geometries_batch(
+        (image_id1, image_id2, np.zeros((num_matches, 2), dtype=np.uint32))
+        for image_id1, image_id2, num_matches in PAIRS)
+    yield db
+    db.close()
+
+
+def test_pair_ids_match_scalar_version():
+    rng = np.random.default_rng(0)
+    image_ids1 = rng.integers(1, 10000, size=100)
+    image_ids2 = rng.integers(1, 10000, size=100)
+
+    pair_ids = image_ids_to_pair_ids(image_ids1, image_ids2)
+    expected = [image_ids_to_pair_id(a, b) for a, b in zip(image_ids1.tolist(), image_ids2.tolist())]
+    np.testing.assert_array_equal(pair_ids, expected)
+    assert np.all(image_ids_to_pair_ids(image_ids2, image_ids1) == pair_ids)
+
+    first, second = pair_ids_to_image_ids(pair_ids)
+    np.testing.assert_array_equal(first, np.minimum(image_ids1, image_ids2))
+    np.testing.assert_array_equal(second, np.maximum(image_ids1, image_ids2))
+    assert pair_id_to_image_ids(int(pair_ids[0])) == (first[0], second[0])
+
+
+def test_graph_from_database(database):
+    graph = MatchGraph.from_database(database)
+    assert graph.num_images == 6
+    assert graph.num_pairs == len(PAIRS)
+    np.testing.assert_array_equal(graph.image_ids, [1, 2, 3, 4, 5, 7])
+
+    for image_id1, image_id2, num_matches in PAIRS:
+        assert graph.num_matches(image_id1, image_id2) == num_matches
+        assert graph.num_matches(image_id2, image_id1) == num_matches
+    assert graph.num_matches(1, 4) == 0
+    assert graph.num_matches(1, 99) == 0
+
+    image_ids1, image_ids2, weights = graph.pairs()
+    assert sorted(zip(image_ids1.tolist(), image_ids2.tolist(), weights.tolist())) == \
+        sorted((min(a, b), max(a, b), n) for a, b, n in PAIRS)
+
+    graph = MatchGraph.from_database(database, min_num_matches=10)
+    assert graph.num_pairs == 3
+
+
+def test_neighbors_and_top_k(database):
+    graph = MatchGraph.from_database(database)
+    neighbor_ids, weights = graph.neighbors(1)
+    assert dict(zip(neighbor_ids.tolist(), weights.tolist())) == { 2: 50, 3: 30, 7: 2 }
+    assert len(graph.neighbors(99)[0]) == 0
+
+    neighbor_ids, weights = graph.top_k(1, 2)
+    np.testing.assert_array_equal(neighbor_ids, [2, 3])
+    np.testing.assert_array_equal(weights, [50, 30])
+
+    partner_ids, partner_weights = graph.top_k_all(2)
+    np.testing.assert_array_equal(partner_ids[graph.rows(1)], [2, 3])
+    np.testing.assert_array_equal(partner_ids[graph.rows(7)], [1, -1])
+    np.testing.assert_array_equal(partner_weights[graph.rows(7)], [2, 0])
+
+
+def test_components(database):
+    graph = MatchGraph.from_database(database)
+    components = graph.components()
+    assert [sorted(component.tolist()) for component in components] == [[1, 2, 3, 7], [4, 5]]
+
+    components = graph.components(min_num_matches=10)
+    assert [sorted(component.tolist()) for component in components] == [[1, 2, 3], [4], [5], [7]]
+
+
+def test_empty_graph(tmp_path):
+    db = COLMAPDatabase.connect(tmp_path / "database.db")
+    db.create_tables()
+    graph = MatchGraph.from_database(db)
+    db.close()
+
+    assert graph.num_images == 0 and graph.num_pairs == 0
+    assert len(graph.components()) == 0
+    np.testing.assert_array_equal(graph.rows([1, 2]), [-1, -1])
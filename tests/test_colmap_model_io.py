@@ -0,0 +1,235 @@
+import struct
+
+import numpy as np
+import pytest
+
+from ff_tools.colmap.reconstruction import Reconstruction
+from ff_tools.colmap.utils import (
+    Points3D,
+    read_cameras_binary,
+    read_cameras_text,
+    read_cameras_text_chunked,
+    read_images_binary,
+    read_images_binary_mmap,
+    read_images_text,
+    read_images_text_chunked,
+    read_points3D_binary,
+    read_points3D_text,
+)
+
+
+def create_points3D(num_points, num_images, seed=0):
+    rng = np.random.default_rng(seed)
+    track_lengths = rng.integers(0, 5, size=num_points)
+    track_offsets = np.zeros(num_points + 1, dtype=np.int64)
+    np.cumsum(track_lengths, out=track_offsets[1:])
+    num_tracks = int(track_offsets[-1])
+    return Points3D(
+        ids=np.arange(1, num_points + 1, dtype=np.int64) * 3,
+        xyz=rng.normal(size=(num_points, 3)),
+        rgb=rng.integers(0, 256, size=(num_points, 3)).astype(np.uint8),
+        error=rng.random(num_points),
+        track_offsets=track_offsets,
+        track_image_ids=rng.integers(1, num_images + 1, size=num_tracks).astype(np.uint32),
+        track_point2D_idxs=rng.integers(0, 100, size=num_tracks).astype(np.uint32),
+    )
+
+
+def create_reconstruction(num_images, num_points, seed=0):
+    rng = np.random.default_rng(seed)
+    camera_ids = [1, 2]
+    num_points2D = rng.integers(0, 6, size=num_images)
+    point2D_offsets = np.zeros(num_images + 1, dtype=np.int64)
+    np.cumsum(num_points2D, out=point2D_offsets[1:])
+    num_total = int(point2D_offsets[-1])
+    qvecs = rng.normal(size=(num_images, 4))
+    qvecs /= np.linalg.norm(qvecs, axis=1, keepdims=True)
+    point3D_ids = rng.integers(0, 50, size=num_total)
+    point3D_ids[::3] = -1
+
+    return Reconstruction(
+        camera_ids=camera_ids,
+        camera_model_ids=[1, 2],
+        camera_widths=[640, 1920],
+        camera_heights=[480, 1080],
+        camera_params=[np.array([500.0, 510.0, 320.0, 240.0]), np.array([1200.0, 960.0, 540.0, 0.01])],
+        image_ids=np.arange(num_images) * 2 + 1,
+        qvecs=qvecs,
+        tvecs=rng.normal(size=(num_images, 3)),
+        image_camera_ids=rng.choice(camera_ids, size=num_images),
+        names=[f"images/view_{i:03d}.jpg" for i in range(num_images)],
+        point2D_offsets=point2D_offsets,
+        xys=rng.random((num_total, 2)) * 100,
+        point3D_ids=point3D_ids,
+        points3D=create_points3D(num_points, num_images, seed) if num_points is not None else None,
+    )
+
+
+def assert_points3D_equal(actual, expected):
+    np.testing.assert_array_equal(actual.ids, expected.ids)
+    np.testing.assert_allclose(actual.xyz, expected.xyz)
+    np.testing.assert_array_equal(actual.rgb, expected.rgb)
+    np.testing.assert_allclose(actual.error, expected.error)
+    np.testing.assert_array_equal(actual.track_offsets, expected.track_offsets)
+    np.testing.assert_array_equal(actual.track_image_ids, expected.track_image_ids)
+    np.testing.assert_array_equal(actual.track_point2D_idxs, expected.track_point2D_idxs)
+
+
+def assert_reconstructions_equal(actual, expected):
+    np.testing.assert_array_equal(actual.camera_ids, expected.camera_ids)
+    np.testing.assert_array_equal(actual.camera_model_ids, expected.camera_model_ids)
+    np.testing.assert_array_equal(actual.camera_widths, expected.camera_widths)
+    np.testing.assert_array_equal(actual.camera_heights, expected.camera_heights)
+    for camera_id in expected.camera_ids.tolist():
+        np.testing.assert_allclose(actual.cameras[camera_id].params, expected.cameras[camera_id].params)
+
+    np.testing.assert_array_equal(actual.image_ids, expected.image_ids)
+    np.testing.assert_allclose(actual.qvecs, expected.qvecs)
+    np.testing.assert_allclose(actual.tvecs, expected.tvecs)
+    np.testing.assert_array_equal(actual.image_camera_ids, expected.image_camera_ids)
+    assert actual.names == expected.names
+    np.testing.assert_array_equal(actual.point2D_offsets, expected.point2D_offsets)
+    np.testing.assert_allclose(actual.xys, expected.xys)
+    np.testing.assert_array_equal(actual.point3D_ids, expected.point3D_ids)
+
+    if expected.points3D is None:
+        assert actual.points3D is None
+    else:
+        assert_points3D_equal(actual.points3D, expected.points3D)
+
+
+@pytest.mark.parametrize("ext", [".bin", ".txt"])
+@pytest.mark.parametrize("num_images, num_points", [(12, 40), (3, 0), (0, 0), (5, None)])
+def test_reconstruction_round_trip(tmp_path, ext, num_images, num_points):
+    expected = create_reconstruction(num_images, num_points)
+    expected.write(tmp_path, ext=ext)
+
+    assert (tmp_path / f"cameras{ext}").exists()
+    assert (tmp_path / f"images{ext}").exists()
+    assert (tmp_path / f"points3D{ext}").exists() == (num_points is not None)
+
+    assert_reconstructions_equal(Reconstruction.read(tmp_path), expected)
+    assert_reconstructions_equal(Reconstruction.read(tmp_path, ext=ext), expected)
+
+
+@pytest.mark.parametrize("num_images", [7, 0])
+def test_image_readers_agree(tmp_path, num_images):
+    reconstruction = create_reconstruction(num_images, 0)
+    reconstruction.write(tmp_path / "bin", ext=".bin")
+    reconstruction.write(tmp_path / "txt", ext=".txt")
+
+    expected = read_images_binary(tmp_path / "bin" / "images.bin")
+    _, images = reconstruction.to_dicts()
+    assert list(expected) == list(images)
+
+    text_path = tmp_path / "txt" / "images.txt"
+    readers = [
+        read_images_binary_mmap(tmp_path / "bin" / "images.bin"),
+        read_images_text(text_path),
+        read_images_text_chunked(text_path),
+        read_images_text_chunked(text_path, block_size=64),
+        read_images_text_chunked(text_path, block_size=256, max_workers=2),
+    ]
+    for images in readers:
+        assert list(images) == list(expected)
+        for image_id, image in expected.items():
+            assert images[image_id].name == image.name
+            assert images[image_id].camera_id == image.camera_id
+            np.testing.assert_array_equal(images[image_id].qvec, image.qvec)
+            np.testing.assert_array_equal(images[image_id].tvec, image.tvec)
+            np.testing.assert_array_equal(np.reshape(images[image_id].xys, (-1, 2)), image.xys)
+            np.testing.assert_array_equal(images[image_id].point3D_ids, image.point3D_ids)
+
+
+def test_camera_readers_agree(tmp_path):
+    reconstruction = create_reconstruction(3, 0)
+    reconstruction.write(tmp_path / "bin", ext=".bin")
+    reconstruction.write(tmp_path / "txt", ext=".txt")
+
+    expected = read_cameras_binary(tmp_path / "bin" / "cameras.bin")
+    for cameras in (read_cameras_text(tmp_path / "txt" / "cameras.txt"),
+                    read_cameras_text_chunked(tmp_path / "txt" / "cameras.txt")):
+        assert list(cameras) == list(expected)
+        for camera_id, camera in expected.items():
+            assert cameras[camera_id].model == camera.model
+            assert cameras[camera_id].width == camera.width
+            assert cameras[camera_id].height == camera.height
+            np.testing.assert_array_equal(cameras[camera_id].params, camera.params)
+
+
+def test_images_text_chunked_without_trailing_points_line(tmp_path):
+    reconstruction = create_reconstruction(4, None)
+    reconstruction.write(tmp_path, ext=".txt")
+    path = tmp_path / "images.txt"
+    text = path.read_text()
+    # drop the POINTS2D line of the last image including its line break
+    path.write_text(text[:text.rstrip("\n").rfind("\n")])
+
+    expected = read_images_text(path)
+    images = read_images_text_chunked(path, block_size=64)
+    assert len(images) == 4
+    assert list(images) == list(expected)
+    last = images[list(images)[-1]]
+    assert len(last.point3D_ids) == 0
+    np.testing.assert_array_equal(last.qvec, expected[last.id].qvec)
+
+
+def test_images_text_chunked_rejects_malformed_points(tmp_path):
+    reconstruction = create_reconstruction(4, None)
+    reconstruction.write(tmp_path, ext=".txt")
+    path = tmp_path / "images.txt"
+    lines = path.read_text().split("\n")
+    lines[5] += " 1.5"
+    path.write_text("\n".join(lines))
+
+    with pytest.raises(ValueError):
+        read_images_text_chunked(path)
+
+
+@pytest.mark.parametrize("num_points", [1000, 1, 0])
+def test_points3D_readers_agree(tmp_path, num_points):
+    reconstruction = create_reconstruction(4, num_points)
+    reconstruction.write(tmp_path / "bin", ext=".bin")
+    reconstruction.write(tmp_path / "txt", ext=".txt")
+
+    assert_points3D_equal(read_points3D_binary(tmp_path / "bin" / "points3D.bin"), reconstruction.points3D)
+    assert_points3D_equal(read_points3D_text(tmp_path / "txt" / "points3D.txt"), reconstruction.points3D)
+
+
+@pytest.mark.parametrize("ext", ["", "bin", ".json"])
+def test_write_rejects_unknown_format(tmp_path, ext):
+    with pytest.raises(ValueError):
+        create_reconstruction(2, 2).write(tmp_path, ext=ext)
+    assert not any(tmp_path.iterdir())
+
+
+@pytest.mark.parametrize("num_bytes", [1, 24, 200])
+def test_truncated_images_binary(tmp_path, num_bytes):
+    reconstruction = create_reconstruction(5, None)
+    reconstruction.point2D_offsets[-1] += 10
+    reconstruction.xys = np.concatenate([reconstruction.xys, np.zeros((10, 2))])
+    reconstruction.point3D_ids = np.concatenate([reconstruction.point3D_ids, np.full(10, -1)])
+    reconstruction.write(tmp_path, ext=".bin")
+
+    path = tmp_path / "images.bin"
+    path.write_bytes(path.read_bytes()[:-num_bytes])
+    with pytest.raises((ValueError, struct.error)):
+        read_images_binary_mmap(path)
+
+
+@pytest.mark.parametrize("num_bytes", [1, 8, 60])
+def test_truncated_points3D_binary(tmp_path, num_bytes):
+    reconstruction = create_reconstruction(4, 50)
+    reconstruction.write(tmp_path, ext=".bin")
+
+    path = tmp_path / "points3D.bin"
+    path.write_bytes(path.read_bytes()[:-num_bytes])
+    with pytest.raises((ValueError, struct.error)):
+        read_points3D_binary(path)
+
+
+@pytest.mark.parametrize("ext", ["bin", ".TXT", ".json"])
+def test_read_rejects_unknown_format(tmp_path, ext):
+    create_reconstruction(2, 2).write(tmp_path, ext=".bin")
+    with pytest.raises(ValueError):
+        Reconstruction.read(tmp_path, ext=ext)
@@ -0,0 +1,137 @@
+import numpy as np
+import pytest
+
+from ff_tools.colmap.database import COLMAPDatabase
+from ff_tools.colmap.pair_generation import (
+    PositionGrid,
+    generate_pairs,
+    generate_pairs_from_database,
+    read_pose_priors,
+    write_match_list,
+)
+
+
+def random_positions(distribution, num=300, seed=0):
+    rng = np.random.default_rng(seed)
+    if distribution == "uniform":
+        return rng.random((num, 3)) * 10.0
+    if distribution == "planar":
+        return np.column_stack([ rng.random((num, 2)) * 10.0, np.zeros(num) ])
+    if distribution == "line":
+        return np.column_stack([ rng.random(num) * 100.0, np.zeros(num), np.full(num, 2.0) ])
+    # dense clusters far apart, so that the searched blocks have to grow
+    centers = rng.random((5, 3)) * 1000.0
+    return np.repeat(centers, num // 5, axis=0) + rng.normal(0, 0.1, (num // 5 * 5, 3))
+
+
+def distance_matrix(positions):
+    return np.linalg.norm(positions[:, None] - positions[None], axis=2)
+
+
+def brute_force_neighbors(positions, k):
+    distances = distance_matrix(positions)
+    np.fill_diagonal(distances, np.inf)
+    neighbors = np.argsort(distances, axis=1, kind="stable")[:, :k]
+    return neighbors, np.take_along_axis(distances, neighbors, axis=1)
+
+
+def brute_force_radius_pairs(positions, radius):
+    rows1, rows2 = np.nonzero(np.triu(distance_matrix(positions) <= radius, k=1))
+    return set(zip(rows1.tolist(), rows2.tolist()))
+
+
+@pytest.mark.parametrize("distribution", [ "uniform", "planar", "line", "clusters" ])
+@pytest.mark.parametrize("cell_size", [ None, 0.3, 5.0 ])
+def test_nearest_neighbors_match_brute_force(distribution, cell_size):
+    positions = random_positions(distribution)
+    grid = PositionGrid(positions, cell_size)
+    neighbors, distances = grid.nearest_neighbors(12)
+    expected_neighbors, expected_distances = brute_force_neighbors(positions, 12)
+    np.testing.assert_allclose(distances, expected_distances, rtol=1e-12)
+    np.testing.assert_array_equal(neighbors, expected_neighbors)
+
+
+def test_nearest_neighbors_of_few_and_coincident_positions():
+    positions = np.array([ (0.0, 0.0, 0.0), (0.0, 0.0, 0.0), (1.0, 0.0, 0.0) ])
+    neighbors, distances = PositionGrid(positions).nearest_neighbors(5)
+    assert neighbors.shape == (3, 2)
+    np.testing.assert_array_equal(neighbors, [ [ 1, 2 ], [ 0, 2 ], [ 0, 1 ] ])
+    np.testing.assert_allclose(distances, [ [ 0, 1 ], [ 0, 1 ], [ 1, 1 ] ])
+
+    neighbors, distances = PositionGrid(positions[:1]).nearest_neighbors(5)
+    assert neighbors.shape == (1, 0)
+
+
+@pytest.mark.parametrize("distribution", [ "uniform", "planar", "line", "clusters" ])
+@pytest.mark.parametrize("radius", [ 0.05, 0.8, 3.0 ])
+def test_radius_pairs_match_brute_force(distribution, radius):
+    positions = random_positions(distribution)
+    for cell_size in (None, radius / 3, radius * 2):
+        rows1, rows2 = PositionGrid(positions, cell_size).radius_pairs(radius)
+        assert np.all(rows1 < rows2)
+        pairs = list(zip(rows1.tolist(), rows2.tolist()))
+        assert len(pairs) == len(set(pairs))
+        assert set(pairs) == brute_force_radius_pairs(positions, radius)
+
+
+def test_generate_pairs():
+    positions = random_positions("uniform", num=200)
+    rows1, rows2 = generate_pairs(positions, num_neighbors=6, radius=1.0)
+    assert np.all(rows1 < rows2)
+    pairs = list(zip(rows1.tolist(), rows2.tolist()))
+    assert len(pairs) == len(set(pairs))
+
+    neighbors, _ = brute_force_neighbors(positions, 6)
+    expected = brute_force_radius_pairs(positions, 1.0)
+    expected |= { (min(row, neighbor), max(row, neighbor))
+                  for row in range(len(positions)) for neighbor in neighbors[row].tolist() }
+    assert set(pairs) == expected
+
+    # only the radius
+    rows1, rows2 = generate_pairs(positions, num_neighbors=0, radius=1.0)
+    assert set(zip(rows1.tolist(), rows2.tolist())) == brute_force_radius_pairs(positions, 1.0)
+
+
+def test_generate_pairs_with_view_angle():
+    positions = random_positions("uniform", num=100)
+    rng = np.random.default_rng(1)
+    directions = rng.normal(size=(100, 3))
+    directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+    directions[:5] = np.nan
+
+    all_pairs = generate_pairs(positions, num_neighbors=10)
+    rows1, rows2 = generate_pairs(positions, directions, num_neighbors=10, max_view_angle=60.0)
+    pairs = set(zip(rows1.tolist(), rows2.tolist()))
+    for row1, row2 in zip(*all_pairs):
+        angle = np.degrees(np.arccos(np.clip(directions[row1] @ directions[row2], -1, 1)))
+        assert ((row1, row2) in pairs) == (row1 < 5 or angle <= 60.0)
+
+
+def test_generate_pairs_from_database(tmp_path):
+    db = COLMAPDatabase.connect(tmp_path / "database.db")
+    db.create_tables()
+    camera_id = db.add_camera(1, 640, 480, np.array([500.0, 320.0, 240.0]))
+    # cameras on a line, looking along +z or -z, one without position prior
+    positions = [ (0, 0, 0), (1, 0, 0), (2, 0, 0), (3, 0, 0), (4, 0, 0) ]
+    qvecs = [ (1, 0, 0, 0), (1, 0, 0, 0), (0, 1, 0, 0), (1, 0, 0, 0), (1, 0, 0, 0) ]
+    for index, (position, qvec) in enumerate(zip(positions, qvecs)):
+        prior_t = np.full(3, np.nan) if index == 3 else np.array(position, dtype=np.float64)
+        db.add_image(f"image{index}.jpg", camera_id, np.array(qvec, dtype=np.float64), prior_t)
+    db.commit()
+
+    priors = read_pose_priors(db)
+    assert priors.names == [ f"image{index}.jpg" for index in range(5) ]
+    np.testing.assert_array_equal(priors.has_position, [ True, True, True, False, True ])
+    np.testing.assert_allclose(priors.view_directions()[:3], [ (0, 0, 1), (0, 0, 1), (0, 0, -1) ])
+
+    names1, names2 = generate_pairs_from_database(db, num_neighbors=1)
+    assert sorted(zip(names1, names2)) == [
+        ("image0.jpg", "image1.jpg"), ("image1.jpg", "image2.jpg"), ("image2.jpg", "image4.jpg") ]
+
+    names1, names2 = generate_pairs_from_database(db, num_neighbors=1, max_view_angle=90.0)
+    assert sorted(zip(names1, names2)) == [ ("image0.jpg", "image1.jpg") ]
+    db.close()
+
+    path = tmp_path / "pairs.txt"
+    write_match_list(path, names1, names2)
+    assert path.read_text() == "image0.jpg image1.jpg\n"
@@ -0,0 +1,113 @@
+import numpy as np
+import pytest
+
+from ff_tools.colmap.utils import (
+    blender_matrices_world,
+    camera_centers,
+    poses_from_blender_matrices,
+    qvec2rotmat,
+    qvecs2rotmats,
+    rotmat2qvec,
+    rotmats2qvecs,
+)
+
+
+def random_qvecs(num, seed=0):
+    qvecs = np.random.default_rng(seed).normal(size=(num, 4))
+    qvecs /= np.linalg.norm(qvecs, axis=1, keepdims=True)
+    qvecs[qvecs[:, 0] < 0] *= -1
+    return qvecs
+
+
+def half_turn_qvecs(epsilon):
+    """quaternions of rotations by 180 degrees minus epsilon (radians)
+    about the coordinate axes and a diagonal axis."""
+    axes = np.array([[1, 0, 0], [0, 1, 0], [0, 0, 1], [1, 1, 1]], dtype=np.float64)
+    axes /= np.linalg.norm(axes, axis=1, keepdims=True)
+    angle = np.pi - epsilon
+    return np.column_stack([np.full(len(axes), np.cos(angle / 2)), axes * np.sin(angle / 2)])
+
+
+def assert_same_rotation(qvecs1, qvecs2, atol=1e-9):
+    # q and -q are the same rotation
+    dots = np.abs(np.einsum("ij,ij->i", qvecs1, qvecs2))
+    np.testing.assert_allclose(dots, 1.0, atol=atol)
+
+
+def test_qvecs2rotmats_matches_scalar_version():
+    qvecs = random_qvecs(50)
+    R = qvecs2rotmats(qvecs)
+    for qvec, rotmat in zip(qvecs, R):
+        np.testing.assert_allclose(rotmat, qvec2rotmat(qvec), atol=1e-12)
+    np.testing.assert_allclose(R @ R.transpose(0, 2, 1), np.broadcast_to(np.eye(3), R.shape), atol=1e-12)
+    np.testing.assert_allclose(np.linalg.det(R), 1.0)
+
+
+def test_rotmats2qvecs_round_trip():
+    qvecs = random_qvecs(1000)
+    result = rotmats2qvecs(qvecs2rotmats(qvecs))
+    assert np.all(result[:, 0] >= 0)
+    np.testing.assert_allclose(result, qvecs, atol=1e-12)
+    assert rotmats2qvecs(np.empty((0, 3, 3))).shape == (0, 4)
+
+
+@pytest.mark.parametrize("epsilon", [0.0, 1e-12, 1e-7, 1e-3])
+def test_rotmats2qvecs_near_half_turn(epsilon):
+    qvecs = half_turn_qvecs(epsilon)
+    R = qvecs2rotmats(qvecs)
+    result = rotmats2qvecs(R)
+    assert_same_rotation(result, qvecs)
+    np.testing.assert_allclose(qvecs2rotmats(result), R, atol=1e-12)
+    assert np.all(result[:, 0] >= 0)
+
+
+def test_rotmats2qvecs_matches_eigenvalue_method():
+    qvecs = np.concatenate([random_qvecs(20), half_turn_qvecs(1e-6)])
+    R = qvecs2rotmats(qvecs)
+    expected = np.array([rotmat2qvec(rotmat) for rotmat in R])
+    assert_same_rotation(rotmats2qvecs(R), expected)
+
+
+def test_rotmats2qvecs_falls_back_for_invalid_matrices():
+    rng = np.random.default_rng(1)
+    R = qvecs2rotmats(random_qvecs(20, seed=1))
+    noisy = R + rng.normal(scale=1e-3, size=R.shape)
+    reflected = R * np.array([1.0, 1.0, -1.0])
+
+    for matrices in (noisy, reflected):
+        result = rotmats2qvecs(matrices)
+        expected = np.array([rotmat2qvec(rotmat) for rotmat in matrices])
+        np.testing.assert_allclose(np.linalg.norm(result, axis=1), 1.0)
+        assert_same_rotation(result, expected / np.linalg.norm(expected, axis=1, keepdims=True))
+
+    # small deviations within the tolerance use the closed form
+    result = rotmats2qvecs(R + 1e-9)
+    assert_same_rotation(result, random_qvecs(20, seed=1), atol=1e-8)
+
+
+def test_camera_centers():
+    qvecs = random_qvecs(10)
+    tvecs = np.random.default_rng(2).normal(size=(10, 3))
+    centers = camera_centers(qvecs, tvecs)
+    for qvec, tvec, center in zip(qvecs, tvecs, centers):
+        R = qvec2rotmat(qvec)
+        np.testing.assert_allclose(center, -R.T @ tvec, atol=1e-12)
+        # the center is mapped to the origin of the camera frame
+        np.testing.assert_allclose(R @ center + tvec, 0.0, atol=1e-12)
+
+
+@pytest.mark.parametrize("scale", [1.0, 0.01, 250.0])
+def test_blender_matrices_round_trip(scale):
+    qvecs = np.concatenate([random_qvecs(100), half_turn_qvecs(1e-9)])
+    tvecs = np.random.default_rng(3).normal(size=(len(qvecs), 3)) * 10
+    matrices = blender_matrices_world(qvecs, tvecs)
+
+    # Blender cameras look down -z, the camera center is the translation
+    np.testing.assert_allclose(matrices[:, :3, 3], camera_centers(qvecs, tvecs), atol=1e-12)
+    R = qvecs2rotmats(qvecs)
+    np.testing.assert_allclose(-matrices[:, :3, 2], R[:, 2, :], atol=1e-12)
+
+    matrices[:, :3, :3] *= scale
+    result_qvecs, result_tvecs = poses_from_blender_matrices(matrices)
+    assert_same_rotation(result_qvecs, qvecs)
+    np.testing.assert_allclose(result_tvecs, tvecs, atol=1e-9)
@@ -0,0 +1,222 @@
+import math
+
+import numpy as np
+import pytest
+
+from ff_tools.colmap.benchmark import synthetic_reconstruction
+from ff_tools.colmap.projection import (
+    compute_reprojection_errors,
+    distort,
+    group_error_stats,
+    project_points,
+)
+from ff_tools.colmap.reconstruction import Reconstruction
+from ff_tools.colmap.utils import (
+    CAMERA_MODEL_NAMES,
+    SINGLE_FOCAL_LENGTH_MODELS,
+    qvec2rotmat,
+)
+
+
+# parameters of all camera models, with moderate distortion
+MODEL_PARAMS = {
+    "SIMPLE_PINHOLE": [500.0, 320.0, 240.0],
+    "PINHOLE": [500.0, 510.0, 320.0, 240.0],
+    "SIMPLE_RADIAL": [500.0, 320.0, 240.0, 0.05],
+    "RADIAL": [500.0, 320.0, 240.0, 0.05, -0.01],
+    "OPENCV": [500.0, 510.0, 320.0, 240.0, 0.05, -0.01, 0.001, -0.002],
+    "OPENCV_FISHEYE": [500.0, 510.0, 320.0, 240.0, 0.05, -0.01, 0.002, -0.001],
+    "FULL_OPENCV": [500.0, 510.0, 320.0, 240.0, 0.05, -0.01, 0.001, -0.002,
+                    0.003, 0.01, -0.002, 0.001],
+    "FOV": [500.0, 510.0, 320.0, 240.0, 0.9],
+    "SIMPLE_RADIAL_FISHEYE": [500.0, 320.0, 240.0, 0.05],
+    "RADIAL_FISHEYE": [500.0, 320.0, 240.0, 0.05, -0.01],
+    "THIN_PRISM_FISHEYE": [500.0, 510.0, 320.0, 240.0, 0.05, -0.01, 0.001, -0.002,
+                           0.003, 0.001, 0.0005, -0.0005],
+}
+
+
+def extra_params(model_name):
+    num_intrinsics = 3 if model_name in SINGLE_FOCAL_LENGTH_MODELS else 4
+    return MODEL_PARAMS[model_name][num_intrinsics:]
+
+
+def reference_distort(model_name, params, u, v):
+    """Distortion of a single normalized coordinate, written out as in
+    src/base/camera_models.h, with the fisheye angle for fisheye models."""
+    r2 = u * u + v * v
+    if model_name in ("SIMPLE_PINHOLE", "PINHOLE"):
+        return u, v
+    if model_name == "SIMPLE_RADIAL":
+        radial = params[0] * r2
+        return u + u * radial, v + v * radial
+    if model_name == "RADIAL":
+        radial = params[0] * r2 + params[1] * r2 * r2
+        return u + u * radial, v + v * radial
+    if model_name in ("OPENCV", "FULL_OPENCV"):
+        k1, k2, p1, p2 = params[:4]
+        if model_name == "OPENCV":
+            radial = 1.0 + k1 * r2 + k2 * r2 ** 2
+        else:
+            k3, k4, k5, k6 = params[4:]
+            radial = ((1.0 + k1 * r2 + k2 * r2 ** 2 + k3 * r2 ** 3)
+                      / (1.0 + k4 * r2 + k5 * r2 ** 2 + k6 * r2 ** 3))
+        return (u * radial + 2.0 * p1 * u * v + p2 * (r2 + 2.0 * u * u),
+                v * radial + 2.0 * p2 * u * v + p1 * (r2 + 2.0 * v * v))
+    if model_name == "FOV":
+        omega = params[0]
+        r = math.sqrt(r2)
+        factor = math.atan(2.0 * r * math.tan(omega / 2.0)) / (omega * r)
+        return u * factor, v * factor
+
+    r = math.sqrt(r2)
+    theta = math.atan(r)
+    if model_name == "THIN_PRISM_FISHEYE":
+        k1, k2, p1, p2, k3, k4, sx1, sy1 = params
+        u, v = u * theta / r, v * theta / r
+        r2 = u * u + v * v
+        radial = k1 * r2 + k2 * r2 ** 2 + k3 * r2 ** 3 + k4 * r2 ** 4
+        return (u + u * radial + 2.0 * p1 * u * v + p2 * (r2 + 2.0 * u * u) + sx1 * r2,
+                v + v * radial + 2.0 * p2 * u * v + p1 * (r2 + 2.0 * v * v) + sy1 * r2)
+
+    theta_d = theta * (1.0 + sum(k * theta ** (2 * i + 2) for i, k in enumerate(params)))
+    return u * theta_d / r, v * theta_d / r
+
+
+def normalized_coordinates(num, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.uniform(-0.6, 0.6, num), rng.uniform(-0.5, 0.5, num)
+
+
+def reconstruction_with_models(model_names, num_images=12, points_per_image=20, seed=0):
+    """Returns a synthetic reconstruction with one camera per model name."""
+    rec = synthetic_reconstruction(num_images, points_per_image,
+                                   num_cameras=len(model_names), seed=seed)
+    return Reconstruction(
+        camera_ids=rec.camera_ids,
+        camera_model_ids=[ CAMERA_MODEL_NAMES[name].model_id for name in model_names ],
+        camera_widths=[ 640 ] * len(model_names),
+        camera_heights=[ 480 ] * len(model_names),
+        camera_params=[ np.array(MODEL_PARAMS[name]) for name in model_names ],
+        image_ids=rec.image_ids,
+        qvecs=rec.qvecs,
+        tvecs=rec.tvecs,
+        image_camera_ids=rec.image_camera_ids,
+        names=rec.names,
+        point2D_offsets=rec.point2D_offsets,
+        xys=rec.xys,
+        point3D_ids=rec.point3D_ids,
+        points3D=rec.points3D,
+    )
+
+
+def reference_projection(rec, image_row, xyz):
+    """Pixel coordinates of a world point in an image, NaN behind the camera."""
+    camera = rec.cameras[int(rec.image_camera_ids[image_row])]
+    point = qvec2rotmat(rec.qvecs[image_row]) @ xyz + rec.tvecs[image_row]
+    if point[2] <= 0:
+        return np.array([np.nan, np.nan])
+    params = list(camera.params)
+    if camera.model in SINGLE_FOCAL_LENGTH_MODELS:
+        params.insert(1, params[0])
+    fx, fy, cx, cy = params[:4]
+    x, y = reference_distort(camera.model, params[4:], point[0] / point[2], point[1] / point[2])
+    return np.array([fx * x + cx, fy * y + cy])
+
+
+@pytest.mark.parametrize("model_name", sorted(MODEL_PARAMS))
+def test_distort_matches_reference(model_name):
+    u, v = normalized_coordinates(50)
+    x, y = distort(model_name, extra_params(model_name), u, v)
+    expected = np.array([ reference_distort(model_name, extra_params(model_name), *uv)
+                          for uv in zip(u, v) ])
+    np.testing.assert_allclose(np.column_stack([x, y]), expected, rtol=1e-12, atol=1e-14)
+
+
+@pytest.mark.parametrize("model_name", ["OPENCV", "FOV", "RADIAL_FISHEYE"])
+def test_distort_with_params_per_coordinate(model_name):
+    u, v = normalized_coordinates(20)
+    params = np.array(extra_params(model_name)) * np.linspace(0.5, 1.5, 20)[:, None]
+    x, y = distort(model_name, params, u, v)
+    for i in range(20):
+        expected = distort(model_name, params[i], u[i:i + 1], v[i:i + 1])
+        np.testing.assert_allclose([x[i], y[i]], np.ravel(expected), rtol=1e-12)
+
+
+def test_distort_at_the_principal_point():
+    for model_name in MODEL_PARAMS:
+        x, y = distort(model_name, extra_params(model_name), np.zeros(1), np.zeros(1))
+        np.testing.assert_allclose([x[0], y[0]], [0.0, 0.0], atol=1e-15)
+
+
+def test_project_points():
+    points = np.array([[1.0, 2.0, 4.0], [0.0, 0.0, 1.0], [1.0, 1.0, -1.0], [1.0, 1.0, 0.0]])
+    projected = project_points("PINHOLE", MODEL_PARAMS["PINHOLE"], points)
+    np.testing.assert_allclose(projected[:2], [[445.0, 495.0], [320.0, 240.0]])
+    assert np.all(np.isnan(projected[2:]))
+
+    # one row of parameters per point
+    params = np.array([MODEL_PARAMS["SIMPLE_RADIAL"]] * 4)
+    params[:, 3] = [0.0, 0.1, 0.2, 0.3]
+    projected = project_points("SIMPLE_RADIAL", params, [[0.5, 0.0, 1.0]] * 4)
+    np.testing.assert_allclose(projected[:, 0], 320.0 + 250.0 * (1.0 + params[:, 3] * 0.25))
+
+
+@pytest.mark.parametrize("max_workers, chunk_size", [(1, 1 << 18), (1, 7), (3, 16)])
+def test_compute_reprojection_errors(max_workers, chunk_size):
+    rec = reconstruction_with_models(["OPENCV", "SIMPLE_RADIAL", "FULL_OPENCV"])
+    rng = np.random.default_rng(1)
+    point3D_rows = { point3D_id: row for row, point3D_id in enumerate(rec.points3D.ids.tolist()) }
+
+    # observations offset from the exact projections by known errors
+    expected = []
+    for image_row in range(rec.num_images):
+        for index in range(rec.point2D_offsets[image_row], rec.point2D_offsets[image_row + 1]):
+            point3D_id = int(rec.point3D_ids[index])
+            if point3D_id < 0:
+                continue
+            xyz = rec.points3D.xyz[point3D_rows[point3D_id]]
+            offset = rng.normal(size=2)
+            projected = reference_projection(rec, image_row, xyz)
+            rec.xys[index] = np.nan_to_num(projected) + offset
+            expected.append(np.nan if np.isnan(projected[0]) else np.linalg.norm(offset))
+
+    result = compute_reprojection_errors(rec, max_workers=max_workers, chunk_size=chunk_size)
+    # points close to the image plane project far outside the image,
+    # where the observations keep fewer significant digits of the errors
+    np.testing.assert_allclose(result.errors, expected, rtol=1e-6, atol=1e-4)
+    assert np.any(np.isnan(result.errors)) and not np.all(np.isnan(result.errors))
+
+    observed = rec.point3D_ids[rec.point2D_offsets[result.image_rows] + result.point2D_idxs]
+    np.testing.assert_array_equal(observed, rec.points3D.ids[result.point3D_rows])
+
+    summary = result.summary()
+    valid = np.array(expected)[~np.isnan(expected)]
+    assert summary["num_observations"] == len(expected)
+    assert summary["num_invalid"] == len(expected) - len(valid)
+    assert summary["rms"] == pytest.approx(np.sqrt(np.mean(valid ** 2)), rel=1e-6)
+
+    per_image = result.per_image()
+    for image_row in range(rec.num_images):
+        errors = result.errors[result.image_rows == image_row]
+        errors = errors[~np.isnan(errors)]
+        assert per_image.count[image_row] == len(errors)
+        if len(errors):
+            assert per_image.mean[image_row] == pytest.approx(errors.mean())
+            assert per_image.median[image_row] == pytest.approx(np.median(errors))
+            assert per_image.max[image_row] == pytest.approx(errors.max())
+    assert len(result.per_point().count) == len(rec.points3D)
+
+
+def test_group_error_stats():
+    groups = np.array([0, 0, 0, 2, 2, 2, 2, 3])
+    errors = np.array([3.0, 1.0, 2.0, 4.0, 1.0, np.nan, 2.0, np.nan])
+    stats = group_error_stats(groups, errors, 5)
+    np.testing.assert_array_equal(stats.count, [3, 0, 3, 0, 0])
+    np.testing.assert_allclose(stats.mean, [2.0, np.nan, 7.0 / 3.0, np.nan, np.nan])
+    np.testing.assert_allclose(stats.rms, [np.sqrt(14.0 / 3.0), np.nan, np.sqrt(7.0), np.nan, np.nan])
+    np.testing.assert_allclose(stats.median, [2.0, np.nan, 2.0, np.nan, np.nan])
+    np.testing.assert_allclose(stats.max, [3.0, np.nan, 4.0, np.nan, np.nan])
+
+    stats = group_error_stats(np.array([1, 1]), np.array([1.0, 4.0]), 2)
+    np.testing.assert_allclose(stats.median, [np.nan, 2.5])
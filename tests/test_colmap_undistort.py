@@ -0,0 +1,137 @@
+import numpy as np
+import pytest
+
+from ff_tools.colmap import undistort
+from ff_tools.colmap.projection import distort
+from ff_tools.colmap.undistort import (
+    camera_key,
+    clear_undistortion_map_cache,
+    compute_undistortion_map,
+    get_undistortion_map,
+    remap,
+    undistort_image,
+    undistort_normalized,
+    undistort_points,
+    undistorted_camera,
+)
+from ff_tools.colmap.utils import Camera
+
+from test_colmap_projection import MODEL_PARAMS, extra_params, normalized_coordinates
+
+
+ROUND_TRIP_MODELS = ["SIMPLE_RADIAL", "RADIAL", "OPENCV", "OPENCV_FISHEYE", "FULL_OPENCV", "FOV"]
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    clear_undistortion_map_cache()
+    yield
+    clear_undistortion_map_cache()
+
+
+def create_camera(model_name, scale=1.0):
+    """Returns a 640 x 480 camera of the model, with the distortion parameters scaled."""
+    params = np.array(MODEL_PARAMS[model_name])
+    num_extra = len(extra_params(model_name))
+    params[len(params) - num_extra:] *= scale
+    return Camera(id=1, model=model_name, width=640, height=480, params=params)
+
+
+@pytest.mark.parametrize("model_name", ROUND_TRIP_MODELS)
+def test_undistort_normalized_round_trip(model_name):
+    u, v = normalized_coordinates(500)
+    x, y = distort(model_name, extra_params(model_name), u, v)
+    assert np.max(np.hypot(x - u, y - v)) > 1e-3
+
+    result_u, result_v = undistort_normalized(model_name, extra_params(model_name), x, y)
+    np.testing.assert_allclose(result_u, u, atol=1e-9)
+    np.testing.assert_allclose(result_v, v, atol=1e-9)
+
+
+@pytest.mark.parametrize("model_name", ROUND_TRIP_MODELS)
+def test_undistortion_map_round_trip(model_name):
+    camera = create_camera(model_name)
+    target = undistorted_camera(camera)
+    assert target.model == "PINHOLE"
+    grid = compute_undistortion_map(camera, target)
+    assert grid.shape == (target.height, target.width, 2)
+    assert grid.dtype == np.float32
+
+    # without blank pixels, all pixels of the target sample the distorted image
+    assert grid[..., 0].min() >= -0.5 - 1e-3 and grid[..., 0].max() <= camera.width - 0.5 + 1e-3
+    assert grid[..., 1].min() >= -0.5 - 1e-3 and grid[..., 1].max() <= camera.height - 0.5 + 1e-3
+
+    # undistorting the sampled pixel centers gives the pixel centers of the target,
+    # offset by the difference of the principal points
+    rows, cols = np.mgrid[0:target.height:37, 0:target.width:41]
+    undistorted = undistort_points(camera, grid[rows, cols].reshape(-1, 2) + 0.5)
+    offset = camera.params[-len(extra_params(model_name)) - 2:][:2] - target.params[2:]
+    expected = np.column_stack([cols.ravel(), rows.ravel()]) + 0.5 + offset
+    np.testing.assert_allclose(undistorted, expected, atol=1e-3)
+
+
+def test_undistorted_camera_with_blank_pixels():
+    camera = create_camera("OPENCV", scale=4.0)
+    inner = undistorted_camera(camera, blank_pixels=0.0)
+    outer = undistorted_camera(camera, blank_pixels=1.0)
+    assert outer.width > inner.width and outer.height > inner.height
+    np.testing.assert_array_equal(outer.params[:2], camera.params[:2])
+
+    limited = undistorted_camera(camera, blank_pixels=1.0, max_scale=1.01)
+    assert limited.width <= 647 and limited.height <= 485
+
+
+def test_get_undistortion_map_caches_on_disk(tmp_path):
+    camera = create_camera("OPENCV")
+    grid, target = get_undistortion_map(camera, cache_dir=tmp_path)
+    paths = list(tmp_path.glob("*.npy"))
+    assert [ path.name for path in paths ] == [ f"{undistort.undistortion_map_key(camera, target)}.npy" ]
+    assert paths[0].name.startswith(camera_key(camera))
+    assert isinstance(grid, np.memmap)
+    np.testing.assert_array_equal(grid, compute_undistortion_map(camera, target))
+
+    # cameras with the same model, size and parameters share the map
+    other = Camera(id=2, model=camera.model, width=640, height=480, params=camera.params.copy())
+    assert get_undistortion_map(other, cache_dir=tmp_path)[0] is grid
+
+    clear_undistortion_map_cache()
+    loaded, loaded_target = get_undistortion_map(camera, cache_dir=tmp_path)
+    assert isinstance(loaded, np.memmap) and loaded is not grid
+    np.testing.assert_array_equal(loaded, grid)
+    assert camera_key(loaded_target) == camera_key(target)
+
+
+def test_caches_are_bounded(monkeypatch):
+    monkeypatch.setattr(undistort, "MAX_CACHED_MAPS", 2)
+    cameras = [ create_camera("SIMPLE_RADIAL", scale) for scale in (0.5, 1.0, 1.5, 2.0) ]
+    for camera in cameras:
+        get_undistortion_map(camera)
+    assert len(undistort._map_cache) == 2
+    assert list(undistort._target_cache) == [ camera_key(camera) for camera in cameras[2:] ]
+
+
+def test_remap():
+    image = np.arange(12, dtype=np.float32).reshape(3, 4)
+    rows, cols = np.mgrid[0:3, 0:4].astype(np.float32)
+    identity = np.stack([cols, rows], axis=-1)
+    np.testing.assert_array_equal(remap(image, identity), image)
+
+    shifted = identity + np.array([0.5, 0.0], dtype=np.float32)
+    np.testing.assert_allclose(remap(image, shifted)[:, :3], image[:, :3] + 0.5)
+
+    # samples more than half a pixel outside the image are filled
+    outside = identity + np.array([0.0, 1.0], dtype=np.float32)
+    result = remap(image, outside, fill_value=-1.0)
+    np.testing.assert_array_equal(result[:2], image[1:])
+    np.testing.assert_array_equal(result[2], -1.0)
+
+    color = np.stack([image, image * 2], axis=-1)
+    np.testing.assert_allclose(remap(color, shifted)[..., 1], remap(image, shifted) * 2)
+
+
+def test_undistort_image():
+    camera = create_camera("SIMPLE_RADIAL")
+    image = np.ones((480, 640, 3), dtype=np.uint8)
+    result, target = undistort_image(image, camera)
+    assert result.shape == (target.height, target.width, 3)
+    np.testing.assert_allclose(result, 1.0)
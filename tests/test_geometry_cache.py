@@ -0,0 +1,159 @@
+from types import SimpleNamespace
+
+import pytest
+
+bpy = pytest.importorskip("bpy")
+
+from ff_tools.geometry import cache
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    cache.unregister_module()
+    cache.reset_stats()
+    yield
+    cache.unregister_module()
+    cache.reset_stats()
+
+
+@pytest.fixture
+def mesh_object():
+    mesh = bpy.data.meshes.new("mesh")
+    mesh.from_pydata([(0, 0, 0), (1, 0, 0), (0, 1, 0)], [], [(0, 1, 2)])
+    obj = bpy.data.objects.new("object", mesh)
+    yield obj
+    bpy.data.objects.remove(obj)
+    bpy.data.meshes.remove(mesh)
+
+
+def update(id, geometry=False, transform=False):
+    return SimpleNamespace(id=id, is_updated_geometry=geometry, is_updated_transform=transform)
+
+
+def send_updates(*updates):
+    cache._on_depsgraph_update(bpy.context.scene, SimpleNamespace(updates=list(updates)))
+
+
+def test_registers_on_first_query():
+    assert not cache.is_registered()
+    assert cache.get(("key",)) is cache.MISSING
+    assert cache.is_registered()
+    assert cache._on_depsgraph_update in bpy.app.handlers.depsgraph_update_post
+    assert cache._on_depsgraph_update in bpy.app.handlers.frame_change_post
+
+    cache.put(("key",), 1)
+    assert cache.get(("key",)) == 1
+    assert cache.get_stats() == { "hits": 1, "misses": 1, "invalidations": 0, "entries": 1 }
+
+    cache.unregister_module()
+    assert cache._on_depsgraph_update not in bpy.app.handlers.depsgraph_update_post
+    assert cache._on_depsgraph_update not in bpy.app.handlers.frame_change_post
+    assert cache.get_stats()["entries"] == 0
+
+
+def test_put_requires_handler():
+    cache.put(("key",), 1)
+    assert cache.get_stats()["entries"] == 0
+    cache.put(("key",), 1, requires_handler=False)
+    assert cache.get_stats()["entries"] == 1
+
+
+def test_get_or_compute():
+    calls = []
+    compute = lambda: calls.append(1) or len(calls)
+    assert cache.get_or_compute(("key",), compute) == 1
+    assert cache.get_or_compute(("key",), compute) == 1
+    assert len(calls) == 1
+    assert cache.get_stats() == { "hits": 1, "misses": 1, "invalidations": 0, "entries": 1 }
+
+
+def test_geometry_and_transform_updates(mesh_object):
+    mesh = mesh_object.data
+    cache.get(("key",))
+    cache.put(("geometry",), 1, geometry=[mesh])
+    cache.put(("transform",), 2, transform=[mesh_object])
+    cache.put(("both",), 3, geometry=[mesh_object, mesh], transform=[mesh_object])
+
+    send_updates(update(mesh, transform=True), update(mesh_object))
+    assert cache.get_stats()["entries"] == 3
+
+    send_updates(update(mesh, geometry=True))
+    assert cache.get(("geometry",)) is cache.MISSING
+    assert cache.get(("transform",)) == 2
+    assert cache.get(("both",)) is cache.MISSING
+    assert cache.get_stats()["invalidations"] == 2
+
+    send_updates(update(mesh_object, transform=True))
+    assert cache.get(("transform",)) is cache.MISSING
+    assert cache.get_stats()["invalidations"] == 3
+    assert cache.get_stats()["entries"] == 0
+
+
+def test_relations_updates(mesh_object):
+    parent = bpy.data.objects.new("parent", None)
+    mesh_object.parent = parent
+    try:
+        cache.get(("key",))
+        cache.put(("hierarchy",), 1, relations=[parent])
+        cache.put(("other",), 2, geometry=[mesh_object.data])
+
+        # moving a child may mean it was parented to the hierarchy
+        send_updates(update(mesh_object, transform=True))
+        assert cache.get(("hierarchy",)) is cache.MISSING
+        assert cache.get(("other",)) == 2
+
+        # any change of collection contents
+        cache.put(("hierarchy",), 1, relations=[parent])
+        send_updates(update(bpy.context.scene.collection))
+        assert cache.get(("hierarchy",)) is cache.MISSING
+        assert cache.get(("other",)) == 2
+    finally:
+        bpy.data.objects.remove(parent)
+
+
+def test_dependents_are_dropped(mesh_object):
+    mesh = mesh_object.data
+    cache.get(("key",))
+    cache.put(("a",), 1, geometry=[mesh_object, mesh], relations=[mesh_object])
+    cache.put(("b",), 2, geometry=[mesh])
+
+    send_updates(update(mesh_object, geometry=True))
+    assert cache.get(("a",)) is cache.MISSING
+    assert cache._dependents == { (mesh.session_uid, cache.GEOMETRY): { ("b",) } }
+
+    # replaced entries drop their previous dependencies
+    cache.put(("b",), 3, transform=[mesh_object])
+    assert cache._dependents == { (mesh_object.session_uid, cache.TRANSFORM): { ("b",) } }
+
+    cache.clear("b")
+    assert cache._dependents == {}
+    assert cache._dependencies == {}
+
+
+def test_eviction_drops_dependents(mesh_object, monkeypatch):
+    monkeypatch.setattr(cache, "MAX_CACHED_ENTRIES", 2)
+    cache.get(("key",))
+    for i in range(3):
+        cache.put(("entry", i), i, geometry=[mesh_object])
+
+    assert cache.get(("entry", 0)) is cache.MISSING
+    assert cache._dependents == { (mesh_object.session_uid, cache.GEOMETRY): { ("entry", 1), ("entry", 2) } }
+
+
+def test_depsgraph_update(mesh_object):
+    bpy.context.scene.collection.objects.link(mesh_object)
+    bpy.context.view_layer.update()
+
+    cache.get(("key",))
+    cache.put(("geometry",), 1, geometry=[mesh_object.data])
+    cache.put(("transform",), 2, transform=[mesh_object])
+
+    mesh_object.data.vertices[0].co.x = 2.0
+    mesh_object.data.update()
+    bpy.context.view_layer.update()
+    assert cache.get(("geometry",)) is cache.MISSING
+    assert cache.get(("transform",)) == 2
+
+    mesh_object.location.x = 1.0
+    bpy.context.view_layer.update()
+    assert cache.get(("transform",)) is cache.MISSING
@@ -0,0 +1,134 @@
+import numpy as np
+import pytest
+
+bpy = pytest.importorskip("bpy")
+
+from ff_tools.geometry import cache
+from ff_tools.geometry.inspect import get_bounding_box, get_hull_points
+
+
+@pytest.fixture(autouse=True)
+def empty_scene():
+    bpy.ops.wm.read_factory_settings(use_empty=True)
+    cache.unregister_module()
+    yield
+    cache.unregister_module()
+
+
+def create_cube(name="cube", size=1.0):
+    corners = [ (x, y, z) for x in (-size, size) for y in (-size, size) for z in (-size, size) ]
+    # an interior vertex, which is not a hull point
+    mesh = bpy.data.meshes.new(name)
+    mesh.from_pydata(corners + [ (0.0, 0.0, 0.0) ], [], [])
+    obj = bpy.data.objects.new(name, mesh)
+    bpy.context.scene.collection.objects.link(obj)
+    return obj
+
+
+def hull_max(obj):
+    return get_hull_points(obj).max(axis=0)
+
+
+def test_hull_points():
+    obj = create_cube()
+    points = get_hull_points(obj)
+    assert len(points) == 8
+    np.testing.assert_allclose(np.abs(points), 1.0)
+    assert get_hull_points(obj) is points
+
+
+def test_hull_follows_moved_vertices():
+    obj = create_cube()
+    np.testing.assert_allclose(hull_max(obj), [ 1.0, 1.0, 1.0 ])
+
+    obj.data.vertices[7].co = (3.0, 1.0, 1.0)
+    obj.data.update()
+    np.testing.assert_allclose(hull_max(obj), [ 3.0, 1.0, 1.0 ])
+
+
+def test_hull_follows_shape_keys():
+    obj = create_cube()
+    obj.shape_key_add(name="Basis")
+    key = obj.shape_key_add(name="key")
+    key.data[7].co = (1.0, 1.0, 5.0)
+    key.value = 0.0
+    np.testing.assert_allclose(hull_max(obj), [ 1.0, 1.0, 1.0 ])
+
+    key.value = 0.5
+    np.testing.assert_allclose(hull_max(obj), [ 1.0, 1.0, 3.0 ])
+
+
+def test_hull_follows_modifier_parameters():
+    obj = create_cube()
+    modifier = obj.modifiers.new("displace", 'DISPLACE')
+    modifier.direction = 'X'
+    modifier.strength = 1.0
+    # without texture, vertices are displaced by (1 - mid_level) * strength
+    np.testing.assert_allclose(hull_max(obj), [ 1.5, 1.0, 1.0 ])
+
+    modifier.strength = 4.0
+    np.testing.assert_allclose(hull_max(obj), [ 3.0, 1.0, 1.0 ])
+
+
+def test_hull_follows_armature_pose():
+    obj = create_cube()
+    armature = bpy.data.objects.new("armature", bpy.data.armatures.new("armature"))
+    bpy.context.scene.collection.objects.link(armature)
+    bpy.context.view_layer.objects.active = armature
+    bpy.ops.object.mode_set(mode='EDIT')
+    bone = armature.data.edit_bones.new("bone")
+    bone.head, bone.tail = (0.0, 0.0, 0.0), (0.0, 1.0, 0.0)
+    bpy.ops.object.mode_set(mode='OBJECT')
+
+    modifier = obj.modifiers.new("armature", 'ARMATURE')
+    modifier.object = armature
+    obj.vertex_groups.new(name="bone").add(list(range(9)), 1.0, 'REPLACE')
+    np.testing.assert_allclose(hull_max(obj), [ 1.0, 1.0, 1.0 ], atol=1e-6)
+
+    # bones translate along their local axes, the bone's y axis is the world y axis
+    armature.pose.bones["bone"].location = (0.0, 2.0, 0.0)
+    np.testing.assert_allclose(hull_max(obj), [ 1.0, 3.0, 1.0 ], atol=1e-6)
+
+
+def test_hull_follows_animation():
+    obj = create_cube()
+    modifier = obj.modifiers.new("displace", 'DISPLACE')
+    modifier.direction = 'Z'
+    modifier.strength = 0.0
+    modifier.keyframe_insert("strength", frame=1)
+    modifier.strength = 4.0
+    modifier.keyframe_insert("strength", frame=5)
+
+    bpy.context.scene.frame_set(1)
+    np.testing.assert_allclose(hull_max(obj), [ 1.0, 1.0, 1.0 ])
+    bpy.context.scene.frame_set(5)
+    np.testing.assert_allclose(hull_max(obj), [ 1.0, 1.0, 3.0 ])
+
+
+def test_shared_mesh_hull():
+    obj = create_cube()
+    other = bpy.data.objects.new("other", obj.data)
+    bpy.context.scene.collection.objects.link(other)
+    assert get_hull_points(other) is get_hull_points(obj)
+
+    modifier = other.modifiers.new("displace", 'DISPLACE')
+    modifier.direction = 'X'
+    np.testing.assert_allclose(hull_max(other), [ 1.5, 1.0, 1.0 ])
+    np.testing.assert_allclose(hull_max(obj), [ 1.0, 1.0, 1.0 ])
+
+
+def test_exact_bounding_box():
+    obj = create_cube()
+    obj.location = (1.0, 0.0, 0.0)
+    obj.rotation_euler = (0.0, 0.0, np.pi / 4)
+    bpy.context.view_layer.update()
+
+    box_min, box_max = get_bounding_box(obj, exact=True)
+    np.testing.assert_allclose(box_max, [ 1.0 + np.sqrt(2.0), np.sqrt(2.0), 1.0 ], atol=1e-6)
+    np.testing.assert_allclose(box_min, [ 1.0 - np.sqrt(2.0), -np.sqrt(2.0), -1.0 ], atol=1e-6)
+
+    obj.data.vertices[0].co = (-1.0, -1.0, -3.0)
+    obj.data.update()
+    bpy.context.view_layer.update()
+    box_min, _ = get_bounding_box(obj, exact=True)
+    assert box_min[2] == pytest.approx(-3.0)
@@ -0,0 +1,227 @@
+import numpy as np
+import pytest
+
+bpy = pytest.importorskip("bpy")
+
+from ff_tools.geometry.benchmark import grid_mesh_arrays
+from ff_tools.geometry.mesh_quality import (
+    MeshArrays,
+    analyze_mesh_arrays,
+    analyze_object,
+    _count_components,
+    _count_duplicates,
+)
+
+
+TETRAHEDRON = [ (0.0, 0.0, 0.0), (1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.0, 0.0, 1.0) ]
+# counter-clockwise seen from outside
+TETRAHEDRON_FACES = [ (0, 2, 1), (0, 1, 3), (1, 2, 3), (0, 3, 2) ]
+
+
+def mesh_arrays(positions, faces, uvs=None, materials=None, loose_edges=()):
+    """Creates the arrays of a mesh with the given faces, with edges
+    numbered by their sorted vertex pairs, as read_mesh_arrays would."""
+    loop_vertices = np.array([ v for face in faces for v in face ], dtype=np.int64)
+    loop_total = np.array([ len(face) for face in faces ], dtype=np.int64)
+    loop_start = np.cumsum(loop_total) - loop_total
+    loop_pairs = [ tuple(sorted((face[i], face[(i + 1) % len(face)])))
+                   for face in faces for i in range(len(face)) ]
+    edges = sorted(set(loop_pairs) | set(loose_edges))
+    if materials is None:
+        materials = [ 0 ] * len(faces)
+
+    return MeshArrays(
+        positions=np.array(positions, dtype=np.float64).reshape(-1, 3),
+        edge_vertices=np.array(edges, dtype=np.int64).reshape(-1, 2),
+        loop_start=loop_start,
+        loop_total=loop_total,
+        material_indices=np.array(materials, dtype=np.int64),
+        loop_vertices=loop_vertices,
+        loop_edges=np.array([ edges.index(pair) for pair in loop_pairs ], dtype=np.int64),
+        uvs=np.array(uvs, dtype=np.float64) if uvs is not None else None,
+    )
+
+
+def count_clusters(positions, merge_distance):
+    """Number of clusters of vertices within merge_distance, by comparing all pairs."""
+    parents = list(range(len(positions)))
+
+    def find(i):
+        while parents[i] != i:
+            i = parents[i]
+        return i
+
+    distances = np.linalg.norm(positions[:, None] - positions[None], axis=2)
+    for i, j in zip(*np.nonzero(distances <= merge_distance)):
+        parents[find(i)] = find(j)
+    return sum(1 for i in range(len(positions)) if find(i) == i)
+
+
+def test_closed_mesh():
+    report = analyze_mesh_arrays(mesh_arrays(TETRAHEDRON, TETRAHEDRON_FACES))
+    assert (report.vertices, report.edges, report.faces) == (4, 6, 4)
+    assert report.boundary_edges == 0
+    assert report.non_manifold_edges == 0
+    assert report.inconsistent_edges == 0
+    assert report.inward_normals is False
+    assert report.mesh_islands == 1
+    assert report.uv_islands is None
+
+
+def test_inward_normals():
+    faces = [ face[::-1] for face in TETRAHEDRON_FACES ]
+    report = analyze_mesh_arrays(mesh_arrays(TETRAHEDRON, faces))
+    assert report.inconsistent_edges == 0
+    assert report.inward_normals is True
+
+
+def test_inconsistent_edges():
+    faces = list(TETRAHEDRON_FACES)
+    faces[0] = faces[0][::-1]
+    report = analyze_mesh_arrays(mesh_arrays(TETRAHEDRON, faces))
+    assert report.inconsistent_edges == 3
+    assert report.inward_normals is None
+    assert report.mesh_islands == 1
+
+
+def test_boundary_and_loose_edges():
+    arrays = mesh_arrays(TETRAHEDRON + [ (5.0, 5.0, 5.0) ], TETRAHEDRON_FACES[1:],
+                         loose_edges=[ (3, 4) ])
+    report = analyze_mesh_arrays(arrays)
+    assert report.boundary_edges == 3
+    assert report.loose_edges == 1
+    assert report.non_manifold_edges == 0
+    assert report.inward_normals is None
+
+
+def test_non_manifold_edges():
+    # three triangles sharing the edge (0, 1)
+    positions = [ (0, 0, 0), (1, 0, 0), (0, 1, 0), (0, -1, 0), (0, 0, 1) ]
+    faces = [ (0, 1, 2), (1, 0, 3), (0, 1, 4) ]
+    report = analyze_mesh_arrays(mesh_arrays(positions, faces))
+    assert report.non_manifold_edges == 1
+    assert report.boundary_edges == 6
+    assert report.mesh_islands == 1
+
+
+def test_degenerate_faces_and_mixed_sizes():
+    positions = [ (0, 0, 0), (2, 0, 0), (2, 1, 0), (0, 1, 0), (4, 0, 0), (6, 0, 0) ]
+    faces = [ (0, 1, 2, 3), (1, 4, 2), (1, 4, 5) ]
+    report = analyze_mesh_arrays(mesh_arrays(positions, faces))
+    assert report.degenerate_faces == 1
+    assert report.materials[0].area == pytest.approx(3.0)
+
+
+def test_islands():
+    square = [ (0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0) ]
+    positions = square + [ (x + 2, y, z) for x, y, z in square ]
+    faces = [ (0, 1, 2), (0, 2, 3), (4, 5, 6) ]
+    report = analyze_mesh_arrays(mesh_arrays(positions, faces))
+    assert report.mesh_islands == 2
+
+
+def test_uv_islands():
+    positions = [ (0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0) ]
+    faces = [ (0, 1, 2), (0, 2, 3) ]
+    uvs = [ (0, 0), (1, 0), (1, 1), (0, 0), (1, 1), (0, 1) ]
+    report = analyze_mesh_arrays(mesh_arrays(positions, faces, uvs))
+    assert report.mesh_islands == 1
+    assert report.uv_islands == 1
+
+    # a seam along the shared edge
+    seam = uvs[:3] + [ (2, 0), (3, 1), (2, 1) ]
+    report = analyze_mesh_arrays(mesh_arrays(positions, faces, seam))
+    assert report.uv_islands == 2
+
+    # UVs within the tolerance still match
+    close = uvs[:3] + [ (1e-6, 0), (1, 1), (0, 1) ]
+    report = analyze_mesh_arrays(mesh_arrays(positions, faces, close))
+    assert report.uv_islands == 1
+
+    # faces traversing the shared edge in the same direction
+    flipped = [ (0, 1, 2), (0, 3, 2) ]
+    flipped_uvs = uvs[:3] + [ (0, 0), (0, 1), (1, 1) ]
+    report = analyze_mesh_arrays(mesh_arrays(positions, flipped, flipped_uvs))
+    assert report.inconsistent_edges == 1
+    assert report.uv_islands == 1
+
+
+def test_grid_islands():
+    report = analyze_mesh_arrays(grid_mesh_arrays(12, num_materials=3, uv_tiles=3))
+    assert report.faces == 288
+    assert report.boundary_edges == 48
+    assert report.inconsistent_edges == 0
+    assert report.mesh_islands == 1
+    assert report.uv_islands == 9
+    assert [ material.faces for material in report.materials ] == [ 96, 96, 96 ]
+    assert sum(material.area for material in report.materials) == pytest.approx(144.0)
+
+
+def test_material_areas():
+    positions = [ (0, 0, 0), (2, 0, 0), (2, 2, 0), (0, 2, 0), (4, 0, 0), (4, 2, 0) ]
+    faces = [ (0, 1, 2, 3), (1, 4, 5, 2) ]
+    uvs = [ (0, 0), (1, 0), (1, 1), (0, 1), (0, 0), (0.5, 0), (0.5, 0.5), (0, 0.5) ]
+    report = analyze_mesh_arrays(mesh_arrays(positions, faces, uvs, materials=[ 0, 2 ]))
+    assert [ material.index for material in report.materials ] == [ 0, 2 ]
+    assert [ material.area for material in report.materials ] == pytest.approx([ 4.0, 4.0 ])
+    assert [ material.uv_area for material in report.materials ] == pytest.approx([ 1.0, 0.25 ])
+
+
+def test_texel_density():
+    bpy.ops.wm.read_factory_settings(use_empty=True)
+    mesh = bpy.data.meshes.new("mesh")
+    mesh.from_pydata([ (0, 0, 0), (2, 0, 0), (2, 2, 0), (0, 2, 0), (4, 0, 0), (4, 2, 0) ], [],
+                     [ (0, 1, 2, 3), (1, 4, 5, 2) ])
+    uv_layer = mesh.uv_layers.new()
+    uv_layer.data.foreach_set("uv", [ 0, 0, 1, 0, 1, 1, 0, 1, 0, 0, 0.5, 0, 0.5, 0.5, 0, 0.5 ])
+    for name in ("a", "b"):
+        mesh.materials.append(bpy.data.materials.new(name))
+    mesh.polygons[1].material_index = 1
+    obj = bpy.data.objects.new("object", mesh)
+
+    report = analyze_object(obj, texture_size=1024)
+    assert [ material.name for material in report.materials ] == [ "a", "b" ]
+    assert report.materials[0].texel_density == pytest.approx(512.0)
+    assert report.materials[1].texel_density == pytest.approx(256.0)
+
+
+@pytest.mark.parametrize("merge_distance", [ 0.0, 0.01, 0.1 ])
+def test_duplicates_match_brute_force(merge_distance):
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        # clusters of vertices, some of them coincident
+        centers = rng.random((20, 3))
+        positions = np.repeat(centers, 5, axis=0) + rng.normal(0, 0.02, (100, 3))
+        positions[::7] = positions[1::7][:len(positions[::7])]
+        expected = len(positions) - count_clusters(positions, merge_distance)
+        assert _count_duplicates(positions, merge_distance) == expected
+
+
+def test_duplicates_across_cell_borders():
+    # cells are merge_distance wide, the pairs straddle the borders
+    # between cells at (1, 0, 0) and (0, 1, 0), and at (5, 5, 5) and (4, 4, 4)
+    positions = np.array([
+        (0.1001, 0.0999, 0.0), (0.0999, 0.1001, 0.0),
+        (0.5001, 0.5001, 0.5001), (0.4999, 0.4999, 0.4999),
+        (0.9, 0.9, 0.9),
+    ])
+    assert _count_duplicates(positions, 0.1) == 2
+    assert _count_duplicates(positions, 0.0001) == 0
+
+    # chains of vertices are merged, even if their ends are further apart
+    chain = np.column_stack([ np.arange(10) * 0.09, np.zeros(10), np.zeros(10) ])
+    assert _count_duplicates(chain, 0.1) == 9
+
+
+def test_duplicates_of_signed_zeros_and_nans():
+    positions = np.array([ (0.0, 0.0, 0.0), (-0.0, 0.0, -0.0), (np.nan, 0.0, 0.0), (1.0, 1.0, 1.0) ])
+    assert _count_duplicates(positions, 0.0) == 1
+    assert _count_duplicates(positions, 0.1) == 1
+
+
+def test_count_components():
+    assert _count_components(5, np.array([], dtype=np.int64), np.array([], dtype=np.int64)) == 5
+    # a path visited from its end, and a separate pair
+    nodes1 = np.array([ 4, 3, 2, 6 ])
+    nodes2 = np.array([ 3, 2, 1, 5 ])
+    assert _count_components(8, nodes1, nodes2) == 4